@@ -3,355 +3,3213 @@
 # ============================================
 
 # IMPORT CÁC THƯ VIỆN CẦN THIẾT
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, g, has_request_context, make_response, get_template_attribute, stream_with_context, send_file, abort
+from markupsafe import Markup  # HTML đã render (không escape lại khi chèn vào template)
+from werkzeug.http import is_resource_modified  # Kiểm tra If-None-Match / If-Modified-Since
+from werkzeug.security import safe_join  # Đường dẫn ảnh bìa trong thư mục static không thoát ra ngoài
 import os
 DATABASE_URL = os.environ.get('DATABASE_URL')  # Lấy URL database từ biến môi trường (dùng khi deploy)
 import psycopg2  # Thư viện kết nối PostgreSQL
 import psycopg2.extras  # Thư viện hỗ trợ thao tác nâng cao với PostgreSQL
 from psycopg2 import errors  # Import các lỗi của PostgreSQL
-from datetime import datetime, timedelta  # Xử lý ngày tháng
+from datetime import datetime, date, timedelta  # Xử lý ngày tháng
 from abc import ABC, abstractmethod  # Tạo class trừu tượng (Abstract Base Class)
-from functools import wraps  # Dùng để tạo decorator
-import os
+from functools import wraps, lru_cache  # Dùng để tạo decorator, nhớ fingerprint câu SQL
+import threading  # Khóa (lock) cho pool kết nối dùng chung giữa các thread
+import time  # Đo thời gian chờ kết nối
+import base64  # Mã hóa cursor phân trang
+import re  # Tách từ khóa tìm kiếm
+import unicodedata  # Bỏ dấu tiếng Việt khi tìm kiếm
+import bisect  # Tìm kiếm nhị phân trên chỉ mục gợi ý
+import zlib  # Tạo khóa advisory lock từ tên job
+import click  # Lệnh CLI (flask run-job ...)
+import random  # Chọn slot ngẫu nhiên cho bộ đếm thống kê
+import itertools  # Chia lượt đọc vòng tròn cho các read replica
+from collections import deque, OrderedDict, Counter  # Hàng đợi giới hạn độ dài, dict có thứ tự (LRU), đếm bản sách
+import select  # Chờ NOTIFY từ PostgreSQL
+import csv  # Đọc / ghi CSV khi nhập sách hàng loạt
+import io  # Bộ đệm COPY trong bộ nhớ
+import json  # Đọc file JSONL khi nhập sách hàng loạt
+import tempfile  # Giữ file upload trong lúc nhập
+import logging  # Ghi log có cấp độ (thay cho print)
+import logging.handlers  # Ghi log qua hàng đợi + thread nền
+import queue  # Hàng đợi bản ghi log
+import atexit  # Ghi nốt log còn trong hàng đợi khi thoát
+import sys  # Tìm method đã gọi câu SQL chậm
+import sqlite3  # Engine nhúng cho kiosk 1 máy / CI (DB_ENGINE=sqlite)
+import hashlib  # Tên file ảnh bìa theo nội dung
+import hmac  # So sánh token /metrics trong thời gian không đổi
+import urllib.request  # Tải ảnh bìa gốc
+import urllib.parse  # Kiểm tra host của URL ảnh bìa
+import http.client  # Kết nối tải ảnh bìa chỉ tới địa chỉ public
+import socket  # Phân giải tên miền ảnh bìa
+import ipaddress  # Chặn địa chỉ nội bộ (SSRF)
+import concurrent.futures  # Pool thread xử lý ảnh bìa
+from PIL import Image, ImageOps  # Thu nhỏ ảnh bìa (Pillow)
 from dotenv import load_dotenv 
 
+# Đọc .env 1 lần cho cả process (trước khi các class đọc cấu hình từ biến môi trường)
+load_dotenv()
+
 # KHỞI TẠO ỨNG DỤNG FLASK
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', 'default_fallback_key')  # Khóa bí mật cho session
 
+class StructuredFormatter(logging.Formatter):
+    """
+    ĐỊNH DẠNG LOG: 1 dòng / bản ghi, các trường thêm (extra={...}) in dạng key=value
+    - LOG_FORMAT=json -> mỗi dòng là 1 object JSON (cho hệ thống gom log)
+    """
+
+    # Thuộc tính có sẵn của LogRecord (không phải trường do người gọi thêm vào)
+    RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'taskName'}
+
+    def __init__(self, as_json=False):
+        super().__init__()
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = {k: v for k, v in vars(record).items() if k not in self.RESERVED}
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            **fields,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if self.as_json:
+            return json.dumps(entry, ensure_ascii=False, default=str)
+
+        line = f"{entry['time']} {record.levelname:<7} {record.name}: {entry['message']}"
+        if fields:
+            line += ' ' + ' '.join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += '\n' + entry['exception']
+        return line
+
+
+def configure_logging():
+    """
+    CẤU HÌNH LOGGER 'library' (LOG_LEVEL=DEBUG/INFO/WARNING/ERROR, mặc định INFO)
+    - Thread gọi log chỉ đẩy bản ghi vào hàng đợi; 1 thread nền định dạng và ghi ra stderr
+      -> request không phải chờ I/O của console
+    - Gọi lại trong process con sau khi fork (thread ghi log không đi theo fork)
+    """
+    handler = logging.StreamHandler()
+    handler.setFormatter(StructuredFormatter(as_json=os.environ.get('LOG_FORMAT', 'text') == 'json'))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+
+    logger = logging.getLogger('library')
+    logger.handlers[:] = [logging.handlers.QueueHandler(records)]
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+log = configure_logging()
+
 # ============================================
 # PHẦN 1: CÁC CLASS OOP
 # ============================================
 
-class DatabaseManager:
+class Metrics:
     """
-    QUẢN LÝ DATABASE (LOCAL + RENDER + NEON)
-    - Ưu tiên Local → Render → Neon
+    SỐ LIỆU ĐO ĐẠC KIỂU PROMETHEUS (histogram + counter), an toàn đa luồng
+    - Mỗi worker đếm trong bộ nhớ (observe/inc chỉ tốn 1 lần khóa, không I/O)
+    - Thread nền ghi snapshot của worker ra METRICS_DIR mỗi METRICS_FLUSH_INTERVAL giây;
+      /metrics ở bất kỳ worker nào cũng gộp snapshot của mọi worker cùng process cha gunicorn
+      (số của worker khác có thể trễ tối đa 1 chu kỳ ghi)
     """
 
-    LOCAL_DB_CONFIG = {
-        'dbname': "library_db",
-        'user': "admin",
-        'password': "1234",
-        'host': "localhost",
-        'port': "5432"
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+
+    # Tên -> (loại, mô tả)
+    DEFINITIONS = {
+        'library_http_request_duration_seconds': ('histogram', 'Thời gian xử lý request theo route'),
+        'library_db_query_duration_seconds': ('histogram', 'Thời gian chạy câu SQL theo fingerprint'),
+        'library_db_query_rows_total': ('counter', 'Số dòng trả về / bị ảnh hưởng theo fingerprint'),
+        'library_db_connection_acquire_seconds': ('histogram', 'Thời gian mượn kết nối từ pool (kể cả mở mới)'),
+        'library_db_reads_total': ('counter', 'Số lần mượn kết nối đọc theo nơi đọc (replica / primary) và lý do'),
     }
 
-    def __init__(self):
-        print(" Khởi tạo DatabaseManager...")
-        load_dotenv()  # Đọc .env
+    def __init__(self, directory=None):
+        self.directory = directory or os.environ.get('METRICS_DIR') or os.path.join(
+            tempfile.gettempdir(), f"library-metrics-{os.getppid()}")
+        self._lock = threading.Lock()
+        self._histograms = {}   # (tên, nhãn) -> [số đếm từng bucket..., +Inf, tổng]
+        self._counters = {}     # (tên, nhãn) -> giá trị
+        self._thread = None
 
-        self.DATABASE_URL_RENDER = os.getenv("DATABASE_URL_RENDER")
-        self.DATABASE_URL_NEON = os.getenv("DATABASE_URL_NEON")
-        self.active_db = None
+    def observe(self, name, labels, value):
+        """Ghi 1 giá trị vào histogram; labels là tuple các cặp (tên nhãn, giá trị)"""
+        index = bisect.bisect_left(self.BUCKETS, value)
+        with self._lock:
+            bins = self._histograms.get((name, labels))
+            if bins is None:
+                bins = self._histograms[(name, labels)] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            bins[index] += 1
+            bins[-1] += value
 
-    def get_connection(self):
+    def inc(self, name, labels, value=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + value
+
+    @staticmethod
+    @lru_cache(maxsize=2048)
+    def normalize(sql):
         """
-        Tự động kết nối: Local → Render → Neon
+        CHUẨN HÓA CÂU SQL ĐỂ GOM NHÓM: bỏ comment, thay tham số / hằng số bằng ?, gộp khoảng trắng
+        - Trả về (câu đã chuẩn hóa, mã crc32)
         """
-        # 1️.Local
-        try:
-            conn = psycopg2.connect(**self.LOCAL_DB_CONFIG)
-            self.active_db = "local"
-            print("Kết nối LOCAL thành công (demo cá nhân).")
-            return conn
-        except Exception as e:
-            print("Local DB không khả dụng:", e)
+        text = re.sub(r'--[^\n]*', ' ', sql)
+        text = re.sub(r"'(?:[^']|'')*'", '?', text)
+        text = re.sub(r'%\(\w+\)s|%s|\b\d+(?:\.\d+)?\b', '?', text)
+        text = ' '.join(text.split())
+        return text, format(zlib.crc32(text.encode()), '08x')
 
-          # 2. Render
+    def record_query(self, sql, seconds, rows):
+        """
+        Ghi nhận 1 câu SQL (gọi từ cursor có đo đạc)
+        - Nhãn chỉ là mã crc32 của câu đã chuẩn hóa, không đưa nội dung SQL ra /metrics
+          (tra mã -> câu SQL ở trang câu chậm của admin)
+        """
+        _, query_id = self.normalize(sql)
+        labels = (('query', query_id),)
+        self.observe('library_db_query_duration_seconds', labels, seconds)
+        if rows > 0:
+            self.inc('library_db_query_rows_total', labels, rows)
+        if has_request_context():
+            timing = g.get('_timing')
+            if timing is not None:
+                timing['db'] += seconds
+                timing['queries'] += 1
+
+    def record_acquire(self, backend, seconds):
+        """Ghi nhận thời gian mượn kết nối"""
+        self.observe('library_db_connection_acquire_seconds', (('backend', backend),), seconds)
+        if has_request_context():
+            timing = g.get('_timing')
+            if timing is not None:
+                timing['conn'] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'histograms': [[name, list(labels), list(bins)] for (name, labels), bins in self._histograms.items()],
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+            }
+
+    def flush(self):
+        """Ghi snapshot của worker này ra file (ghi file tạm rồi đổi tên -> người đọc không thấy file dở)"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + '.tmp', path)
+
+    def start(self):
+        """Bật thread ghi snapshot định kỳ (gọi nhiều lần cũng chỉ chạy 1 thread)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._flush_loop, name='metrics-flush', daemon=True)
+                self._thread.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                log.warning("Không ghi được snapshot metrics: %s", e)
+
+    def collect(self):
+        """Gộp số liệu của worker này (mới nhất) với snapshot của các worker khác"""
+        snapshots = [self.snapshot()]
+        own = f"{os.getpid()}.json"
         try:
-            if not self.DATABASE_URL_RENDER:
-                raise Exception("Không có DATABASE_URL_RENDER trong .env!")
-            conn = psycopg2.connect(self.DATABASE_URL_RENDER, sslmode='require')
-            self.active_db = "render"
-            print("🌍 Kết nối RENDER PostgreSQL thành công!")
-            return conn
-        except Exception as e:
-            print("⚠️ Render DB không khả dụng:", e)
+            names = [n for n in os.listdir(self.directory) if n.endswith('.json') and n != own]
+        except FileNotFoundError:
+            names = []
+        for filename in names:
+            try:
+                with open(os.path.join(self.directory, filename), encoding='utf-8') as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+
+        histograms, counters = {}, {}
+        for snap in snapshots:
+            for name, labels, bins in snap['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(bins))
+                histograms[key] = [a + b for a, b in zip(total, bins)]
+            for name, labels, value in snap['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+        return histograms, counters
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        def escape(value):
+            return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in (*labels, *extra)) + '}'
+
+    def render(self):
+        """XUẤT DẠNG TEXT CHO PROMETHEUS (text/plain; version=0.0.4)"""
+        histograms, counters = self.collect()
+        lines = []
+        for name, (kind, description) in self.DEFINITIONS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if kind == 'histogram':
+                for (metric, labels), bins in sorted(histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*self.BUCKETS, '+Inf'), bins):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(labels)} {bins[-1]}")
+                    lines.append(f"{name}_count{self._labels(labels)} {cumulative}")
+            else:
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{self._labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
 
-        # 3️.Neon
+    def reset_after_fork(self):
+        """Process con không mang theo số liệu / thread của process cha"""
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._thread = None
+
+
+METRICS = Metrics()
+
+
+class SlowQueryLog:
+    """
+    GHI NHẬN CÂU SQL CHẬM (vượt SLOW_QUERY_MS, mặc định 200ms; 0 = tắt)
+    - Trên request: chỉ ghi 1 dòng log + đẩy vào hàng đợi (không I/O database)
+    - Thread nền gộp theo (câu SQL đã chuẩn hóa, method gọi) rồi upsert vào bảng slow_queries
+      -> mọi worker cùng ghi 1 chỗ, trang admin xếp hạng theo tổng thời gian
+    - 1 phần (SLOW_QUERY_EXPLAIN_RATE) câu SELECT được chạy lại bằng EXPLAIN (ANALYZE, BUFFERS)
+      trong transaction READ ONLY rồi rollback; mỗi câu tối đa 1 lần / SLOW_QUERY_EXPLAIN_INTERVAL giây
+    - Không lưu giá trị tham số (chỉ lưu kiểu); chuỗi trong plan bị thay bằng '?'
+    """
+
+    THRESHOLD = float(os.environ.get('SLOW_QUERY_MS', 200)) / 1000
+    EXPLAIN_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_RATE', 0.1))
+    EXPLAIN_INTERVAL = float(os.environ.get('SLOW_QUERY_EXPLAIN_INTERVAL', 600))
+    EXPLAIN_TIMEOUT = float(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT', 30))
+    QUEUE_SIZE = 1000
+    BATCH_SIZE = 200
+
+    # Chỉ EXPLAIN ANALYZE câu đọc không có tác dụng phụ (ANALYZE chạy thật câu lệnh)
+    EXPLAINABLE = re.compile(r'\s*(SELECT|WITH)\b', re.IGNORECASE)
+    SIDE_EFFECTS = re.compile(r'\b(INSERT|UPDATE|DELETE|pg_\w*advisory\w*|pg_notify|nextval|setval)\b', re.IGNORECASE)
+
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
+        self.dropped = 0
+
+    @staticmethod
+    def params_shape(params):
+        """Mô tả tham số mà không lộ giá trị: {user_id: int, ids: list[50]}"""
+        def kind(value):
+            if isinstance(value, (list, tuple)):
+                return f"{type(value).__name__}[{len(value)}]"
+            return type(value).__name__
+        if params is None:
+            return ''
+        if isinstance(params, dict):
+            return '{' + ', '.join(f"{k}: {kind(v)}" for k, v in params.items()) + '}'
+        return '(' + ', '.join(kind(v) for v in params) + ')'
+
+    @staticmethod
+    def caller(frame):
+        """Method trong app.py đã gọi câu SQL (vd. User.get_borrowed_books)"""
+        while frame is not None and frame.f_code.co_filename != __file__:
+            frame = frame.f_back
+        return frame.f_code.co_qualname if frame is not None else '?'
+
+    def record(self, sql, params, seconds, frame):
+        """Gọi từ cursor có đo đạc khi câu SQL vượt ngưỡng"""
+        if threading.current_thread() is self._thread:
+            return  # Câu của chính thread ghi nhận (upsert / EXPLAIN) thì bỏ qua
+        text, query_id = Metrics.normalize(sql)
+        item = {
+            'query_id': query_id,
+            'query': text,
+            'caller': self.caller(frame),
+            'route': request.endpoint if has_request_context() else None,
+            'params': self.params_shape(params),
+            'ms': seconds * 1000,
+        }
+        log.warning("Câu SQL chậm %.1f ms tại %s", item['ms'], item['caller'],
+                    extra={'query_id': query_id, 'route': item['route'], 'params': item['params']})
+        if not BACKEND.SLOW_QUERIES:
+            return  # Bảng slow_queries + EXPLAIN (ANALYZE, BUFFERS) chỉ có trên PostgreSQL: chỉ ghi log
+        # Giữ câu gốc + tham số chỉ cho mẫu sẽ được EXPLAIN (chỉ dùng trong bộ nhớ, không ghi ra)
+        if random.random() < self.EXPLAIN_RATE and self.EXPLAINABLE.match(sql) and not self.SIDE_EFFECTS.search(sql):
+            item['explain'] = (sql, params)
         try:
-            if not self.DATABASE_URL_NEON:
-                raise Exception("Không có DATABASE_URL_NEON trong .env!")
-            conn = psycopg2.connect(self.DATABASE_URL_NEON, sslmode='require')
-            self.active_db = "neon"
-            print("Kết nối NEON PostgreSQL thành công!")
-            return conn
-        except Exception as e:
-            print("Không thể kết nối Neon DB:", e)
-            raise RuntimeError("Không thể kết nối tới bất kỳ database nào!")
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+            return
+        self.start()
 
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='slow-query-log', daemon=True)
+                self._thread.start()
 
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.save(batch)
+            except errors.UndefinedTable:
+                pass  # Migration 12 chưa chạy (câu chậm lúc khởi động) -> bỏ lô này
+            except Exception as e:
+                log.error("Không ghi được slow_queries: %s", e)
 
-    def init_database(self):
+    def save(self, batch):
+        """Gộp theo (câu, method) rồi upsert; chạy EXPLAIN cho các mẫu đã chọn"""
+        groups = {}
+        for item in batch:
+            key = (item['query_id'], item['caller'])
+            group = groups.setdefault(key, {**item, 'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+            group['calls'] += 1
+            group['total_ms'] += item['ms']
+            group['max_ms'] = max(group['max_ms'], item['ms'])
+            if item.get('explain'):
+                group['explain'] = item['explain']
+
+        conn = DatabaseManager().get_connection()
+        try:
+            cursor = conn.cursor()
+            for (query_id, caller), group in groups.items():
+                cursor.execute('''
+                    INSERT INTO slow_queries (query_id, caller, query, params, route, calls, total_ms, max_ms)
+                    VALUES (%(query_id)s, %(caller)s, %(query)s, %(params)s, %(route)s,
+                            %(calls)s, %(total_ms)s, %(max_ms)s)
+                    ON CONFLICT (query_id, caller) DO UPDATE
+                    SET calls = slow_queries.calls + EXCLUDED.calls,
+                        total_ms = slow_queries.total_ms + EXCLUDED.total_ms,
+                        max_ms = GREATEST(slow_queries.max_ms, EXCLUDED.max_ms),
+                        params = EXCLUDED.params,
+                        route = COALESCE(EXCLUDED.route, slow_queries.route),
+                        last_seen = NOW()
+                    RETURNING plan_at IS NULL OR plan_at < NOW() - make_interval(secs => %(interval)s)
+                ''', {**group, 'interval': self.EXPLAIN_INTERVAL})
+                group['plan_due'] = cursor.fetchone()[0]
+            conn.commit()
+
+            for (query_id, caller), group in groups.items():
+                if group.get('explain') and group['plan_due']:
+                    plan, plan_ms = self.explain(conn, *group['explain'])
+                    cursor = conn.cursor()
+                    cursor.execute('''
+                        UPDATE slow_queries SET plan = %s, plan_ms = %s, plan_at = NOW()
+                        WHERE query_id = %s AND caller = %s
+                    ''', (plan, plan_ms, query_id, caller))
+                    conn.commit()
+        finally:
+            conn.close()
+
+    def explain(self, conn, sql, params):
         """
-        KHỞI TẠO DATABASE: Tạo các bảng và dữ liệu mẫu nếu chưa có
+        CHẠY LẠI CÂU SQL BẰNG EXPLAIN (ANALYZE, BUFFERS)
+        - Transaction READ ONLY + statement_timeout, luôn rollback
+        - Trả về (plan đã che chuỗi hằng, thời gian chạy lại ms); lỗi thì plan là thông báo lỗi
         """
+        cursor = conn.cursor()
+        start = time.perf_counter()
         try:
-            conn = self.get_connection()
-            cursor = conn.cursor()
+            cursor.execute("SET TRANSACTION READ ONLY")
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)", (f"{int(self.EXPLAIN_TIMEOUT * 1000)}ms",))
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+            plan = re.sub(r"'(?:[^']|'')*'", "'?'", plan)
+        except psycopg2.Error as e:
+            plan = f"Không chạy được EXPLAIN: {str(e).strip()}"
+        finally:
+            conn.rollback()
+        return plan, (time.perf_counter() - start) * 1000
 
-            # --- TẠO BẢNG USERS (Người dùng) ---
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id SERIAL PRIMARY KEY,                 -- ID tự động tăng
-                    username VARCHAR(100) UNIQUE NOT NULL, -- Tên đăng nhập (duy nhất)
-                    password VARCHAR(100) NOT NULL,        -- Mật khẩu
-                    email VARCHAR(100),                    -- Email
-                    role VARCHAR(50) DEFAULT 'user',       -- Vai trò: 'user' hoặc 'admin'
-                    points INTEGER DEFAULT 0,              -- Điểm tích lũy
-                    created_at TIMESTAMP DEFAULT NOW()     -- Ngày tạo tài khoản
-                )
-            ''')
-            
-            # --- TẠO BẢNG BOOKS (Sách) ---
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS books (
-                    id SERIAL PRIMARY KEY,              -- ID sách
-                    title VARCHAR(255) NOT NULL,        -- Tên sách
-                    author VARCHAR(255) NOT NULL,       -- Tác giả
-                    category VARCHAR(100) NOT NULL,     -- Thể loại
-                    year INTEGER,                       -- Năm xuất bản
-                    quantity INTEGER DEFAULT 1,         -- Tổng số lượng
-                    available INTEGER DEFAULT 1,        -- Số lượng có sẵn để mượn
-                    image_url TEXT,                     -- Link ảnh bìa
-                    description TEXT,                   -- Mô tả sách
-                    created_at TIMESTAMP DEFAULT NOW()  -- Ngày thêm sách
-                )
-            ''')
+    @staticmethod
+    def top(limit=50):
+        """CÁC CÂU CHẬM NHẤT THEO TỔNG THỜI GIAN (cho trang admin)"""
+        if not BACKEND.SLOW_QUERIES:
+            return []
+        conn = DatabaseManager().get_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute('''
+            SELECT query_id, caller, query, params, route, calls, total_ms, max_ms,
+                   total_ms / NULLIF(calls, 0) AS avg_ms, first_seen, last_seen, plan, plan_ms, plan_at
+            FROM slow_queries
+            ORDER BY total_ms DESC
+            LIMIT %s
+        ''', (limit,))
+        rows = cursor.fetchall()
+        conn.close()
+        return rows
 
-            # --- CHÈN DỮ LIỆU MẪU NẾU BẢNG TRỐNG ---
-            # Kiểm tra xem bảng users có dữ liệu chưa
-            cursor.execute("SELECT COUNT(*) FROM users")
-            if cursor.fetchone()[0] == 0:
-                # Thêm tài khoản mẫu: 1 admin và 1 user
-                cursor.execute('''
-                    INSERT INTO users (username, password, email, role, points)
-                    VALUES 
-                    ('admin', 'admin123', 'admin@library.com', 'admin', 0),
-                    ('user1', 'user123', 'user1@example.com', 'user', 50)
-                ''')
+    @staticmethod
+    def reset():
+        if not BACKEND.SLOW_QUERIES:
+            return
+        conn = DatabaseManager().get_connection()
+        cursor = conn.cursor()
+        cursor.execute("TRUNCATE slow_queries")
+        conn.commit()
+        conn.close()
 
-            # Kiểm tra xem bảng books có dữ liệu chưa
-            cursor.execute("SELECT COUNT(*) FROM books")
-            if cursor.fetchone()[0] == 0:
-                # Thêm sách mẫu
-                books = [
-                    ('Đắc Nhân Tâm', 'Dale Carnegie', 'Kỹ năng sống', 2020, 5, 5, 'https://i.pinimg.com/1200x/1c/22/df/1c22df7132ad8f1358688b23831e9eaf.jpg', 'Sách về kỹ năng giao tiếp'),
-                    ('Sapiens', 'Yuval Noah Harari', 'Lịch sử', 2018, 3, 3, 'https://i.pinimg.com/1200x/ef/68/e5/ef68e5753d6bd53fbc099c9003ad1abb.jpg', 'Lịch sử loài người'),
-                ]
-                cursor.executemany('''
-                    INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', books)
+    def reset_after_fork(self):
+        self._queue = queue.Queue(maxsize=self.QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._thread = None
 
-            conn.commit()  # Lưu tất cả thay đổi vào database
-            cursor.close()
-            conn.close()
-            print("[INFO] Database đã được đồng bộ thành công!")
 
-        except Exception as e:
-            print(f"[ERROR] Đồng bộ database thất bại: {e}")
-            if conn:
-                conn.rollback()  # Hoàn tác nếu có lỗi
-                conn.close()
+SLOW_QUERIES = SlowQueryLog()
 
 
-    def init_database(self):
-        """
-        KHỞI TẠO CÁC BẢNG VÀ DỮ LIỆU MẪU
-        - Tạo 4 bảng: users, books, cart, transactions
-        """
+class InstrumentedCursorMixin:
+    """
+    ĐO TỪNG CÂU SQL: thời gian + số dòng, gom theo fingerprint (xem Metrics.record_query)
+    - Câu vượt ngưỡng được chuyển cho SlowQueryLog
+    """
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
         try:
-            with self.get_connection() as conn:
-                with conn.cursor() as cursor:
-                    # --- BẢNG USERS (Người dùng) ---
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS users (
-                            id SERIAL PRIMARY KEY,
-                            username VARCHAR(100) UNIQUE NOT NULL,
-                            password VARCHAR(100) NOT NULL,
-                            email VARCHAR(100),
-                            role VARCHAR(50) DEFAULT 'user',
-                            points INTEGER DEFAULT 0,
-                            created_at TIMESTAMP DEFAULT NOW()
-                        )
-                    ''')
-
-                    # --- BẢNG BOOKS (Sách) ---
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS books (
-                            id SERIAL PRIMARY KEY,
-                            title VARCHAR(255) NOT NULL,
-                            author VARCHAR(255) NOT NULL,
-                            category VARCHAR(100) NOT NULL,
-                            year INTEGER,
-                            quantity INTEGER DEFAULT 1,
-                            available INTEGER DEFAULT 1,
-                            image_url TEXT,
-                            description TEXT,
-                            created_at TIMESTAMP DEFAULT NOW()
-                        )
-                    ''')
-
-                    # --- BẢNG CART (Giỏ sách - sách user định mượn) ---
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS cart (
-                            id SERIAL PRIMARY KEY,
-                            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,  -- Khóa ngoại đến users
-                            book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,  -- Khóa ngoại đến books
-                            added_at TIMESTAMP DEFAULT NOW(),                                 -- Thời gian thêm vào giỏ
-                            UNIQUE (user_id, book_id)  -- 1 user không thể thêm 1 sách 2 lần
-                        )
-                    ''')
-
-                    # --- BẢNG TRANSACTIONS (Lịch sử mượn trả) ---
-                    cursor.execute('''
-                        CREATE TABLE IF NOT EXISTS transactions (
-                            id SERIAL PRIMARY KEY,
-                            user_id INTEGER NOT NULL REFERENCES users(id),      -- User nào mượn
-                            book_id INTEGER NOT NULL REFERENCES books(id),      -- Sách nào
-                            borrow_date TIMESTAMP DEFAULT NOW(),                -- Ngày mượn
-                            due_date DATE NOT NULL,                             -- Ngày phải trả
-                            return_date TIMESTAMP,                              -- Ngày trả thực tế (NULL nếu chưa trả)
-                            status VARCHAR(50) DEFAULT 'borrowed',              -- Trạng thái: 'borrowed' hoặc 'returned'
-                            points_earned INTEGER DEFAULT 0                     -- Điểm nhận được khi trả
-                        )
-                    ''')
-
-                    # Lưu thay đổi sau khi tạo bảng
-                    conn.commit()
+            return super().execute(query, vars)
+        finally:
+            self._record(query, vars, time.perf_counter() - start)
 
-                    # Tạo dữ liệu mẫu
-                    self.create_sample_data(cursor, conn)
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            self._record(query, None, time.perf_counter() - start)
 
-                    print("[INFO] Database và bảng đã sẵn sàng.")
-        except psycopg2.Error as e:
-            print(f"[ERROR] Khởi tạo database thất bại: {e}")
+    def copy_expert(self, sql, file, size=8192):
+        start = time.perf_counter()
+        try:
+            return super().copy_expert(sql, file, size)
+        finally:
+            self._record(sql, None, time.perf_counter() - start)
 
-    def create_sample_data(self, cursor, conn):
-        """
-        TẠO DỮ LIỆU MẪU CHO BẢNG USERS VÀ BOOKS (nếu bảng trống)
-        """
+    def _record(self, sql, params, seconds):
+        if not isinstance(sql, str):
+            sql = sql.decode() if isinstance(sql, bytes) else str(sql)
+        METRICS.record_query(sql, seconds, self.rowcount)
+        if 0 < SlowQueryLog.THRESHOLD <= seconds:
+            SLOW_QUERIES.record(sql, params, seconds, sys._getframe(2))
+
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """
+    KẾT NỐI psycopg2 CÓ ĐO ĐẠC (connection_factory khi mở kết nối)
+    - Mọi cursor đều được bọc, kể cả khi code truyền cursor_factory riêng (RealDictCursor)
+      hay dùng named cursor (server-side)
+    """
+
+    _cursor_classes = {}   # cursor gốc -> cursor có đo đạc
+
+    def cursor(self, name=None, cursor_factory=None, scrollable=None, withhold=False):
+        base = cursor_factory or self.cursor_factory or psycopg2.extensions.cursor
+        wrapped = self._cursor_classes.get(base)
+        if wrapped is None:
+            wrapped = self._cursor_classes[base] = type(f"Instrumented{base.__name__}",
+                                                        (InstrumentedCursorMixin, base), {})
+        return super().cursor(name, cursor_factory=wrapped, scrollable=scrollable, withhold=withhold)
+
+
+class PoolTimeout(RuntimeError):
+    """LỖI: Chờ quá lâu mà pool không còn kết nối rảnh"""
+
+
+class PooledConnection:
+    """
+    KẾT NỐI MƯỢN TỪ POOL
+    - Dùng y như kết nối psycopg2 bình thường (cursor, commit, rollback, with ...)
+    - close() KHÔNG đóng kết nối thật mà trả nó về pool để dùng lại
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    @property
+    def closed(self):
+        return self._conn is None or self._conn.closed
+
+    def close(self):
+        """Trả kết nối về pool (gọi nhiều lần cũng không sao)"""
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Lưới an toàn: code quên close() thì kết nối vẫn quay về pool
         try:
-            # --- THÊM DỮ LIỆU CHO BẢNG USERS ---
-            cursor.execute("SELECT COUNT(*) FROM users")
-            if cursor.fetchone()[0] == 0:
-                cursor.execute('''
-                    INSERT INTO users (username, password, email, role, points)
-                    VALUES 
-                    ('admin', 'admin123', 'admin@library.com', 'admin', 0),
-                    ('user1', 'user123', 'user1@example.com', 'user', 50)
-                ''')
+            self.close()
+        except Exception:
+            pass
 
-            # --- THÊM DỮ LIỆU CHO BẢNG BOOKS ---
-            cursor.execute("SELECT COUNT(*) FROM books")
-            if cursor.fetchone()[0] == 0:
-                books = [
-                    ('Đắc Nhân Tâm', 'Dale Carnegie', 'Kỹ năng sống', 2020, 5, 5, 'https://i.pinimg.com/1200x/1c/22/df/1c22df7132ad8f1358688b23831e9eaf.jpg', 'Sách về kỹ năng giao tiếp'),
-                    ('Sapiens', 'Yuval Noah Harari', 'Lịch sử', 2018, 3, 3, 'https://salt.tikicdn.com/cache/750x750/ts/product/5e/18/24/2a6154ba08df6ce6161c13f4303fa19e.jpg.webp', 'Lịch sử loài người'),
-                    ('Clean Code', 'Robert C. Martin', 'Công nghệ', 2019, 4, 4, 'https://m.media-amazon.com/images/I/51E2055ZGUL._SY445_SX342_.jpg', 'Viết code sạch'),
-                    ('Hoàng Tử Bé', 'Antoine de Saint-Exupéry', 'Văn học', 2015, 6, 6, 'https://i.pinimg.com/736x/73/fe/f2/73fef2d17b9f311e713bee4bcba584d7.jpg', 'Truyện thiếu nhi'),
-                    ('Nhà Giả Kim', 'Paulo Coelho', 'Văn học', 2017, 5, 5, 'https://i.pinimg.com/736x/e7/9b/61/e79b615c3277569a59e312943707eeae.jpg', 'Tiểu thuyết triết lý')
-                ]
-                cursor.executemany('''
-                    INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                ''', books)
 
-            conn.commit()
-            print("[INFO] Sample data đã được thêm (nếu bảng rỗng).")
+class RequestConnection:
+    """
+    KẾT NỐI DÙNG CHUNG CHO CẢ 1 REQUEST
+    - close() của các method KHÔNG trả kết nối về pool, nhưng luôn rollback phần chưa commit
+      (kể cả khi method return sớm giữa transaction): khóa FOR UPDATE được nhả ngay và
+      commit() của method sau không commit nhầm phần ghi dở của method trước
+    - release() (gọi khi kết thúc request) rollback như close() rồi mới trả về pool
+    - Kết nối primary: commit() của transaction có ghi đánh dấu g._db_wrote
+      (để các lần đọc sau dính primary, xem ReplicaRouter)
+    """
 
-        except Exception as e:
-            print(f"[ERROR] Tạo dữ liệu mẫu thất bại: {e}")
+    def __init__(self, conn, primary=True):
+        self._conn = conn
+        self._primary = primary
 
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
 
+    def commit(self):
+        if self._primary and REPLICAS.names and not g.get('_db_wrote') and \
+                self._conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+            # Transaction chỉ được cấp xid khi đã ghi -> phân biệt ghi / chỉ đọc mà không cần đoán từ câu SQL
+            with self._conn.cursor() as cursor:
+                cursor.execute("SELECT pg_current_xact_id_if_assigned() IS NOT NULL")
+                g._db_wrote = cursor.fetchone()[0]
+        self._conn.commit()
 
-class Person(ABC):
+    def close(self):
+        if not self._conn.closed and \
+                self._conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            self._conn.rollback()
+
+    def release(self):
+        try:
+            self.close()
+        finally:
+            self._conn.close()
+
+
+class ConnectionPool:
     """
-    CLASS TRỪU TƯỢNG (ABSTRACT CLASS) - ĐẠI DIỆN CHO MỘT NGƯỜI DÙNG
-    - Đây là class cha, không thể tạo đối tượng trực tiếp
-    - Các class con (User, Admin) phải kế thừa và implement method get_permissions()
+    POOL KẾT NỐI CÓ GIỚI HẠN, AN TOÀN ĐA LUỒNG (1 pool cho 1 backend)
+    - Tối đa maxconn kết nối; hết chỗ thì chờ tối đa timeout giây
+    - Kết nối rảnh quá recycle giây sẽ được kiểm tra lại trước khi dùng
+    - Ghi lại số lần checkout, thời gian chờ... để tinh chỉnh khi tải cao
     """
-    
-    def __init__(self, user_id, username, email, role, points=0):
-        """KHỞI TẠO: Lưu thông tin cơ bản của người dùng"""
-        self.user_id = user_id      # ID người dùng
-        self.username = username    # Tên đăng nhập
-        self.email = email          # Email
-        self.role = role            # Vai trò: 'user' hoặc 'admin'
-        self.points = points        # Điểm tích lũy
-    
-    @abstractmethod
-    def get_permissions(self):
+
+    def __init__(self, name, connect, maxconn=10, timeout=10.0, recycle=300):
+        self.name = name
+        self._connect = connect        # Hàm tạo kết nối psycopg2 mới
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = []                # Danh sách (conn, thời điểm được trả về)
+        self._in_use = 0
+        self._cond = threading.Condition()
+
+        # Số liệu thống kê
+        self.checkouts = 0
+        self.timeouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def getconn(self):
+        """MƯỢN 1 KẾT NỐI: lấy kết nối rảnh, hoặc tạo mới nếu chưa đủ maxconn"""
+        start = time.monotonic()
+        deadline = start + self.timeout
+        with self._cond:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout(f"Pool '{self.name}' hết kết nối sau {self.timeout}s chờ!")
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            conn, idle_since = self._idle.pop() if self._idle else (None, None)
+
+            waited = time.monotonic() - start
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+        try:
+            # Kết nối rảnh lâu có thể đã bị server cắt -> kiểm tra lại
+            if conn is not None and (conn.closed or (time.monotonic() - idle_since > self.recycle
+                                                     and not self._is_alive(conn))):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+                with self._cond:
+                    self.created += 1
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, conn)
+
+    def putconn(self, conn):
+        """TRẢ KẾT NỐI VỀ POOL: rollback phần giao dịch còn dở trước khi cho mượn lại"""
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            self._discard(conn)   # Đã đếm vào discarded
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            return
+
+        with self._cond:
+            self._in_use -= 1
+            if conn.closed:
+                self.discarded += 1
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        """ĐÓNG TẤT CẢ KẾT NỐI ĐANG RẢNH"""
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        """SỐ LIỆU CỦA POOL (dùng cho trang theo dõi)"""
+        with self._cond:
+            return {
+                'max_size': self.maxconn,
+                'size': self._in_use + len(self._idle),
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'wait_avg_ms': round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                'wait_max_ms': round(self.wait_max * 1000, 3),
+            }
+
+    def _is_alive(self, conn):
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+        with self._cond:
+            self.discarded += 1
+
+
+class FailoverManager:
+    """
+    THEO DÕI SỨC KHỎE CÁC BACKEND + CIRCUIT BREAKER (Local → Render → Neon)
+    - Backend lỗi bị "ngắt mạch": request sau bỏ qua nó, không tốn timeout kết nối nữa
+    - 1 thread nền thử kết nối lại backend lỗi với thời gian chờ tăng dần (backoff)
+    - Backend ưu tiên cao hơn sống lại -> request kế tiếp tự quay về (failback)
+    """
+
+    PROBE_BACKOFF_MIN = float(os.environ.get('DB_PROBE_BACKOFF_MIN', 1))     # Giây chờ lần thử đầu
+    PROBE_BACKOFF_MAX = float(os.environ.get('DB_PROBE_BACKOFF_MAX', 60))    # Giây chờ tối đa
+
+    def __init__(self, backends, connect):
+        self.backends = list(backends)   # Thứ tự ưu tiên
+        self._connect = connect          # Hàm mở kết nối thật: connect(name)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        # Trạng thái từng backend
+        self._down = {}                  # name -> {'since', 'failures', 'next_probe', 'error'}
+        self.active = None               # Backend đang phục vụ request (active_db)
+        self.failovers = 0
+        self.events = deque(maxlen=50)   # Lịch sử chuyển backend gần nhất
+
+    def candidates(self):
+        """CÁC BACKEND ĐANG KHỎE theo thứ tự ưu tiên (không có I/O, gọi trên request path)"""
+        with self._lock:
+            return [name for name in self.backends if name not in self._down]
+
+    def mark_up(self, name):
+        """GHI NHẬN backend name vừa phục vụ thành công"""
+        with self._lock:
+            self._down.pop(name, None)
+            if self.active != name:
+                if self.active is None:
+                    reason = 'connected'
+                elif self.backends.index(name) < self.backends.index(self.active):
+                    reason = 'failback'
+                else:
+                    reason = 'failover'
+                self._record_switch(self.active, name, reason)
+                self.active = name
+
+    def mark_down(self, name, error):
+        """NGẮT MẠCH backend name và giao cho thread nền thử lại"""
+        with self._lock:
+            state = self._down.get(name)
+            if state is None:
+                state = self._down[name] = {'since': time.time(), 'failures': 0}
+            state['failures'] += 1
+            state['error'] = str(error).strip()
+            state['next_probe'] = time.monotonic() + self._backoff(state['failures'])
+            if self.active == name:
+                self._record_switch(name, None, state['error'])
+                self.active = None
+        self._ensure_prober()
+        self._wakeup.set()
+
+    def stats(self):
+        """SỐ LIỆU: backend đang dùng, backend đang bị ngắt mạch, số lần failover"""
+        with self._lock:
+            return {
+                'active_db': self.active,
+                'failovers': self.failovers,
+                'down': {name: {'since': datetime.fromtimestamp(st['since']).isoformat(timespec='seconds'),
+                                'failures': st['failures'],
+                                'error': st['error']}
+                         for name, st in self._down.items()},
+                'events': list(self.events),
+            }
+
+    def reset_after_fork(self):
+        """Thread nền không tồn tại trong process con -> để lần lỗi sau tạo lại"""
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        if self._down:
+            self._ensure_prober()
+
+    def _backoff(self, failures):
+        return min(self.PROBE_BACKOFF_MIN * 2 ** (failures - 1), self.PROBE_BACKOFF_MAX)
+
+    def _record_switch(self, old, new, reason):
+        # Gọi khi đang giữ self._lock
+        if old is not None:
+            self.failovers += 1
+        self.events.append({
+            'at': datetime.now().isoformat(timespec='seconds'),
+            'from': old,
+            'to': new,
+            'reason': reason,
+        })
+        log.log(logging.INFO if old is None else logging.WARNING,
+                "Đổi backend database: %s → %s (%s)", old, new, reason)
+
+    def _ensure_prober(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._probe_loop, name='db-failover-probe', daemon=True)
+                self._thread.start()
+
+    def _probe_loop(self):
+        """THREAD NỀN: đến hạn thì thử kết nối lại từng backend đang bị ngắt mạch"""
+        while True:
+            with self._lock:
+                if not self._down:
+                    self._thread = None
+                    return
+                now = time.monotonic()
+                due = [name for name, st in self._down.items() if st['next_probe'] <= now]
+                wait = min(st['next_probe'] for st in self._down.values()) - now
+
+            if not due:
+                self._wakeup.wait(max(wait, 0.05))
+                self._wakeup.clear()
+                continue
+
+            for name in due:
+                try:
+                    conn = self._connect(name)
+                    conn.close()
+                except Exception as e:
+                    self.mark_down(name, e)
+                else:
+                    with self._lock:
+                        self._down.pop(name, None)
+                    log.info("Backend %s đã hoạt động trở lại.", name.upper())
+
+
+class ReplicaRouter:
+    """
+    ĐỊNH TUYẾN CÂU ĐỌC SANG READ REPLICA (primary = backend đang phục vụ của FAILOVER)
+    - Các replica đang khỏe được chia lượt vòng tròn (round-robin) -> thêm replica là đọc được nhiều hơn
+    - Replica lỗi bị ngắt mạch như backend chính (dùng lại FailoverManager: backoff + thread thử lại)
+    - Replica trễ quá MAX_LAG giây bị bỏ qua cho tới lần đo sau; không còn replica nào thì đọc ở primary
+    - User vừa ghi thì các lần đọc của user đó dính (sticky) vào primary STICKY_SECONDS giây:
+      mốc thời gian nằm trong session nên đúng với mọi worker, cả app Flask lẫn API bất đồng bộ
+    """
+
+    STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY', 5))                 # Cửa sổ đọc ở primary sau khi ghi
+    MAX_LAG = float(os.environ.get('DB_REPLICA_MAX_LAG', STICKY_SECONDS))          # Replica trễ hơn thì bỏ qua
+    LAG_CHECK_INTERVAL = float(os.environ.get('DB_REPLICA_LAG_CHECK', 5))          # Giây giữa 2 lần đo độ trễ
+    SESSION_KEY = '_primary_until'
+
+    # Độ trễ (giây) của replica; đã replay hết WAL nhận được thì coi như không trễ (primary đang rảnh)
+    LAG_SQL = '''
+        SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp())
+               END
+    '''
+
+    def __init__(self, names, connect):
+        self.names = list(names)
+        self.health = FailoverManager(self.names, connect)
+        self._turn = itertools.count()
+        self._lock = threading.Lock()
+        self._lag = {}             # name -> (thời điểm đo, độ trễ giây)
+        self.reads = Counter()     # (nơi đọc, lý do) -> số lần
+
+    def primary_reason(self, wrote=False, primary_until=0, catalog=False):
+        """
+        LÝ DO PHẢI ĐỌC Ở PRIMARY (None = được đọc ở replica)
+        - wrote: request hiện tại đã ghi; primary_until: mốc sticky lấy từ session
+        - catalog: kết quả sẽ được cache theo phiên bản danh mục -> danh mục đổi chưa quá MAX_LAG giây
+          thì replica có thể chưa thấy, không được để bản cũ nằm trong cache dưới khóa mới
+        """
+        if not self.names:
+            return 'no_replica'
+        if wrote:
+            return 'wrote'
+        if primary_until > time.time():
+            return 'sticky'
+        if catalog and datetime.now() - CATALOG.changed_at < timedelta(seconds=self.MAX_LAG):
+            return 'catalog'
+        return None
+
+    def candidates(self):
+        """CÁC REPLICA ĐANG KHỎE, xoay vòng điểm bắt đầu mỗi lần gọi"""
+        healthy = self.health.candidates()
+        if not healthy:
+            return []
+        start = next(self._turn) % len(healthy)
+        return healthy[start:] + healthy[:start]
+
+    def lag_status(self, name):
+        """SỐ ĐO ĐỘ TRỄ GẦN NHẤT -> (còn mới, trễ trong giới hạn)"""
+        with self._lock:
+            measured = self._lag.get(name)
+        if measured is None or time.monotonic() - measured[0] > self.LAG_CHECK_INTERVAL:
+            return False, False
+        return True, measured[1] <= self.MAX_LAG
+
+    def record_lag(self, name, lag):
+        """LƯU SỐ ĐO MỚI, trả về True nếu replica đủ mới để đọc"""
+        lag = float(lag or 0)
+        with self._lock:
+            previous = self._lag.get(name)
+            self._lag[name] = (time.monotonic(), lag)
+        if lag > self.MAX_LAG and (previous is None or previous[1] <= self.MAX_LAG):
+            log.warning("Replica %s trễ %.1fs (> %.1fs), tạm đọc ở nơi khác.", name.upper(), lag, self.MAX_LAG)
+        return lag <= self.MAX_LAG
+
+    def is_fresh(self, name, conn):
+        """Replica có đủ mới không (đo lại bằng conn khi số đo cũ đã quá LAG_CHECK_INTERVAL)"""
+        fresh, ok = self.lag_status(name)
+        if fresh:
+            return ok
+        cursor = conn.cursor()
+        cursor.execute(self.LAG_SQL)
+        lag = cursor.fetchone()[0]
+        conn.rollback()
+        return self.record_lag(name, lag)
+
+    def count(self, target, reason):
+        """Đếm 1 lần mượn kết nối đọc (target: tên replica hoặc 'primary')"""
+        with self._lock:
+            self.reads[(target, reason)] += 1
+        METRICS.inc('library_db_reads_total', (('target', target), ('reason', reason)))
+
+    def stats(self):
+        """SỐ LIỆU: replica nào đang lỗi / trễ bao nhiêu, số lần đọc ở đâu và vì sao"""
+        with self._lock:
+            lag = {name: round(value, 3) for name, (_, value) in self._lag.items()}
+            reads = {f"{target}:{reason}": n for (target, reason), n in sorted(self.reads.items())}
+        return {
+            'replicas': self.names,
+            'down': self.health.stats()['down'],
+            'lag_seconds': lag,
+            'reads': reads,
+        }
+
+    def reset_after_fork(self):
+        self._lock = threading.Lock()
+        self.health.reset_after_fork()
+
+
+class DatabaseManager:
+    """
+    QUẢN LÝ DATABASE (LOCAL + RENDER + NEON)
+    - Ưu tiên Local → Render → Neon, backend lỗi được FailoverManager ngắt mạch
+    - Câu đọc có thể đi tới read replica (get_read_connection, xem ReplicaRouter)
+    - Mỗi backend / replica có 1 pool riêng
+    - Pool dùng chung cho cả process; mỗi worker gunicorn tự tạo lại pool sau khi fork
+    """
+
+    LOCAL_DB_CONFIG = {
+        'dbname': "library_db",
+        'user': "admin",
+        'password': "1234",
+        'host': "localhost",
+        'port': "5432"
+    }
+
+    # Cấu hình pool (có thể chỉnh qua biến môi trường)
+    POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX', 10))            # Số kết nối tối đa / backend / worker
+    POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))       # Số giây chờ khi pool đầy
+    POOL_RECYCLE = float(os.environ.get('DB_POOL_RECYCLE', 300))      # Kết nối rảnh quá lâu sẽ được ping lại
+    CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))    # Timeout khi mở kết nối mới
+
+    # Engine lưu trữ: 'postgres' (mặc định, Local → Render → Neon) hoặc 'sqlite' (file nhúng, xem SQLiteEngine)
+    ENGINE = os.environ.get('DB_ENGINE', 'postgres').lower()
+    SQLITE = ENGINE == 'sqlite'
+
+    # Thứ tự ưu tiên backend (vd. DB_BACKENDS=render,neon để bỏ Local khi deploy)
+    BACKENDS = [name.strip() for name in os.environ.get('DB_BACKENDS', 'local,render,neon').split(',') if name.strip()]
+
+    # Trạng thái dùng chung cho cả process
+    _pools = {}
+    _lock = threading.Lock()
+
+    # Cấu hình đọc 1 lần khi nạp module (.env đã được load_dotenv() ở đầu file)
+    DATABASE_URL_RENDER = os.getenv("DATABASE_URL_RENDER")
+    DATABASE_URL_NEON = os.getenv("DATABASE_URL_NEON")
+
+    # Read replica của primary (DATABASE_URL_REPLICAS=url1,url2 ...) -> tên replica1, replica2 ...
+    REPLICA_URLS = {f"replica{i}": url.strip() for i, url in
+                    enumerate((url for url in os.getenv("DATABASE_URL_REPLICAS", "").split(',') if url.strip()), 1)}
+
+    def __init__(self):
+        """KHỞI TẠO: rất nhẹ, không đọc file hay mở kết nối (tạo mỗi request cũng không tốn gì)"""
+        self.active_db = FAILOVER.active
+
+    @classmethod
+    def connect_args(cls, name):
+        """
+        THAM SỐ KẾT NỐI TỚI BACKEND name: (dsn, kwargs)
+        - Dùng chung cho psycopg2 (app Flask) và psycopg 3 (API bất đồng bộ)
+        """
+        if name == "local":
+            return "", {**cls.LOCAL_DB_CONFIG, 'connect_timeout': cls.CONNECT_TIMEOUT}
+
+        if name in cls.REPLICA_URLS:
+            # sslmode theo URL của replica (replica cùng máy / cùng mạng nội bộ không cần TLS)
+            return cls.REPLICA_URLS[name], {'connect_timeout': cls.CONNECT_TIMEOUT}
+
+        url = getattr(cls, f"DATABASE_URL_{name.upper()}", None)
+        if not url:
+            raise Exception(f"Không có DATABASE_URL_{name.upper()} trong .env!")
+        return url, {'sslmode': 'require', 'connect_timeout': cls.CONNECT_TIMEOUT}
+
+    @classmethod
+    def _connect_backend(cls, name):
+        """MỞ 1 KẾT NỐI THẬT TỚI BACKEND name ('local' / 'render' / 'neon')"""
+        dsn, kwargs = cls.connect_args(name)
+        return psycopg2.connect(dsn, connection_factory=InstrumentedConnection, **kwargs)
+
+    @classmethod
+    def _get_pool(cls, name):
+        """LẤY (HOẶC TẠO) POOL CỦA 1 BACKEND"""
+        pool = cls._pools.get(name)
+        if pool is None:
+            with cls._lock:
+                pool = cls._pools.get(name)
+                if pool is None:
+                    pool = ConnectionPool(name, lambda: cls._connect_backend(name),
+                                          maxconn=cls.POOL_MAX_SIZE,
+                                          timeout=cls.POOL_TIMEOUT,
+                                          recycle=cls.POOL_RECYCLE)
+                    cls._pools[name] = pool
+        return pool
+
+    def get_connection(self):
+        """
+        LẤY KẾT NỐI
+        - Trong 1 request Flask: mượn pool 1 lần (lúc cần lần đầu), mọi method trong
+          request dùng chung kết nối đó; cuối request mới trả về pool
+        - Ngoài request (thread nền, CLI): mượn thẳng từ pool
+        - SQLite: kết nối mở sẵn của thread hiện tại (không có pool)
+        - Nhớ gọi conn.close() như bình thường
+        """
+        if self.SQLITE:
+            return SQLITE_ENGINE.connection()
+        if has_request_context():
+            conn = g.get('_db_conn')
+            if conn is None or conn.closed:
+                conn = g._db_conn = RequestConnection(self._checkout())
+            return conn
+        return self._checkout()
+
+    def get_bookkeeping_connection(self):
+        """
+        KẾT NỐI RIÊNG CHO VIỆC GHI PHỤ CỦA HỆ THỐNG (vd. ghi cache HTML), KHÔNG PHẢI THAO TÁC CỦA NGƯỜI DÙNG
+        - Luôn mượn thẳng từ pool, không dùng chung kết nối của request -> commit không đánh dấu
+          g._db_wrote: người xem không bị dính primary, khách không bị set cookie
+        - SQLite: như get_connection
+        """
+        if self.SQLITE:
+            return SQLITE_ENGINE.connection()
+        return self._checkout()
+
+    def get_read_connection(self, catalog=False):
+        """
+        LẤY KẾT NỐI CHỈ ĐỂ ĐỌC (danh mục, tìm kiếm, thống kê, lịch sử...)
+        - Có replica thì đọc ở replica (xem ReplicaRouter), trong 1 request dùng chung 1 kết nối replica
+        - Đọc ở primary (như get_connection) khi: không có replica / SQLite, request này đã ghi,
+          user vừa ghi trong cửa sổ sticky, catalog=True mà danh mục vừa đổi, hoặc không replica nào dùng được
+        - Chỉ dùng cho câu đọc: replica không nhận câu ghi
+        """
+        if self.SQLITE or not REPLICAS.names:
+            return self.get_connection()
+
+        if has_request_context():
+            reason = REPLICAS.primary_reason(g.get('_db_wrote', False), session.get(REPLICAS.SESSION_KEY, 0), catalog)
+            if reason is None:
+                conn = g.get('_db_read_conn')
+                if conn is None or conn.closed:
+                    replica = self._checkout_replica()
+                    conn = g._db_read_conn = RequestConnection(replica, primary=False) if replica else None
+                if conn is not None:
+                    return conn
+                reason = 'fallback'
+        else:
+            reason = REPLICAS.primary_reason(catalog=catalog)
+            if reason is None:
+                conn = self._checkout_replica()
+                if conn is not None:
+                    return conn
+                reason = 'fallback'
+
+        REPLICAS.count('primary', reason)
+        return self.get_connection()
+
+    def _checkout_replica(self):
+        """
+        MƯỢN KẾT NỐI TỪ 1 REPLICA (lần lượt theo ReplicaRouter.candidates)
+        - Replica lỗi bị ngắt mạch, replica trễ / pool đầy thì thử replica kế tiếp
+        - Không replica nào dùng được -> None (người gọi đọc ở primary)
+        """
+        for name in REPLICAS.candidates():
+            start = time.perf_counter()
+            try:
+                conn = self._get_pool(name).getconn()
+            except PoolTimeout:
+                continue
+            except Exception as e:
+                log.warning("Replica %s không khả dụng: %s", name.upper(), e)
+                self._get_pool(name).closeall()
+                REPLICAS.health.mark_down(name, e)
+                continue
+
+            try:
+                fresh = REPLICAS.is_fresh(name, conn)
+            except psycopg2.Error as e:
+                log.warning("Replica %s không khả dụng: %s", name.upper(), e)
+                conn.close()
+                REPLICAS.health.mark_down(name, e)
+                continue
+            if not fresh:
+                conn.close()
+                continue
+
+            METRICS.record_acquire(name, time.perf_counter() - start)
+            REPLICAS.count(name, 'replica')
+            return conn
+        return None
+
+    def _checkout(self):
+        """
+        MƯỢN KẾT NỐI TỪ POOL
+        - Chỉ thử các backend đang khỏe, theo thứ tự Local → Render → Neon
+        - Backend lỗi bị ngắt mạch, thread nền sẽ thử lại (không chặn request)
+        """
+        for name in FAILOVER.candidates():
+            start = time.perf_counter()
+            try:
+                conn = self._get_pool(name).getconn()
+            except PoolTimeout:
+                raise
+            except Exception as e:
+                log.warning("%s DB không khả dụng: %s", name.upper(), e)
+                self._get_pool(name).closeall()
+                FAILOVER.mark_down(name, e)
+                continue
+
+            METRICS.record_acquire(name, time.perf_counter() - start)
+            FAILOVER.mark_up(name)
+            self.active_db = name
+            return conn
+
+        raise RuntimeError("Không thể kết nối tới bất kỳ database nào!")
+
+    @classmethod
+    def pool_stats(cls):
+        """THỐNG KÊ POOL CỦA TẤT CẢ BACKEND"""
+        if cls.SQLITE:
+            return SQLITE_ENGINE.stats()
+        return {
+            'active_db': FAILOVER.active,
+            'pools': {name: pool.stats() for name, pool in list(cls._pools.items())},
+            'failover': FAILOVER.stats(),
+            'replicas': REPLICAS.stats(),
+        }
+
+    @classmethod
+    def _reset_after_fork(cls):
+        """
+        GỌI TRONG PROCESS CON SAU KHI FORK (worker gunicorn)
+        - Bỏ pool kế thừa từ process cha, worker sẽ tự tạo pool mới khi cần
+        - Không close() kết nối cũ vì socket đó vẫn đang thuộc về process cha
+        """
+        _inherited_pools.extend(cls._pools.values())
+        cls._pools = {}
+        cls._lock = threading.Lock()
+        FAILOVER.reset_after_fork()
+        REPLICAS.reset_after_fork()
+
+
+    def init_database(self):
+        """
+        KHỞI TẠO / NÂNG CẤP DATABASE
+        - Chạy các migration chưa áp dụng (xem SchemaMigrations)
+        - Schema đã mới nhất thì chỉ tốn 1 câu SELECT, không chạy lại DDL
+        - Lần đầu tạo bảng thì thêm dữ liệu mẫu và đồng bộ bộ đếm thống kê
+        """
+        conn = None
+        try:
+            conn = self.get_connection()
+            applied = BACKEND.migrations.migrate(conn)
+            if applied:
+                cursor = conn.cursor()
+                self.create_sample_data(cursor, conn)
+                LibraryStats.reconcile(conn)
+                log.info("Đã áp dụng migration: %s", applied)
+            log.info("Database ở phiên bản schema %s.",
+                     BACKEND.migrations.latest())
+        except psycopg2.Error as e:
+            log.error("Khởi tạo database thất bại: %s", e)
+            if conn:
+                conn.rollback()
+        finally:
+            if conn:
+                conn.close()
+
+    def create_sample_data(self, cursor, conn):
+        """
+        TẠO DỮ LIỆU MẪU CHO BẢNG USERS VÀ BOOKS (nếu bảng trống)
+        """
+        try:
+            # --- THÊM DỮ LIỆU CHO BẢNG USERS ---
+            cursor.execute("SELECT COUNT(*) FROM users")
+            if cursor.fetchone()[0] == 0:
+                cursor.execute('''
+                    INSERT INTO users (username, password, email, role, points)
+                    VALUES 
+                    ('admin', 'admin123', 'admin@library.com', 'admin', 0),
+                    ('user1', 'user123', 'user1@example.com', 'user', 50)
+                ''')
+
+            # --- THÊM DỮ LIỆU CHO BẢNG BOOKS ---
+            cursor.execute("SELECT COUNT(*) FROM books")
+            if cursor.fetchone()[0] == 0:
+                books = [
+                    ('Đắc Nhân Tâm', 'Dale Carnegie', 'Kỹ năng sống', 2020, 5, 5, 'https://i.pinimg.com/1200x/1c/22/df/1c22df7132ad8f1358688b23831e9eaf.jpg', 'Sách về kỹ năng giao tiếp'),
+                    ('Sapiens', 'Yuval Noah Harari', 'Lịch sử', 2018, 3, 3, 'https://salt.tikicdn.com/cache/750x750/ts/product/5e/18/24/2a6154ba08df6ce6161c13f4303fa19e.jpg.webp', 'Lịch sử loài người'),
+                    ('Clean Code', 'Robert C. Martin', 'Công nghệ', 2019, 4, 4, 'https://m.media-amazon.com/images/I/51E2055ZGUL._SY445_SX342_.jpg', 'Viết code sạch'),
+                    ('Hoàng Tử Bé', 'Antoine de Saint-Exupéry', 'Văn học', 2015, 6, 6, 'https://i.pinimg.com/736x/73/fe/f2/73fef2d17b9f311e713bee4bcba584d7.jpg', 'Truyện thiếu nhi'),
+                    ('Nhà Giả Kim', 'Paulo Coelho', 'Văn học', 2017, 5, 5, 'https://i.pinimg.com/736x/e7/9b/61/e79b615c3277569a59e312943707eeae.jpg', 'Tiểu thuyết triết lý')
+                ]
+                cursor.executemany('''
+                    INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                ''', books)
+
+            conn.commit()
+            log.info("Sample data đã được thêm (nếu bảng rỗng).")
+
+        except Exception as e:
+            log.error("Tạo dữ liệu mẫu thất bại: %s", e)
+
+
+class SchemaMigrations:
+    """
+    MIGRATION SCHEMA CÓ ĐÁNH SỐ PHIÊN BẢN
+    - Mỗi migration: (số phiên bản, tên, danh sách bước); bước là câu SQL hoặc hàm nhận cursor
+    - Bảng schema_migrations lưu các phiên bản đã áp dụng
+    - Mỗi migration chạy trong 1 transaction riêng, có advisory lock để nhiều worker
+      khởi động cùng lúc không chạy trùng
+    - Thêm thay đổi schema mới: thêm 1 migration cuối danh sách, KHÔNG sửa migration cũ
+    """
+
+    LOCK_KEY = 4_271_001  # Khóa advisory riêng cho việc migrate
+
+    MIGRATIONS = [
+        (1, 'create_core_tables', [
+            # --- BẢNG USERS (Người dùng) ---
+            '''
+            CREATE TABLE IF NOT EXISTS users (
+                id SERIAL PRIMARY KEY,                 -- ID tự động tăng
+                username VARCHAR(100) UNIQUE NOT NULL, -- Tên đăng nhập (duy nhất)
+                password VARCHAR(100) NOT NULL,        -- Mật khẩu
+                email VARCHAR(100),                    -- Email
+                role VARCHAR(50) DEFAULT 'user',       -- Vai trò: 'user' hoặc 'admin'
+                points INTEGER DEFAULT 0,              -- Điểm tích lũy
+                created_at TIMESTAMP DEFAULT NOW()     -- Ngày tạo tài khoản
+            )
+            ''',
+            # --- BẢNG BOOKS (Sách) ---
+            '''
+            CREATE TABLE IF NOT EXISTS books (
+                id SERIAL PRIMARY KEY,              -- ID sách
+                title VARCHAR(255) NOT NULL,        -- Tên sách
+                author VARCHAR(255) NOT NULL,       -- Tác giả
+                category VARCHAR(100) NOT NULL,     -- Thể loại
+                year INTEGER,                       -- Năm xuất bản
+                quantity INTEGER DEFAULT 1,         -- Tổng số lượng
+                available INTEGER DEFAULT 1,        -- Số lượng có sẵn để mượn
+                image_url TEXT,                     -- Link ảnh bìa
+                description TEXT,                   -- Mô tả sách
+                created_at TIMESTAMP DEFAULT NOW()  -- Ngày thêm sách
+            )
+            ''',
+            # --- BẢNG CART (Giỏ sách - sách user định mượn) ---
+            '''
+            CREATE TABLE IF NOT EXISTS cart (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,  -- Khóa ngoại đến users
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,  -- Khóa ngoại đến books
+                added_at TIMESTAMP DEFAULT NOW(),                                 -- Thời gian thêm vào giỏ
+                UNIQUE (user_id, book_id)  -- 1 user không thể thêm 1 sách 2 lần
+            )
+            ''',
+            # --- BẢNG TRANSACTIONS (Lịch sử mượn trả) ---
+            '''
+            CREATE TABLE IF NOT EXISTS transactions (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id),      -- User nào mượn
+                book_id INTEGER NOT NULL REFERENCES books(id),      -- Sách nào
+                borrow_date TIMESTAMP DEFAULT NOW(),                -- Ngày mượn
+                due_date DATE NOT NULL,                             -- Ngày phải trả
+                return_date TIMESTAMP,                              -- Ngày trả thực tế (NULL nếu chưa trả)
+                status VARCHAR(50) DEFAULT 'borrowed',              -- Trạng thái: 'borrowed' hoặc 'returned'
+                points_earned INTEGER DEFAULT 0                     -- Điểm nhận được khi trả
+            )
+            ''',
+        ]),
+        (2, 'books_catalog_keyset_index', [
+            # Phân trang danh mục sách (keyset theo created_at, id)
+            '''
+            CREATE INDEX IF NOT EXISTS idx_books_created_at_id
+            ON books (created_at DESC, id DESC)
+            ''',
+        ]),
+        (3, 'books_search_index', [
+            # Full-text + trigram, bỏ dấu tiếng Việt
+            "CREATE EXTENSION IF NOT EXISTS unaccent",
+            "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+            # unaccent() không IMMUTABLE nên phải bọc lại mới dùng được trong cột generated/index
+            '''
+            CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+            LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+            AS $$ SELECT public.unaccent('public.unaccent', $1) $$
+            ''',
+            '''
+            ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', f_unaccent(coalesce(title, ''))), 'A') ||
+                setweight(to_tsvector('simple', f_unaccent(coalesce(author, ''))), 'B') ||
+                setweight(to_tsvector('simple', f_unaccent(coalesce(description, ''))), 'C')
+            ) STORED
+            ''',
+            '''
+            ALTER TABLE books ADD COLUMN IF NOT EXISTS search_text TEXT
+            GENERATED ALWAYS AS (lower(f_unaccent(coalesce(title, '') || ' ' || coalesce(author, '')))) STORED
+            ''',
+            "CREATE INDEX IF NOT EXISTS idx_books_search_vector ON books USING GIN (search_vector)",
+            "CREATE INDEX IF NOT EXISTS idx_books_search_text_trgm ON books USING GIN (search_text gin_trgm_ops)",
+            "CREATE INDEX IF NOT EXISTS idx_books_year ON books (year)",
+        ]),
+        (4, 'create_waitlist', [
+            # --- BẢNG WAITLIST (Hàng chờ sách hết bản + giữ sách) ---
+            '''
+            CREATE TABLE IF NOT EXISTS waitlist (
+                id SERIAL PRIMARY KEY,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                status VARCHAR(20) DEFAULT 'waiting',   -- 'waiting' / 'held' / 'claimed' / 'expired' / 'cancelled'
+                created_at TIMESTAMP DEFAULT NOW(),     -- Thời điểm vào hàng chờ (thứ tự ưu tiên)
+                held_until TIMESTAMP                    -- Hạn nhận sách khi đang được giữ
+            )
+            ''',
+            # Mỗi user chỉ có 1 lượt chờ/giữ còn hiệu lực cho mỗi cuốn
+            '''
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_waitlist_active
+            ON waitlist (user_id, book_id) WHERE status IN ('waiting', 'held')
+            ''',
+            # Lấy người kế tiếp trong hàng chờ của 1 cuốn sách
+            '''
+            CREATE INDEX IF NOT EXISTS idx_waitlist_queue
+            ON waitlist (book_id, created_at, id) WHERE status = 'waiting'
+            ''',
+            '''
+            CREATE INDEX IF NOT EXISTS idx_waitlist_held_until
+            ON waitlist (held_until) WHERE status = 'held'
+            ''',
+        ]),
+        (5, 'create_library_stats', [
+            # --- BẢNG LIBRARY_STATS (Bộ đếm thống kê, chia nhiều dòng để tránh tranh chấp) ---
+            '''
+            CREATE TABLE IF NOT EXISTS library_stats (
+                slot INTEGER PRIMARY KEY,               -- Mỗi giao dịch cộng vào 1 slot ngẫu nhiên
+                total_books BIGINT DEFAULT 0,           -- Số đầu sách
+                total_copies BIGINT DEFAULT 0,          -- Tổng số bản
+                available_copies BIGINT DEFAULT 0,      -- Số bản có sẵn
+                total_users BIGINT DEFAULT 0,           -- Số user (role = 'user')
+                active_borrows BIGINT DEFAULT 0         -- Số lượt đang mượn
+            )
+            ''',
+            lambda cursor: cursor.execute('''
+                INSERT INTO library_stats (slot)
+                SELECT generate_series(0, %s - 1)
+                ON CONFLICT (slot) DO NOTHING
+            ''', (LibraryStats.SLOTS,)),
+        ]),
+        (6, 'hot_path_indexes', [
+            # Sách đang mượn của 1 user (dashboard, trả sách)
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_status ON transactions (user_id, status)",
+            # Kiểm tra sách còn người mượn trước khi xóa
+            "CREATE INDEX IF NOT EXISTS idx_transactions_book_status ON transactions (book_id, status)",
+            # Lịch sử giao dịch mới nhất (dashboard admin)
+            "CREATE INDEX IF NOT EXISTS idx_transactions_borrow_date ON transactions (borrow_date DESC)",
+            # Giỏ hàng theo user đã dùng được UNIQUE (user_id, book_id) nên không cần index riêng
+        ]),
+        (7, 'catalog_version_sequence', [
+            # Phiên bản danh mục sách: tăng mỗi lần sách thay đổi (sequence không khóa dòng nào)
+            "CREATE SEQUENCE IF NOT EXISTS catalog_version_seq",
+        ]),
+        (8, 'fragment_cache', [
+            # HTML lưới sách đã render, dùng chung giữa các worker.
+            # UNLOGGED: không ghi WAL, mất khi crash cũng không sao (chỉ là cache)
+            '''
+            CREATE UNLOGGED TABLE IF NOT EXISTS fragment_cache (
+                key VARCHAR(255) PRIMARY KEY,
+                version BIGINT NOT NULL,
+                html TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            ''',
+        ]),
+        (9, 'books_title_author_index', [
+            # Nhập sách hàng loạt: kiểm tra trùng theo tên + tác giả (không phân biệt hoa thường)
+            "CREATE INDEX IF NOT EXISTS idx_books_title_author ON books (lower(title), lower(author))",
+        ]),
+        (10, 'transaction_history_indexes', [
+            # Lịch sử giao dịch phân trang keyset theo (borrow_date, id), lọc theo user / sách / trạng thái:
+            # mỗi bộ lọc có index khớp thứ tự sắp xếp -> trang nào cũng chỉ đọc đúng số dòng cần
+            "CREATE INDEX IF NOT EXISTS idx_transactions_borrow_date_id ON transactions (borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_history ON transactions (user_id, borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_book_history ON transactions (book_id, borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_status_history ON transactions (status, borrow_date DESC, id DESC)",
+            # Thay bởi idx_transactions_borrow_date_id
+            "DROP INDEX IF EXISTS idx_transactions_borrow_date",
+        ]),
+        (11, 'overdue_processing', [
+            # Số ngày trễ và tiền phạt chốt khi trả sách (DEFAULT hằng số: không phải ghi lại bảng)
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS late_days INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS fine INTEGER NOT NULL DEFAULT 0",
+            # Thời điểm job phát hiện giao dịch quá hạn (mỗi giao dịch chỉ bị đánh dấu 1 lần)
+            "ALTER TABLE transactions ADD COLUMN IF NOT EXISTS overdue_marked_at TIMESTAMP",
+            # Chỉ index giao dịch đang mượn: job quá hạn không phải đọc lịch sử đã trả
+            "CREATE INDEX IF NOT EXISTS idx_transactions_open_due ON transactions (due_date) WHERE status = 'borrowed'",
+            # Tổng hợp quá hạn theo user (dashboard đọc bảng này, không quét transactions)
+            '''
+            CREATE TABLE IF NOT EXISTS overdue_summary (
+                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                overdue_loans INTEGER NOT NULL,     -- Số sách đang quá hạn
+                late_days BIGINT NOT NULL,          -- Tổng số ngày trễ
+                fines BIGINT NOT NULL,              -- Tổng tiền phạt (VND)
+                oldest_due DATE,                    -- Hạn trả cũ nhất chưa trả
+                updated_at TIMESTAMP DEFAULT NOW()
+            )
+            ''',
+        ]),
+        (12, 'slow_query_log', [
+            # Câu SQL chậm gộp theo (câu đã chuẩn hóa, method gọi); UNLOGGED: số liệu chẩn đoán,
+            # mất khi database crash cũng không sao, đổi lại ghi không tốn WAL
+            '''
+            CREATE UNLOGGED TABLE IF NOT EXISTS slow_queries (
+                query_id CHAR(8) NOT NULL,              -- crc32 của câu đã chuẩn hóa
+                caller VARCHAR(200) NOT NULL,           -- Method gọi (vd. User.get_borrowed_books)
+                query TEXT NOT NULL,                    -- Câu SQL, tham số / hằng số thay bằng ?
+                params TEXT,                            -- Kiểu tham số (không lưu giá trị)
+                route VARCHAR(100),                     -- Endpoint Flask gần nhất gặp câu này
+                calls BIGINT NOT NULL DEFAULT 0,
+                total_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                max_ms DOUBLE PRECISION NOT NULL DEFAULT 0,
+                first_seen TIMESTAMP DEFAULT NOW(),
+                last_seen TIMESTAMP DEFAULT NOW(),
+                plan TEXT,                              -- Kết quả EXPLAIN (ANALYZE, BUFFERS) gần nhất
+                plan_ms DOUBLE PRECISION,               -- Thời gian chạy lại khi EXPLAIN
+                plan_at TIMESTAMP,
+                PRIMARY KEY (query_id, caller)
+            )
+            ''',
+        ]),
+    ]
+
+    @classmethod
+    def latest(cls):
+        return cls.MIGRATIONS[-1][0]
+
+    @classmethod
+    def current_version(cls, conn):
+        """PHIÊN BẢN SCHEMA HIỆN TẠI (0 nếu chưa có bảng schema_migrations)"""
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            version = cursor.fetchone()[0]
+            conn.rollback()
+            return version
+        except errors.UndefinedTable:
+            conn.rollback()
+            return 0
+
+    @classmethod
+    def migrate(cls, conn):
+        """
+        ÁP DỤNG CÁC MIGRATION CÒN THIẾU
+        - Đường nhanh: đã là phiên bản mới nhất -> trả về [] sau 1 câu SELECT
+        - Trả về danh sách phiên bản vừa áp dụng
+        """
+        if cls.current_version(conn) >= cls.latest():
+            return []
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (cls.LOCK_KEY,))
+        try:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL,
+                    applied_at TIMESTAMP DEFAULT NOW()
+                )
+            ''')
+            conn.commit()
+
+            # Worker khác có thể vừa migrate xong trong lúc mình chờ lock
+            current = cls.current_version(conn)
+            applied = []
+            for version, name, steps in cls.MIGRATIONS:
+                if version <= current:
+                    continue
+                cursor = conn.cursor()
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.append(version)
+                log.info("Migration %03d_%s đã áp dụng.", version, name)
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (cls.LOCK_KEY,))
+            conn.commit()
+
+
+class SQLiteCursor:
+    """
+    CURSOR SQLITE DÙNG NHƯ CURSOR psycopg2 (execute / fetch* / rowcount / description)
+    - Câu SQL viết cho PostgreSQL được dịch trước khi chạy (SQLiteEngine.translate)
+    - cursor_factory=RealDictCursor -> mỗi dòng là dict, như psycopg2
+    - Lỗi sqlite3 được đổi sang lỗi psycopg2 tương ứng: các khối except sẵn có vẫn bắt được
+    """
+
+    arraysize = 1
+    itersize = 2000   # Có ở named cursor của psycopg2 (export đặt lại); SQLite đọc từng lô bằng fetchmany
+
+    def __init__(self, conn, as_dict=False):
+        self.connection = conn
+        self._cursor = conn.raw.cursor()
+        self._as_dict = as_dict
+        self.rowcount = -1
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def _run(self, method, query, params):
+        sql, write = SQLiteEngine.translate(query, params is not None)
+        try:
+            if write and not self._cursor.connection.in_transaction:
+                # Giữ khóa ghi ngay từ câu đầu tiên (thay cho FOR UPDATE / khóa dòng của PostgreSQL)
+                self._cursor.execute("BEGIN IMMEDIATE")
+            method(sql, params if params is not None else ())
+        except sqlite3.Error as e:
+            raise SQLiteEngine.to_psycopg2(e) from e
+        self.rowcount = self._cursor.rowcount
+
+    def execute(self, query, vars=None):
+        self._run(self._cursor.execute, query, SQLiteEngine.adapt(vars))
+
+    def executemany(self, query, vars_list):
+        self._run(self._cursor.executemany, query, [SQLiteEngine.adapt(v) for v in vars_list])
+
+    def copy_expert(self, sql, file, size=8192):
+        raise psycopg2.NotSupportedError("SQLite không hỗ trợ COPY")
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return dict(zip((col[0] for col in self._cursor.description), row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=None):
+        return [self._row(row) for row in self._cursor.fetchmany(size or self.arraysize)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return (self._row(row) for row in self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class InstrumentedSQLiteCursor(InstrumentedCursorMixin, SQLiteCursor):
+    """Cursor SQLite có đo đạc (cùng Metrics / SlowQueryLog với PostgreSQL)"""
+
+
+class SQLiteConnection:
+    """
+    KẾT NỐI SQLITE CỦA THREAD HIỆN TẠI (handle nhẹ, dùng như kết nối psycopg2)
+    - Mỗi thread có đúng 1 kết nối sqlite3 thật; mỗi lần get_connection() trả về 1 handle trỏ tới nó
+    - close() của handle nào cũng rollback phần chưa commit (như RequestConnection.close): method
+      return sớm không commit thì phần ghi dở không bị commit của method khác trên cùng thread mang theo
+    """
+
+    def __init__(self, local):
+        self._local = local
+        self.closed = False
+
+    @property
+    def raw(self):
+        return self._local.conn
+
+    def cursor(self, name=None, cursor_factory=None, **kwargs):
+        as_dict = cursor_factory is not None and issubclass(cursor_factory, psycopg2.extras.RealDictCursor)
+        return InstrumentedSQLiteCursor(self, as_dict=as_dict)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.raw.in_transaction:
+            self.raw.rollback()
+
+
+class SQLiteEngine:
+    """
+    ENGINE SQLITE NHÚNG (DB_ENGINE=sqlite): User / Admin / LibrarySystem chạy không cần PostgreSQL
+    - Dành cho kiosk 1 máy và CI: file SQLITE_PATH (mặc định instance/library.db, không nằm trong git), không qua mạng
+    - Mỗi thread 1 kết nối mở sẵn; WAL (đọc không chặn ghi), mmap, cache trang lớn, synchronous=NORMAL
+    - sqlite3 giữ sẵn câu lệnh đã prepare theo từng kết nối (STATEMENT_CACHE); câu SQL đã dịch được
+      nhớ lại (lru_cache) nên cùng 1 câu luôn dùng lại đúng câu lệnh đã prepare
+    - Câu SQL của PostgreSQL được dịch: %s -> ?, bỏ FOR UPDATE (ghi thì BEGIN IMMEDIATE ngay từ đầu),
+      = ANY(list) -> json_each, bỏ ép kiểu ::, CURRENT_DATE / NOW() / GREATEST / LEAST bằng hàm Python
+    - Câu dùng CTE ghi dữ liệu (chỉ PostgreSQL có) có bản riêng trong SQLiteBackend
+    - Tìm kiếm: FTS5 trên chữ đã bỏ dấu (khớp tiền tố) + FTS5 trigram (khớp 1 đoạn chữ bất kỳ)
+    - Không có trên SQLite: LISTEN/NOTIFY (cache giữa các process chỉ hết hạn theo TTL), advisory lock,
+      COPY (nhập sách dùng executemany), bảng slow_queries / EXPLAIN, API bất đồng bộ (psycopg 3)
+    - Trigger / index dùng hàm fold() và lower() của Python -> chỉ ghi vào file qua ứng dụng này
+    """
+
+    PATH = os.environ.get('SQLITE_PATH', os.path.join(app.instance_path, 'library.db'))
+    MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))   # Byte đọc qua mmap
+    CACHE_KB = int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024))             # Cache trang / kết nối
+    BUSY_TIMEOUT = float(os.environ.get('SQLITE_BUSY_TIMEOUT', 5))           # Giây chờ khóa ghi
+    STATEMENT_CACHE = int(os.environ.get('SQLITE_STATEMENT_CACHE', 512))     # Câu đã prepare / kết nối
+
+    # Giờ địa phương có phần nghìn giây (cùng định dạng với datetime Python đã lưu)
+    LOCAL_NOW = "(strftime('%Y-%m-%d %H:%M:%f', 'now', 'localtime'))"
+
+    MIGRATIONS = [
+        (1, 'create_schema', [
+            # Cùng bảng / cột với các migration PostgreSQL (tới phiên bản 11); IF NOT EXISTS để
+            # dùng tiếp được file library.db cũ
+            f"""
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username VARCHAR(100) UNIQUE NOT NULL,
+                password VARCHAR(100) NOT NULL,
+                email VARCHAR(100),
+                role VARCHAR(50) DEFAULT 'user',
+                points INTEGER DEFAULT 0,
+                created_at TIMESTAMP DEFAULT {LOCAL_NOW}
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS books (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                title VARCHAR(255) NOT NULL,
+                author VARCHAR(255) NOT NULL,
+                category VARCHAR(100) NOT NULL,
+                year INTEGER,
+                quantity INTEGER DEFAULT 1,
+                available INTEGER DEFAULT 1,
+                image_url TEXT,
+                description TEXT,
+                created_at TIMESTAMP DEFAULT {LOCAL_NOW}
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS cart (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                added_at TIMESTAMP DEFAULT {LOCAL_NOW}
+            )
+            """,
+            f"""
+            CREATE TABLE IF NOT EXISTS transactions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users(id),
+                book_id INTEGER NOT NULL REFERENCES books(id),
+                borrow_date TIMESTAMP DEFAULT {LOCAL_NOW},
+                due_date DATE NOT NULL,
+                return_date TIMESTAMP,
+                status VARCHAR(50) DEFAULT 'borrowed',
+                points_earned INTEGER DEFAULT 0,
+                late_days INTEGER NOT NULL DEFAULT 0,
+                fine INTEGER NOT NULL DEFAULT 0,
+                overdue_marked_at TIMESTAMP
+            )
+            """,
+            # File library.db cũ: bảng transactions chưa có các cột quá hạn
+            lambda cursor: SQLiteEngine.add_missing_columns(cursor, 'transactions', {
+                'late_days': 'INTEGER NOT NULL DEFAULT 0',
+                'fine': 'INTEGER NOT NULL DEFAULT 0',
+                'overdue_marked_at': 'TIMESTAMP',
+            }),
+            # Giỏ cũ không có UNIQUE: bỏ dòng trùng trước khi tạo unique index
+            "DELETE FROM cart WHERE id NOT IN (SELECT MIN(id) FROM cart GROUP BY user_id, book_id)",
+            "CREATE UNIQUE INDEX IF NOT EXISTS uq_cart_user_book ON cart (user_id, book_id)",
+            f"""
+            CREATE TABLE IF NOT EXISTS waitlist (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                book_id INTEGER NOT NULL REFERENCES books(id) ON DELETE CASCADE,
+                status VARCHAR(20) DEFAULT 'waiting',
+                created_at TIMESTAMP DEFAULT {LOCAL_NOW},
+                held_until TIMESTAMP
+            )
+            """,
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS uq_waitlist_active
+            ON waitlist (user_id, book_id) WHERE status IN ('waiting', 'held')
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_waitlist_queue ON waitlist (book_id, created_at, id) WHERE status = 'waiting'",
+            "CREATE INDEX IF NOT EXISTS idx_waitlist_held_until ON waitlist (held_until) WHERE status = 'held'",
+            """
+            CREATE TABLE IF NOT EXISTS library_stats (
+                slot INTEGER PRIMARY KEY,
+                total_books BIGINT DEFAULT 0,
+                total_copies BIGINT DEFAULT 0,
+                available_copies BIGINT DEFAULT 0,
+                total_users BIGINT DEFAULT 0,
+                active_borrows BIGINT DEFAULT 0
+            )
+            """,
+            lambda cursor: cursor.executemany("INSERT OR IGNORE INTO library_stats (slot) VALUES (%s)",
+                                              [(slot,) for slot in range(LibraryStats.SLOTS)]),
+            f"""
+            CREATE TABLE IF NOT EXISTS overdue_summary (
+                user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+                overdue_loans INTEGER NOT NULL,
+                late_days BIGINT NOT NULL,
+                fines BIGINT NOT NULL,
+                oldest_due DATE,
+                updated_at TIMESTAMP DEFAULT {LOCAL_NOW}
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_books_created_at_id ON books (created_at DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_books_year ON books (year)",
+            "CREATE INDEX IF NOT EXISTS idx_books_title_author ON books (lower(title), lower(author))",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_book_status ON transactions (book_id, status)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_borrow_date_id ON transactions (borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_user_history ON transactions (user_id, borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_book_history ON transactions (book_id, borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_status_history ON transactions (status, borrow_date DESC, id DESC)",
+            "CREATE INDEX IF NOT EXISTS idx_transactions_open_due ON transactions (due_date) WHERE status = 'borrowed'",
+            # --- TÌM KIẾM: FTS5 theo từ (trọng số tên > tác giả > mô tả) + FTS5 trigram (1 đoạn chữ) ---
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5(title, author, description, tokenize = 'unicode61')",
+            "CREATE VIRTUAL TABLE IF NOT EXISTS books_trgm USING fts5(search_text, tokenize = 'trigram')",
+            # Đồng bộ bằng trigger; cập nhật available (mượn / trả) không đụng tới chỉ mục tìm kiếm
+            """
+            CREATE TRIGGER IF NOT EXISTS books_search_insert AFTER INSERT ON books BEGIN
+                INSERT INTO books_fts (rowid, title, author, description)
+                VALUES (new.id, fold(new.title), fold(new.author), fold(new.description));
+                INSERT INTO books_trgm (rowid, search_text) VALUES (new.id, fold(new.title || ' ' || new.author));
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS books_search_delete AFTER DELETE ON books BEGIN
+                DELETE FROM books_fts WHERE rowid = old.id;
+                DELETE FROM books_trgm WHERE rowid = old.id;
+            END
+            """,
+            """
+            CREATE TRIGGER IF NOT EXISTS books_search_update AFTER UPDATE OF title, author, description ON books BEGIN
+                UPDATE books_fts SET title = fold(new.title), author = fold(new.author),
+                                     description = fold(new.description)
+                WHERE rowid = new.id;
+                UPDATE books_trgm SET search_text = fold(new.title || ' ' || new.author) WHERE rowid = new.id;
+            END
+            """,
+            "DELETE FROM books_fts",
+            "DELETE FROM books_trgm",
+            "INSERT INTO books_fts (rowid, title, author, description) SELECT id, fold(title), fold(author), fold(description) FROM books",
+            "INSERT INTO books_trgm (rowid, search_text) SELECT id, fold(title || ' ' || author) FROM books",
+        ]),
+    ]
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.opened = 0   # Số kết nối đã mở (= số thread đã dùng database)
+
+    @classmethod
+    def latest(cls):
+        return cls.MIGRATIONS[-1][0]
+
+    def connection(self):
+        """KẾT NỐI CỦA THREAD HIỆN TẠI (lần đầu thì mở, sau đó dùng lại)"""
+        if getattr(self._local, 'conn', None) is None:
+            self._local.conn = self._open()
+        return SQLiteConnection(self._local)
+
+    def _open(self):
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)   # Lần đầu chạy: chưa có thư mục instance/
+        conn = sqlite3.connect(self.path, timeout=self.BUSY_TIMEOUT, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES, cached_statements=self.STATEMENT_CACHE)
+        for pragma in ("journal_mode = WAL", "synchronous = NORMAL", "foreign_keys = ON", "temp_store = MEMORY",
+                       f"mmap_size = {self.MMAP_SIZE}", f"cache_size = -{self.CACHE_KB}"):
+            conn.execute(f"PRAGMA {pragma}")
+        conn.create_function('NOW', 0, lambda: datetime.now().isoformat(' ', 'milliseconds'))
+        conn.create_function('today', 0, lambda: date.today().isoformat())
+        conn.create_function('GREATEST', -1, self._greatest, deterministic=True)
+        conn.create_function('LEAST', -1, self._least, deterministic=True)
+        # lower() có sẵn của SQLite chỉ đổi chữ ASCII; PostgreSQL đổi cả chữ có dấu
+        conn.create_function('lower', 1, lambda text: text.lower() if isinstance(text, str) else text,
+                             deterministic=True)
+        conn.create_function('fold', 1, fold_text, deterministic=True)
+        with self._lock:
+            self.opened += 1
+        return conn
+
+    @staticmethod
+    def _greatest(*values):
+        return max((value for value in values if value is not None), default=None)
+
+    @staticmethod
+    def _least(*values):
+        return min((value for value in values if value is not None), default=None)
+
+    # Chuỗi hằng '...' ('' là dấu nháy bên trong chuỗi)
+    LITERAL = re.compile(r"('(?:[^']|'')*')")
+
+    @staticmethod
+    @lru_cache(maxsize=1024)
+    def translate(query, has_params=True):
+        """
+        DỊCH CÂU SQL VIẾT CHO PostgreSQL SANG SQLITE -> (câu SQL, có ghi dữ liệu / cần khóa ghi không)
+        - Chỉ dịch phần nằm ngoài chuỗi hằng '...': nội dung chuỗi giữ nguyên (trừ %% -> % như psycopg2)
+        - Không có tham số thì giữ nguyên ký tự % (như psycopg2)
+        """
+        parts = SQLiteEngine.LITERAL.split(query)   # Phần tử lẻ là chuỗi hằng
+        code = ' '.join(parts[::2])
+        write = bool(re.search(r'\bFOR\s+UPDATE\b', code)) or not re.match(r'\s*(SELECT|WITH)\b', query, re.I)
+        for i in range(0, len(parts), 2):
+            sql = re.sub(r'\s+FOR\s+UPDATE(\s+SKIP\s+LOCKED)?', '', parts[i])
+            sql = re.sub(r'::\w+(\[\])?', '', sql)
+            sql = re.sub(r'=\s*ANY\((%\(\w+\)s|%s)\)', r'IN (SELECT value FROM json_each(\1))', sql)
+            sql = re.sub(r'\bCURRENT_DATE\s*-\s*([\w.]+)', r'CAST(julianday(today()) - julianday(\1) AS INTEGER)', sql)
+            sql = re.sub(r'\bCURRENT_DATE\b', 'today()', sql)
+            # UPDATE books b SET ... -> UPDATE books AS b SET ... (SQLite bắt buộc có AS)
+            sql = re.sub(r'\b(UPDATE|DELETE\s+FROM)\s+(?!SET\b|OF\b)(\w+)\s+(?!SET\b|WHERE\b|AS\b|RETURNING\b)(\w+)\b',
+                         r'\1 \2 AS \3', sql)
+            if has_params:
+                sql = re.sub(r'%\((\w+)\)s', r':\1', sql)
+                sql = sql.replace('%s', '?')
+            parts[i] = sql
+        sql = ''.join(parts)
+        return (sql.replace('%%', '%') if has_params else sql), write
+
+    @staticmethod
+    def adapt(params):
+        """THAM SỐ KIỂU DANH SÁCH (dùng với = ANY) -> chuỗi JSON cho json_each"""
+        def value(v):
+            return json.dumps(list(v)) if isinstance(v, (list, tuple, set)) else v
+        if params is None:
+            return None
+        if isinstance(params, dict):
+            return {k: value(v) for k, v in params.items()}
+        return [value(v) for v in params]
+
+    @staticmethod
+    def to_psycopg2(error):
+        """ĐỔI LỖI sqlite3 SANG LỖI psycopg2 TƯƠNG ỨNG"""
+        message = str(error)
+        if isinstance(error, sqlite3.IntegrityError):
+            if 'UNIQUE' in message:
+                return errors.UniqueViolation(message)
+            if 'FOREIGN KEY' in message:
+                return errors.ForeignKeyViolation(message)
+            return psycopg2.IntegrityError(message)
+        if 'no such table' in message:
+            return errors.UndefinedTable(message)
+        if isinstance(error, sqlite3.OperationalError):
+            return psycopg2.OperationalError(message)
+        return psycopg2.DatabaseError(message)
+
+    @staticmethod
+    def add_missing_columns(cursor, table, columns):
+        """ALTER TABLE ADD COLUMN cho các cột chưa có (SQLite không có ADD COLUMN IF NOT EXISTS)"""
+        cursor.execute(f"PRAGMA table_info({table})")
+        existing = {row[1] for row in cursor.fetchall()}
+        for name, definition in columns.items():
+            if name not in existing:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+    def migrate(self, conn):
+        """
+        ÁP DỤNG CÁC MIGRATION SQLITE CÒN THIẾU (1 transaction, BEGIN IMMEDIATE thay cho advisory lock)
+        - Trả về danh sách phiên bản vừa áp dụng
+        """
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                applied_at TIMESTAMP DEFAULT {self.LOCAL_NOW}
+            )
+        """)
+        conn.commit()
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        if cursor.fetchone()[0] >= self.latest():
+            return []
+
+        conn.raw.execute("BEGIN IMMEDIATE")
+        try:
+            # Process khác có thể vừa migrate xong trong lúc mình chờ khóa ghi
+            cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            current = cursor.fetchone()[0]
+            applied = []
+            for version, name, steps in self.MIGRATIONS:
+                if version <= current:
+                    continue
+                for step in steps:
+                    if callable(step):
+                        step(cursor)
+                    else:
+                        cursor.execute(step)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                applied.append(version)
+                log.info("Migration SQLite %03d_%s đã áp dụng.", version, name)
+            conn.commit()
+            return applied
+        except Exception:
+            conn.rollback()
+            raise
+
+    def stats(self):
+        return {'engine': 'sqlite', 'path': self.path, 'connections': self.opened,
+                'sqlite_version': sqlite3.sqlite_version}
+
+    def reset_after_fork(self):
+        """Kết nối sqlite3 không dùng được qua fork: mỗi process con tự mở lại"""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.opened = 0
+
+
+# Ngày giờ lưu dạng ISO cùng độ chính xác phần nghìn giây với LOCAL_NOW (so sánh chuỗi đúng thứ tự
+# thời gian, cursor phân trang khớp đúng dòng), đọc ra lại thành datetime / date
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' ', 'milliseconds'))
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()))
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()))
+
+SQLITE_ENGINE = SQLiteEngine()
+
+
+class PostgresBackend:
+    """
+    CÂU SQL RIÊNG CỦA POSTGRESQL (DB_ENGINE=postgres)
+    - User / Admin / Waitlist / OverdueEngine / BookImporter / LibrarySystem gọi BACKEND.<method>,
+      không tự rẽ nhánh theo engine: mỗi engine 1 class cùng các method, cùng kết quả
+    - PostgreSQL: CTE ghi dữ liệu (1 câu, 1 round trip), LATERAL + SKIP LOCKED, COPY, advisory lock
+    - Cờ LISTEN / SLOW_QUERIES / FRAGMENT_TABLE: tính năng chỉ engine này có
+    """
+
+    NAME = 'postgres'
+    LISTEN = True            # LISTEN/NOTIFY phiên bản danh mục (CatalogVersion)
+    SLOW_QUERIES = True      # Bảng slow_queries + EXPLAIN (SlowQueryLog)
+    FRAGMENT_TABLE = True    # Bảng UNLOGGED fragment_cache (FragmentCache)
+    migrations = SchemaMigrations
+
+    @staticmethod
+    def try_lock(cursor, key):
+        """GIÀNH ADVISORY LOCK (cấp session) -> True / False nếu process khác đang giữ"""
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (key,))
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def unlock(cursor, key):
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (key,))
+
+    @staticmethod
+    def next_catalog_version(cursor, channel):
+        """LẤY PHIÊN BẢN DANH MỤC MỚI + NOTIFY các worker khác (gửi đi khi transaction commit)"""
+        cursor.execute("SELECT v, pg_notify(%s, v::text) FROM nextval('catalog_version_seq') AS v", (channel,))
+        return cursor.fetchone()[0]
+
+    @staticmethod
+    def add_to_cart(cursor, params):
+        """THÊM VÀO GIỎ (User.ADD_TO_CART_SQL) -> (available, đã thêm?)"""
+        cursor.execute(User.ADD_TO_CART_SQL, params)
+        return cursor.fetchone()
+
+    @staticmethod
+    def checkout(cursor, user_id, due_date):
+        """1 câu: khóa giỏ, giữ bản, tạo giao dịch, xóa khỏi giỏ -> [(book_id, title, đã mượn được?)]"""
+        cursor.execute('''
+            WITH cart_books AS (
+                SELECT book_id FROM cart
+                WHERE user_id = %(user_id)s
+                FOR UPDATE
+            ),
+            reserved AS (
+                UPDATE books b
+                SET available = b.available - 1
+                FROM cart_books c
+                WHERE b.id = c.book_id AND b.available > 0
+                RETURNING b.id
+            ),
+            inserted AS (
+                INSERT INTO transactions (user_id, book_id, due_date)
+                SELECT %(user_id)s, id, %(due_date)s FROM reserved
+                RETURNING book_id
+            ),
+            removed AS (
+                DELETE FROM cart
+                WHERE user_id = %(user_id)s AND book_id IN (SELECT book_id FROM inserted)
+                RETURNING book_id
+            ),
+            stats AS (
+                UPDATE library_stats
+                SET available_copies = available_copies - (SELECT COUNT(*) FROM inserted),
+                    active_borrows = active_borrows + (SELECT COUNT(*) FROM inserted)
+                WHERE slot = %(slot)s
+            )
+            SELECT c.book_id, bk.title, r.book_id IS NOT NULL AS reserved
+            FROM cart_books c
+            JOIN books bk ON bk.id = c.book_id
+            LEFT JOIN removed r ON r.book_id = c.book_id
+            ORDER BY bk.title
+        ''', {'user_id': user_id, 'due_date': due_date, 'slot': LibraryStats.random_slot()})
+        return cursor.fetchall()
+
+    @staticmethod
+    def cancel_waitlist(cursor, user_id, book_id):
+        """HỦY LƯỢT CHỜ ĐANG MỞ -> (trạng thái CŨ,) hoặc None nếu không có"""
+        cursor.execute('''
+            WITH target AS (
+                SELECT id, status FROM waitlist
+                WHERE user_id = %s AND book_id = %s AND status IN ('waiting', 'held')
+                FOR UPDATE
+            )
+            UPDATE waitlist w SET status = 'cancelled'
+            FROM target t
+            WHERE w.id = t.id
+            RETURNING t.status
+        ''', (user_id, book_id))
+        return cursor.fetchone()
+
+    @staticmethod
+    def claim_hold(cursor, params):
+        """LƯỢT GIỮ CÒN HẠN -> 1 GIAO DỊCH MƯỢN -> (transaction_id,) hoặc None"""
+        cursor.execute('''
+            WITH claimed AS (
+                UPDATE waitlist SET status = 'claimed'
+                WHERE user_id = %(user_id)s AND book_id = %(book_id)s
+                  AND status = 'held' AND held_until > NOW()
+                RETURNING book_id
+            )
+            INSERT INTO transactions (user_id, book_id, due_date)
+            SELECT %(user_id)s, book_id, %(due_date)s FROM claimed
+            RETURNING id
+        ''', params)
+        return cursor.fetchone()
+
+    @staticmethod
+    def release_copies(cursor, copies, hours, slot):
+        """1 câu cho mọi sách (xem Waitlist.release_copies) -> {book_id: [user_id được giữ sách]}"""
+        book_ids = list(copies)
+        cursor.execute('''
+            WITH returned AS (
+                SELECT * FROM unnest(%(book_ids)s::int[], %(counts)s::int[]) AS r(book_id, copies)
+            ),
+            next_waiters AS (
+                -- Chỉ khóa đúng `copies` người đầu hàng của mỗi sách: lượt trả song song
+                -- bỏ qua những người này và lấy những người kế tiếp
+                SELECT w.id
+                FROM returned r
+                CROSS JOIN LATERAL (
+                    SELECT id FROM waitlist
+                    WHERE book_id = r.book_id AND status = 'waiting'
+                    ORDER BY created_at, id
+                    LIMIT r.copies
+                    FOR UPDATE SKIP LOCKED
+                ) w
+            ),
+            held AS (
+                UPDATE waitlist w
+                SET status = 'held', held_until = NOW() + make_interval(hours => %(hours)s)
+                FROM next_waiters n
+                WHERE w.id = n.id
+                RETURNING w.book_id, w.user_id, w.created_at, w.id
+            ),
+            freed AS (
+                UPDATE books b SET available = b.available + f.copies
+                FROM (SELECT r.book_id, r.copies - COUNT(h.user_id) AS copies
+                      FROM returned r LEFT JOIN held h ON h.book_id = r.book_id
+                      GROUP BY r.book_id, r.copies) f
+                WHERE b.id = f.book_id AND f.copies > 0
+                RETURNING f.copies
+            ),
+            stats AS (
+                UPDATE library_stats
+                SET available_copies = available_copies + (SELECT COALESCE(SUM(copies), 0) FROM freed)
+                WHERE slot = %(slot)s
+            )
+            SELECT book_id, user_id FROM held ORDER BY book_id, created_at, id
+        ''', {'book_ids': book_ids, 'counts': [copies[b] for b in book_ids], 'hours': hours, 'slot': slot})
+        held = {}
+        for book_id, user_id in cursor.fetchall():
+            held.setdefault(book_id, []).append(user_id)
+        return held
+
+    @staticmethod
+    def refresh_summary(cursor, params, only_user, only_summary_user):
+        """1 câu: upsert user còn quá hạn, xóa user hết quá hạn -> (số giao dịch quá hạn, số user)"""
+        cursor.execute(f'''
+            WITH agg AS (
+                SELECT t.user_id,
+                       COUNT(*) AS overdue_loans,
+                       SUM(CURRENT_DATE - t.due_date) AS late_days,
+                       SUM({OverdueEngine.FINE_SQL}) AS fines,
+                       MIN(t.due_date) AS oldest_due
+                FROM transactions t
+                WHERE t.status = 'borrowed' AND t.due_date < CURRENT_DATE {only_user}
+                GROUP BY t.user_id
+            ),
+            upserted AS (
+                INSERT INTO overdue_summary (user_id, overdue_loans, late_days, fines, oldest_due, updated_at)
+                SELECT user_id, overdue_loans, late_days, fines, oldest_due, NOW() FROM agg
+                ON CONFLICT (user_id) DO UPDATE
+                SET overdue_loans = EXCLUDED.overdue_loans,
+                    late_days = EXCLUDED.late_days,
+                    fines = EXCLUDED.fines,
+                    oldest_due = EXCLUDED.oldest_due,
+                    updated_at = EXCLUDED.updated_at
+                RETURNING user_id
+            ),
+            removed AS (
+                -- CTE ghi luôn được thực thi dù câu chính không đọc tới
+                DELETE FROM overdue_summary s
+                WHERE {only_summary_user} NOT EXISTS (SELECT 1 FROM agg WHERE agg.user_id = s.user_id)
+            )
+            SELECT COALESCE((SELECT SUM(overdue_loans) FROM agg), 0)::bigint, (SELECT COUNT(*) FROM upserted)
+        ''', params)
+        return cursor.fetchone()
+
+    @staticmethod
+    def return_books(conn, transaction_ids):
+        """
+        1 câu: khóa giao dịch theo thứ tự id, đánh dấu đã trả, cộng điểm
+        - Trả về dict theo đúng thứ tự mã gửi lên: transaction_id, previous_status, user_id, book_id,
+          points, late_days, fine (book_id = None nếu không trả được)
+        """
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(f'''
+            WITH requested AS (
+                SELECT id, position FROM unnest(%(ids)s::int[]) WITH ORDINALITY AS r(id, position)
+            ),
+            locked AS (
+                SELECT id FROM transactions
+                WHERE id = ANY(%(ids)s) AND status = 'borrowed'
+                ORDER BY id
+                FOR UPDATE
+            ),
+            returned AS (
+                UPDATE transactions t
+                SET status = 'returned', return_date = NOW(),
+                    points_earned = CASE WHEN CURRENT_DATE <= t.due_date THEN 20 ELSE 5 END,
+                    late_days = GREATEST(CURRENT_DATE - t.due_date, 0),
+                    fine = {OverdueEngine.FINE_SQL}
+                FROM locked l
+                WHERE t.id = l.id
+                RETURNING t.id, t.user_id, t.book_id, t.points_earned, t.late_days, t.fine
+            ),
+            credited AS (
+                UPDATE users u SET points = u.points + p.points
+                FROM (SELECT user_id, SUM(points_earned) AS points FROM returned GROUP BY user_id) p
+                WHERE u.id = p.user_id
+            )
+            SELECT q.id AS transaction_id, t.status AS previous_status,
+                   r.user_id, r.book_id, r.points_earned AS points, r.late_days, r.fine
+            FROM requested q
+            LEFT JOIN returned r ON r.id = q.id
+            LEFT JOIN transactions t ON t.id = q.id
+            ORDER BY q.position
+        ''', {'ids': transaction_ids, **OverdueEngine.fine_params()})
+        return cursor.fetchall()
+
+    @staticmethod
+    def import_chunk(cursor, chunk):
+        """COPY vào bảng tạm rồi INSERT ... SELECT sách chưa có -> (số sách, số bản, các dòng trùng)"""
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(chunk)   # Ô rỗng (None) -> NULL trong COPY CSV
+        buffer.seek(0)
+
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (BookImporter.LOCK_KEY,))
+        # Kiểm tra trùng bằng idx_books_title_author cho từng dòng của chunk: chi phí không đổi
+        # theo kích thước bảng books (hash join sẽ quét cả bảng ở mỗi chunk)
+        cursor.execute("SET LOCAL enable_hashjoin = off")
+        cursor.execute("SET LOCAL enable_mergejoin = off")
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS book_import (
+                line INTEGER,
+                title VARCHAR(255),
+                author VARCHAR(255),
+                category VARCHAR(100),
+                year INTEGER,
+                quantity INTEGER,
+                image_url TEXT,
+                description TEXT
+            ) ON COMMIT DELETE ROWS
+        ''')
+        cursor.copy_expert(
+            f"COPY book_import (line, {', '.join(BookImporter.FIELDS)}) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        # Trùng trong cùng chunk: giữ dòng đầu tiên; trùng sách đã có: bỏ qua
+        cursor.execute('''
+            WITH fresh AS MATERIALIZED (
+                SELECT DISTINCT ON (lower(s.title), lower(s.author)) s.*
+                FROM book_import s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM books b
+                    WHERE lower(b.title) = lower(s.title) AND lower(b.author) = lower(s.author)
+                )
+                ORDER BY lower(s.title), lower(s.author), s.line
+            ),
+            inserted AS (
+                INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
+                SELECT title, author, category, year, quantity, quantity, image_url, description
+                FROM fresh
+                ORDER BY line
+                RETURNING quantity
+            )
+            SELECT (SELECT COUNT(*) FROM inserted),
+                   (SELECT COALESCE(SUM(quantity), 0) FROM inserted),
+                   ARRAY(SELECT line FROM book_import
+                         WHERE line NOT IN (SELECT line FROM fresh) ORDER BY line)
+        ''')
+        return cursor.fetchone()
+
+    @staticmethod
+    def search_query(tokens, folded, pattern, limit, offset, year=None):
+        """
+        TÌM THEO CHỮ: tsvector (khớp tiền tố từng từ) + LIKE trên search_text, xếp theo ts_rank + similarity
+        - "dac nhan" -> 'dac:* & nhan:*'
+        - year: thêm cả sách xuất bản năm đó (idx_books_year)
+        """
+        tsquery = ' & '.join(f"{token}:*" for token in tokens)
+        by_year = "OR year = %(year)s" if year is not None else ""
+        return f'''
+            SELECT {LibrarySystem.BOOK_COLUMNS},
+                   ts_rank(search_vector, q.tsq) + similarity(search_text, %(folded)s) AS rank
+            FROM books, (SELECT to_tsquery('simple', %(tsquery)s) AS tsq) q
+            WHERE search_vector @@ q.tsq
+               OR search_text LIKE %(pattern)s
+               {by_year}
+            ORDER BY rank DESC, id ASC
+            LIMIT %(limit)s OFFSET %(offset)s
+        ''', {'folded': folded, 'tsquery': tsquery, 'pattern': pattern, 'year': year,
+              'limit': limit + 1, 'offset': offset}
+
+
+class SQLiteBackend:
+    """
+    CÂU SQL RIÊNG CỦA SQLITE (DB_ENGINE=sqlite), cùng method / kết quả với PostgresBackend
+    - Không có CTE ghi dữ liệu: tách thành nhiều câu; câu ghi đầu tiên giữ khóa ghi cả database
+      (BEGIN IMMEDIATE, xem SQLiteEngine.translate) nên không cần khóa từng dòng / advisory lock
+    - Tìm kiếm: FTS5 (bm25) + bảng trigram thay cho tsvector / pg_trgm
+    """
+
+    NAME = 'sqlite'
+    LISTEN = False           # touch() sau commit tự tăng epoch của process (không có NOTIFY)
+    SLOW_QUERIES = False     # Câu chậm chỉ ghi log
+    FRAGMENT_TABLE = False   # Cache HTML chỉ ở tầng trong process
+
+    # Cùng luật với User.ADD_TO_CART_SQL, tách thành 2 câu
+    ADD_TO_CART_SQL = (
+        '''
+        INSERT INTO cart (user_id, book_id)
+        SELECT %(user_id)s, id FROM books WHERE id = %(book_id)s AND available > 0
+        ON CONFLICT (user_id, book_id) DO NOTHING
+        ''',
+        "SELECT available FROM books WHERE id = %(book_id)s",
+    )
+
+    def __init__(self, engine):
+        self.migrations = engine
+
+    @staticmethod
+    def try_lock(cursor, key):
+        return True   # 1 node: khóa ghi của database đã xếp hàng các job
+
+    @staticmethod
+    def unlock(cursor, key):
+        pass
+
+    @staticmethod
+    def next_catalog_version(cursor, channel):
+        return None   # Không có sequence / NOTIFY
+
+    def add_to_cart(self, cursor, params):
+        insert, select = self.ADD_TO_CART_SQL
+        cursor.execute(insert, params)
+        added = cursor.rowcount > 0
+        cursor.execute(select, params)
+        return (cursor.fetchone() or (None,))[0], added
+
+    @staticmethod
+    def checkout(cursor, user_id, due_date):
+        """Đọc giỏ + available 1 lần (đã giữ khóa ghi nên không đổi tới lúc commit), rồi ghi theo lô"""
+        cursor.execute('''
+            SELECT c.book_id, b.title, b.available > 0
+            FROM cart c
+            JOIN books b ON b.id = c.book_id
+            WHERE c.user_id = %s
+            ORDER BY b.title
+            FOR UPDATE
+        ''', (user_id,))
+        results = [(book_id, title, bool(reserved)) for book_id, title, reserved in cursor.fetchall()]
+        reserved = [book_id for book_id, _, ok in results if ok]
+        if reserved:
+            cursor.executemany("UPDATE books SET available = available - 1 WHERE id = %s",
+                               [(book_id,) for book_id in reserved])
+            cursor.executemany("INSERT INTO transactions (user_id, book_id, due_date) VALUES (%s, %s, %s)",
+                               [(user_id, book_id, due_date) for book_id in reserved])
+            cursor.execute("DELETE FROM cart WHERE user_id = %s AND book_id = ANY(%s)", (user_id, reserved))
+            LibraryStats.bump(cursor, available_copies=-len(reserved), active_borrows=len(reserved))
+        return results
+
+    @staticmethod
+    def cancel_waitlist(cursor, user_id, book_id):
+        cursor.execute('''
+            SELECT id, status FROM waitlist
+            WHERE user_id = %s AND book_id = %s AND status IN ('waiting', 'held')
+            FOR UPDATE
+        ''', (user_id, book_id))
+        target = cursor.fetchone()
+        if target:
+            cursor.execute("UPDATE waitlist SET status = 'cancelled' WHERE id = %s", (target[0],))
+        return target[1:] if target else None
+
+    @staticmethod
+    def claim_hold(cursor, params):
+        cursor.execute('''
+            UPDATE waitlist SET status = 'claimed'
+            WHERE user_id = %(user_id)s AND book_id = %(book_id)s
+              AND status = 'held' AND held_until > NOW()
+        ''', params)
+        if not cursor.rowcount:
+            return None
+        cursor.execute('''
+            INSERT INTO transactions (user_id, book_id, due_date)
+            VALUES (%(user_id)s, %(book_id)s, %(due_date)s)
+            RETURNING id
+        ''', params)
+        return cursor.fetchone()
+
+    @staticmethod
+    def release_copies(cursor, copies, hours, slot):
+        """Mỗi sách 1 câu UPDATE ... LIMIT (không qua mạng nên vòng lặp rẻ)"""
+        held, freed = {}, []
+        for book_id, count in copies.items():
+            cursor.execute('''
+                UPDATE waitlist
+                SET status = 'held', held_until = strftime('%%Y-%%m-%%d %%H:%%M:%%f', NOW(), '+' || %(hours)s || ' hours')
+                WHERE id IN (SELECT id FROM waitlist
+                             WHERE book_id = %(book_id)s AND status = 'waiting'
+                             ORDER BY created_at, id
+                             LIMIT %(count)s)
+                RETURNING user_id, created_at, id
+            ''', {'book_id': book_id, 'count': count, 'hours': hours})
+            waiters = sorted(cursor.fetchall(), key=lambda row: (row[1], row[2]))
+            if waiters:
+                held[book_id] = [row[0] for row in waiters]
+            if count > len(waiters):
+                freed.append((count - len(waiters), book_id))
+        if freed:
+            cursor.executemany("UPDATE books SET available = available + %s WHERE id = %s", freed)
+            LibraryStats.bump(cursor, slot, available_copies=sum(n for n, _ in freed))
+        return held
+
+    @staticmethod
+    def refresh_summary(cursor, params, only_user, only_summary_user):
+        """Xóa user hết quá hạn, upsert phần còn lại, rồi đếm"""
+        overdue = f"t.status = 'borrowed' AND t.due_date < CURRENT_DATE {only_user}"
+        cursor.execute(f'''
+            DELETE FROM overdue_summary s
+            WHERE {only_summary_user} NOT EXISTS (
+                SELECT 1 FROM transactions t WHERE t.user_id = s.user_id AND {overdue}
+            )
+        ''', params)
+        cursor.execute(f'''
+            INSERT INTO overdue_summary (user_id, overdue_loans, late_days, fines, oldest_due, updated_at)
+            SELECT t.user_id, COUNT(*), SUM(CURRENT_DATE - t.due_date), SUM({OverdueEngine.FINE_SQL}),
+                   MIN(t.due_date), NOW()
+            FROM transactions t
+            WHERE {overdue}
+            GROUP BY t.user_id
+            ON CONFLICT (user_id) DO UPDATE
+            SET overdue_loans = EXCLUDED.overdue_loans,
+                late_days = EXCLUDED.late_days,
+                fines = EXCLUDED.fines,
+                oldest_due = EXCLUDED.oldest_due,
+                updated_at = EXCLUDED.updated_at
+        ''', params)
+        only = "WHERE s.user_id = ANY(%(user_ids)s)" if params['user_ids'] else ""
+        cursor.execute(f"SELECT COALESCE(SUM(overdue_loans), 0), COUNT(*) FROM overdue_summary s {only}", params)
+        return cursor.fetchone()
+
+    @staticmethod
+    def return_books(conn, transaction_ids):
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, status FROM transactions WHERE id = ANY(%s) FOR UPDATE", (transaction_ids,))
+        previous = dict(cursor.fetchall())
+        cursor.execute(f'''
+            UPDATE transactions t
+            SET status = 'returned', return_date = NOW(),
+                points_earned = CASE WHEN CURRENT_DATE <= t.due_date THEN 20 ELSE 5 END,
+                late_days = GREATEST(CURRENT_DATE - t.due_date, 0),
+                fine = {OverdueEngine.FINE_SQL}
+            WHERE t.id = ANY(%(ids)s) AND t.status = 'borrowed'
+            RETURNING id, user_id, book_id, points_earned, late_days, fine
+        ''', {'ids': transaction_ids, **OverdueEngine.fine_params()})
+        returned = {row[0]: row for row in cursor.fetchall()}
+
+        points = Counter()
+        for _, user_id, _, earned, _, _ in returned.values():
+            points[user_id] += earned
+        cursor.executemany("UPDATE users SET points = points + %s WHERE id = %s",
+                           [(earned, user_id) for user_id, earned in points.items()])
+
+        rows = []
+        for transaction_id in transaction_ids:
+            _, user_id, book_id, earned, late_days, fine = returned.get(transaction_id, (None,) * 6)
+            rows.append({'transaction_id': transaction_id, 'previous_status': previous.get(transaction_id),
+                         'user_id': user_id, 'book_id': book_id, 'points': earned,
+                         'late_days': late_days, 'fine': fine})
+        return rows
+
+    @staticmethod
+    def import_chunk(cursor, chunk):
+        """executemany vào bảng tạm (không có COPY) rồi INSERT ... SELECT sách chưa có"""
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS book_import (
+                line INTEGER, title TEXT, author TEXT, category TEXT,
+                year INTEGER, quantity INTEGER, image_url TEXT, description TEXT
+            )
+        ''')
+        cursor.execute("DELETE FROM book_import")
+        cursor.executemany(f"INSERT INTO book_import (line, {', '.join(BookImporter.FIELDS)}) "
+                           f"VALUES ({', '.join(['%s'] * 8)})", chunk)
+        # Trùng trong cùng chunk: giữ dòng đầu tiên; trùng sách đã có: bỏ qua
+        cursor.execute('''
+            CREATE TEMP TABLE IF NOT EXISTS book_import_fresh (line INTEGER PRIMARY KEY)
+        ''')
+        cursor.execute("DELETE FROM book_import_fresh")
+        cursor.execute('''
+            INSERT INTO book_import_fresh (line)
+            SELECT MIN(s.line) FROM book_import s
+            WHERE NOT EXISTS (
+                SELECT 1 FROM books b
+                WHERE lower(b.title) = lower(s.title) AND lower(b.author) = lower(s.author)
+            )
+            GROUP BY lower(s.title), lower(s.author)
+        ''')
+        cursor.execute('''
+            INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
+            SELECT title, author, category, year, quantity, quantity, image_url, description
+            FROM book_import
+            WHERE line IN (SELECT line FROM book_import_fresh)
+            ORDER BY line
+        ''')
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(quantity), 0) FROM book_import
+            WHERE line IN (SELECT line FROM book_import_fresh)
+        ''')
+        inserted, copies = cursor.fetchone()
+        cursor.execute('''
+            SELECT line FROM book_import
+            WHERE line NOT IN (SELECT line FROM book_import_fresh)
+            ORDER BY line
+        ''')
+        return inserted, copies, [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def search_query(tokens, folded, pattern, limit, offset, year=None):
+        """
+        TÌM THEO CHỮ: FTS5 books_fts (bm25, trọng số tên > tác giả > mô tả) + books_trgm cho 1 đoạn chữ
+        - "dac nhan" -> '"dac"* AND "nhan"*' (khớp tiền tố từng từ, như to_tsquery phía PostgreSQL)
+        - year: thêm cả sách xuất bản năm đó (idx_books_year)
+        """
+        match = ' AND '.join(f'"{token}"*' for token in tokens)
+        by_year = "UNION SELECT id FROM books WHERE year = %(year)s" if year is not None else ""
+        return f'''
+            SELECT {LibrarySystem.BOOK_COLUMNS}, COALESCE(-f.score, 0) AS rank
+            FROM books
+            LEFT JOIN (SELECT rowid, bm25(books_fts, 10.0, 5.0, 1.0) AS score
+                       FROM books_fts WHERE books_fts MATCH %(match)s) f ON f.rowid = books.id
+            WHERE books.id IN (SELECT rowid FROM books_fts WHERE books_fts MATCH %(match)s
+                               UNION
+                               SELECT rowid FROM books_trgm WHERE search_text LIKE %(pattern)s ESCAPE '\\'
+                               {by_year})
+            ORDER BY rank DESC, id ASC
+            LIMIT %(limit)s OFFSET %(offset)s
+        ''', {'match': match, 'pattern': pattern, 'year': year, 'limit': limit + 1, 'offset': offset}
+
+
+# Câu SQL riêng của engine đang dùng (domain chỉ gọi BACKEND.<method>)
+BACKEND = SQLiteBackend(SQLITE_ENGINE) if DatabaseManager.SQLITE else PostgresBackend()
+
+
+# Bộ failover dùng chung cho cả process
+FAILOVER = FailoverManager(DatabaseManager.BACKENDS, DatabaseManager._connect_backend)
+REPLICAS = ReplicaRouter(DatabaseManager.REPLICA_URLS, DatabaseManager._connect_backend)
+
+# Giữ tham chiếu tới pool kế thừa khi fork để GC không đóng nhầm socket của process cha
+_inherited_pools = []
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=DatabaseManager._reset_after_fork)
+    os.register_at_fork(after_in_child=METRICS.reset_after_fork)
+    os.register_at_fork(after_in_child=SLOW_QUERIES.reset_after_fork)
+    os.register_at_fork(after_in_child=SQLITE_ENGINE.reset_after_fork)
+    os.register_at_fork(after_in_child=configure_logging)
+
+
+
+class Person(ABC):
+    """
+    CLASS TRỪU TƯỢNG (ABSTRACT CLASS) - ĐẠI DIỆN CHO MỘT NGƯỜI DÙNG
+    - Đây là class cha, không thể tạo đối tượng trực tiếp
+    - Các class con (User, Admin) phải kế thừa và implement method get_permissions()
+    """
+    
+    def __init__(self, user_id, username, email, role, points=0):
+        """KHỞI TẠO: Lưu thông tin cơ bản của người dùng"""
+        self.user_id = user_id      # ID người dùng
+        self.username = username    # Tên đăng nhập
+        self.email = email          # Email
+        self.role = role            # Vai trò: 'user' hoặc 'admin'
+        self.points = points        # Điểm tích lũy
+    
+    @abstractmethod
+    def get_permissions(self):
+        """
+        METHOD TRỪU TƯỢNG: Mỗi class con phải tự định nghĩa quyền hạn
+        - User: chỉ được mượn/trả sách
+        - Admin: toàn quyền
+        """
+        pass
+    
+    def get_info(self):
+        """TRẢ VỀ THÔNG TIN CƠ BẢN CỦA NGƯỜI DÙNG dưới dạng dictionary"""
+        return {
+            'id': self.user_id,
+            'username': self.username,
+            'email': self.email,
+            'role': self.role,
+            'points': self.points
+        }
+
+
+class User(Person):
+    """
+    CLASS USER (NGƯỜI DÙNG THÔNG THƯỜNG)
+    - Kế thừa từ Person
+    - Có quyền: xem sách, thêm vào giỏ, mượn, trả sách
+    """
+    
+    def __init__(self, user_id, username, email, points=0):
+        """KHỞI TẠO: Gọi constructor của class cha với role='user'"""
+        super().__init__(user_id, username, email, 'user', points)
+        self.db = DatabaseManager()  # Tạo kết nối database
+    
+    def get_permissions(self):
+        """QUYỀN HẠN CỦA USER: chỉ được browse và borrow sách"""
+        return ['browse_books', 'borrow_books', 'return_books']
+    
+    # Câu SQL dùng chung với API bất đồng bộ (async_api.py): cùng luật nghiệp vụ, khác driver
+    ADD_TO_CART_SQL = '''
+        WITH book AS (
+            SELECT available FROM books WHERE id = %(book_id)s
+        ),
+        added AS (
+            INSERT INTO cart (user_id, book_id)
+            SELECT %(user_id)s, %(book_id)s FROM book WHERE available > 0
+            ON CONFLICT (user_id, book_id) DO NOTHING
+            RETURNING id
+        )
+        SELECT (SELECT available FROM book), EXISTS (SELECT 1 FROM added)
+    '''
+    CART_SQL = '''
+        SELECT c.id, b.id, b.title, b.author, b.category, b.image_url
+        FROM cart c
+        JOIN books b ON c.book_id = b.id
+        WHERE c.user_id = %s
+    '''
+    BORROWED_SQL = '''
+        SELECT t.id, b.title, b.author, t.borrow_date, t.due_date, b.image_url, b.id
+        FROM transactions t
+        JOIN books b ON t.book_id = b.id
+        WHERE t.user_id = %s AND t.status = 'borrowed'
+    '''
+
+    @staticmethod
+    def add_to_cart_result(row):
+        """DIỄN GIẢI KẾT QUẢ ADD_TO_CART_SQL -> (thành công?, thông báo)"""
+        available, added = row
+        if not available or available <= 0:
+            return False, "Sách không có sẵn! Bạn có thể đăng ký chờ để được giữ sách khi có người trả."
+        if not added:
+            return False, "Sách đã có trong giỏ!"
+        return True, "Đã thêm vào giỏ!"
+
+    def add_to_cart(self, book_id):
+        """
+        THÊM SÁCH VÀO GIỎ - 1 CÂU LỆNH
+        - Chỉ thêm khi sách còn available
+        - Sách đã có trong giỏ thì bỏ qua (UNIQUE (user_id, book_id))
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            
+            row = BACKEND.add_to_cart(cursor, {'user_id': self.user_id, 'book_id': book_id})
+            success, message = self.add_to_cart_result(row)
+            
+            conn.commit()
+            return success, message
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+    
+    def get_cart(self):
+        """
+        LẤY DANH SÁCH SÁCH TRONG GIỎ CỦA USER
+        - JOIN bảng cart với bảng books để lấy thông tin sách
+        """
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(self.CART_SQL, (self.user_id,))
+        
+        cart_items = cursor.fetchall()
+        conn.close()
+        return cart_items
+    
+    def checkout(self):
+        """
+        THANH TOÁN GIỎ HÀNG (MƯỢN TẤT CẢ SÁCH TRONG GIỎ) - 1 CÂU LỆNH DUY NHẤT
+        - Khóa giỏ của user (tránh bấm checkout 2 lần cùng lúc)
+        - Giảm available 1 lần cho mọi sách còn bản (available > 0), không bao giờ âm
+          kể cả khi nhiều người mượn cuốn cuối cùng cùng lúc
+        - Tạo transaction hàng loạt cho các sách đã giữ được (thời hạn 14 ngày)
+        - Chỉ xóa khỏi giỏ những sách đã mượn được; sách hết bản vẫn nằm lại trong giỏ
+        - Số round trip không đổi dù giỏ có bao nhiêu sách
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            
+            # Tính ngày phải trả (14 ngày sau)
+            due_date = (datetime.now() + timedelta(days=14)).date()
+            
+            results = BACKEND.checkout(cursor, self.user_id, due_date)
+            
+            if not results:
+                return False, "Giỏ trống!"
+            
+            CATALOG.bump(cursor)
+            conn.commit()
+            CATALOG.touch()
+
+            borrowed = [title for _, title, reserved in results if reserved]
+            unavailable = [title for _, title, reserved in results if not reserved]
+            if not borrowed:
+                return False, f"Không mượn được sách nào, đã hết bản: {', '.join(unavailable)}"
+            message = f"Đã mượn {len(borrowed)} cuốn sách!"
+            if unavailable:
+                message += f" Hết bản (vẫn giữ trong giỏ): {', '.join(unavailable)}"
+            return True, message
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+
+    def get_borrowed_books(self):
+        """
+        LẤY DANH SÁCH SÁCH ĐANG MƯỢN CỦA USER
+        - Chỉ lấy transaction có status = 'borrowed'
+        """
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor()
+        
+        cursor.execute(self.BORROWED_SQL, (self.user_id,))
+        
+        borrowed = cursor.fetchall()
+        conn.close()
+        return borrowed
+    
+    def return_book(self, transaction_id):
+        """
+        TRẢ SÁCH
+        - Kiểm tra transaction có tồn tại và thuộc user này không
+        - Tính điểm: +20 nếu trả đúng hạn, +5 nếu trả trễ
+        - Cập nhật status = 'returned', lưu return_date
+        - Có người đang chờ -> giữ bản vừa trả cho người đầu hàng chờ
+          Không ai chờ -> tăng available của sách
+        - Trả trễ: chốt số ngày trễ / tiền phạt, cập nhật bảng tổng hợp quá hạn của user
+        - Cộng điểm cho user
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+            
+            # Lấy thông tin transaction
+            cursor.execute('''
+                SELECT book_id, due_date FROM transactions
+                WHERE id = %s AND user_id = %s AND status = 'borrowed'
+                FOR UPDATE
+            ''', (transaction_id, self.user_id))
+            
+            result = cursor.fetchone()
+            if not result:
+                return False, "Không tìm thấy giao dịch!"
+            
+            book_id, due_date = result
+            return_date = datetime.now()
+            
+            # Tính điểm: đúng hạn +20, trễ hạn +5
+            points = 20 if return_date.date() <= due_date else 5
+            
+            # Cập nhật transaction, chốt số ngày trễ và tiền phạt
+            cursor.execute(f'''
+                UPDATE transactions t
+                SET status = 'returned', return_date = %(return_date)s, points_earned = %(points)s,
+                    late_days = GREATEST(CURRENT_DATE - t.due_date, 0),
+                    fine = {OverdueEngine.FINE_SQL}
+                WHERE t.id = %(id)s
+            ''', {'return_date': return_date, 'points': points, 'id': transaction_id,
+                  **OverdueEngine.fine_params()})
+            if return_date.date() > due_date:
+                OverdueEngine.refresh_summary(cursor, [self.user_id])
+            
+            # Giao bản vừa trả cho người đang chờ, hoặc tăng available (cùng 1 slot thống kê)
+            slot = LibraryStats.random_slot()
+            Waitlist.release_copy(cursor, book_id, slot)
+            LibraryStats.bump(cursor, slot, active_borrows=-1)
+            
+            # Cộng điểm cho user
+            cursor.execute("UPDATE users SET points = points + %s WHERE id = %s", (points, self.user_id))
+            
+            # Cập nhật points trong object
+            self.points += points
+            
+            conn.commit()
+            CATALOG.touch()
+            return True, f"Đã trả sách! +{points} điểm"
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+
+    def join_waitlist(self, book_id):
+        """
+        ĐĂNG KÝ CHỜ SÁCH ĐANG HẾT BẢN
+        - Sách còn bản thì không cần chờ (thêm vào giỏ như bình thường)
+        - Đã có trong hàng chờ rồi thì không thêm lần nữa
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+
+            cursor.execute("SELECT available FROM books WHERE id = %s", (book_id,))
+            result = cursor.fetchone()
+            if not result:
+                return False, "Không tìm thấy sách!"
+            if result[0] > 0:
+                return False, "Sách đang có sẵn, hãy thêm vào giỏ!"
+
+            cursor.execute('''
+                INSERT INTO waitlist (user_id, book_id)
+                VALUES (%s, %s)
+                ON CONFLICT (user_id, book_id) WHERE status IN ('waiting', 'held') DO NOTHING
+            ''', (self.user_id, book_id))
+            if cursor.rowcount == 0:
+                return False, "Bạn đã ở trong hàng chờ của sách này!"
+
+            conn.commit()
+            return True, "Đã đăng ký chờ! Sách sẽ được giữ cho bạn khi có người trả."
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+
+    def cancel_waitlist(self, book_id):
+        """
+        HỦY ĐĂNG KÝ CHỜ
+        - Nếu sách đang được giữ cho mình thì chuyển bản đó cho người kế tiếp
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+
+            # Trả về trạng thái CŨ để biết có phải đang giữ sách hay không
+            result = BACKEND.cancel_waitlist(cursor, self.user_id, book_id)
+            if not result:
+                return False, "Bạn không ở trong hàng chờ của sách này!"
+
+            if result[0] == 'held':
+                Waitlist.release_copy(cursor, book_id)
+
+            conn.commit()
+            CATALOG.touch()
+            return True, "Đã hủy đăng ký chờ."
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+
+    def claim_hold(self, book_id):
+        """
+        NHẬN SÁCH ĐANG ĐƯỢC GIỮ CHO MÌNH
+        - Chuyển lượt giữ (còn hạn) thành 1 lượt mượn 14 ngày, trong cùng 1 câu lệnh
+        - Bản giữ không nằm trong available nên không cần trừ available nữa
+        """
+        conn = None
+        try:
+            conn = self.db.get_connection()
+            cursor = conn.cursor()
+
+            due_date = (datetime.now() + timedelta(days=14)).date()
+            claimed = BACKEND.claim_hold(cursor, {'user_id': self.user_id, 'book_id': book_id, 'due_date': due_date})
+            if not claimed:
+                return False, "Không có sách nào đang được giữ cho bạn (hoặc đã quá hạn nhận)!"
+            LibraryStats.bump(cursor, active_borrows=1)
+
+            conn.commit()
+            return True, "Đã nhận sách được giữ! Hạn trả sau 14 ngày."
+        except Exception as e:
+            if conn:
+                conn.rollback()
+            return False, f"Lỗi: {e}"
+        finally:
+            if conn:
+                conn.close()
+
+    def get_overdue_summary(self):
+        """
+        TỔNG HỢP SÁCH QUÁ HẠN CỦA USER (đọc overdue_summary do job process_overdue dựng)
+        - Trả về dict overdue_loans, late_days, fines, oldest_due; không quá hạn thì None
+        """
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute('''
+            SELECT overdue_loans, late_days, fines, oldest_due
+            FROM overdue_summary
+            WHERE user_id = %s
+        ''', (self.user_id,))
+        summary = cursor.fetchone()
+        conn.close()
+        return summary
+
+    def get_waitlist(self):
+        """
+        LẤY DANH SÁCH SÁCH ĐANG CHỜ / ĐANG ĐƯỢC GIỮ CỦA USER
+        - Kèm vị trí trong hàng chờ (số người đứng trước)
+        """
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor()
+
+        cursor.execute('''
+            SELECT w.book_id, b.title, b.author, w.status, w.held_until,
+                   (SELECT COUNT(*) FROM waitlist w2
+                    WHERE w2.book_id = w.book_id AND w2.status = 'waiting'
+                      AND (w2.created_at, w2.id) < (w.created_at, w.id)) AS ahead
+            FROM waitlist w
+            JOIN books b ON w.book_id = b.id
+            WHERE w.user_id = %s AND w.status IN ('waiting', 'held')
+            ORDER BY w.created_at
+        ''', (self.user_id,))
+
+        waitlist = cursor.fetchall()
+        conn.close()
+        return waitlist
+
+
+class Waitlist:
+    """
+    HÀNG CHỜ SÁCH HOT (thao tác dùng chung cho trả sách / hủy chờ / hết hạn giữ)
+    - Mỗi bản sách được trả sẽ giữ cho người đầu hàng chờ trong HOLD_HOURS giờ
+    - Lấy người kế tiếp bằng FOR UPDATE SKIP LOCKED: nhiều lượt trả cùng lúc cho
+      1 cuốn sẽ lấy những người chờ khác nhau, không phải xếp hàng chờ khóa
+    """
+
+    HOLD_HOURS = int(os.environ.get('WAITLIST_HOLD_HOURS', 48))
+
+    @classmethod
+    def release_copy(cls, cursor, book_id, slot=None):
+        """
+        GIẢI PHÓNG 1 BẢN SÁCH (trong transaction của người gọi)
+        - Có người chờ -> chuyển sang 'held' kèm hạn nhận; không ai chờ -> available + 1
+        - slot: slot thống kê của transaction (xem LibraryStats.bump)
+        - Trả về user_id được giữ sách, hoặc None
+        """
+        held = cls.release_copies(cursor, {book_id: 1}, slot)
+        return held[book_id][0] if held else None
+
+    @classmethod
+    def release_copies(cls, cursor, copies, slot=None):
+        """
+        GIẢI PHÓNG NHIỀU BẢN CỦA NHIỀU SÁCH CÙNG LÚC (PostgreSQL: 1 câu lệnh; trong transaction của người gọi)
+        - copies: {book_id: số bản vừa trả}
+        - Mỗi sách: k bản đầu giao cho k người chờ đầu hàng, phần còn lại cộng 1 lần vào available
+        - slot: slot thống kê của transaction (xem LibraryStats.bump)
+        - Trả về {book_id: [user_id được giữ sách, theo thứ tự hàng chờ]}
+        """
+        slot = LibraryStats.random_slot() if slot is None else slot
+        held = BACKEND.release_copies(cursor, copies, cls.HOLD_HOURS, slot)
+        CATALOG.bump(cursor)
+        return held
+
+    @classmethod
+    def expire_holds(cls, conn):
+        """
+        HỦY CÁC LƯỢT GIỮ ĐÃ QUÁ HẠN NHẬN (chạy định kỳ)
+        - Mỗi bản bị hết hạn được chuyển tiếp cho người chờ kế tiếp hoặc trả về available
+        - Trả về số lượt giữ đã hết hạn
+        """
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE waitlist SET status = 'expired'
+            WHERE id IN (
+                SELECT id FROM waitlist
+                WHERE status = 'held' AND held_until <= NOW()
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING book_id
+        ''')
+        expired = [row[0] for row in cursor.fetchall()]
+        if expired:
+            cls.release_copies(cursor, Counter(expired))
+        conn.commit()
+        if expired:
+            CATALOG.touch()
+        return len(expired)
+
+
+class LibraryStats:
+    """
+    BỘ ĐẾM THỐNG KÊ CẬP NHẬT THEO TỪNG GIAO DỊCH
+    - Mỗi thao tác (mượn, trả, thêm/xóa sách, nhập kho, đăng ký) cộng/trừ bộ đếm
+      ngay trong transaction của nó -> dashboard chỉ cần đọc SLOTS dòng
+    - Chia thành nhiều slot, mỗi giao dịch chọn 1 slot ngẫu nhiên để các lượt mượn
+      đồng thời không phải chờ khóa trên cùng 1 dòng
+    - Transaction cập nhật bộ đếm nhiều lần phải dùng cùng 1 slot (random_slot() 1 lần rồi truyền
+      vào mọi lần cập nhật): 2 slot khác nhau theo thứ tự ngẫu nhiên có thể deadlock với nhau
+    - Job reconcile định kỳ tính lại từ bảng gốc để sửa sai lệch (nếu có)
+    """
+
+    SLOTS = 16
+    COLUMNS = ('total_books', 'total_copies', 'available_copies', 'total_users', 'active_borrows')
+
+    @classmethod
+    def random_slot(cls):
+        return random.randrange(cls.SLOTS)
+
+    @classmethod
+    def bump(cls, cursor, slot=None, **deltas):
+        """
+        CỘNG/TRỪ BỘ ĐẾM (trong transaction của người gọi), vd. bump(cursor, active_borrows=-1)
+        - slot: slot của transaction nếu nó cập nhật bộ đếm nhiều lần; None = chọn ngẫu nhiên
+        """
+        columns = [col for col in deltas if col in cls.COLUMNS]
+        if not columns:
+            return
+        assignments = ', '.join(f"{col} = {col} + %s" for col in columns)
+        cursor.execute(f"UPDATE library_stats SET {assignments} WHERE slot = %s",
+                       [deltas[col] for col in columns] + [cls.random_slot() if slot is None else slot])
+
+    @classmethod
+    def read(cls, cursor):
+        """ĐỌC TỔNG CÁC SLOT -> dict thống kê"""
+        sums = ', '.join(f"COALESCE(SUM({col}), 0)" for col in cls.COLUMNS)
+        cursor.execute(f"SELECT {sums} FROM library_stats")
+        return dict(zip(cls.COLUMNS, (int(value) for value in cursor.fetchone())))
+
+    @classmethod
+    def reconcile(cls, conn):
+        """
+        TÍNH LẠI THỐNG KÊ TỪ BẢNG GỐC VÀ GHI ĐÈ BỘ ĐẾM (chạy định kỳ)
+        - Khóa hết các slot trước (theo thứ tự slot, như mọi giao dịch khác chỉ khóa 1 slot thì
+          không thể khóa chéo), nên giao dịch đang dở sẽ commit xong rồi mới được đếm,
+          còn giao dịch mới phải chờ reconcile xong
+        - Trả về độ lệch đã sửa (chỉ các cột bị lệch)
+        """
+        cursor = conn.cursor()
+        cursor.execute("SELECT slot FROM library_stats ORDER BY slot FOR UPDATE")
+        before = cls.read(cursor)
+
+        cursor.execute('''
+            SELECT
+                (SELECT COUNT(*) FROM books),
+                (SELECT COALESCE(SUM(quantity), 0) FROM books),
+                (SELECT COALESCE(SUM(available), 0) FROM books),
+                (SELECT COUNT(*) FROM users WHERE role = 'user'),
+                (SELECT COUNT(*) FROM transactions WHERE status = 'borrowed')
+        ''')
+        actual = dict(zip(cls.COLUMNS, (int(value) for value in cursor.fetchone())))
+
+        assignments = ', '.join(f"{col} = CASE WHEN slot = 0 THEN %s ELSE 0 END" for col in cls.COLUMNS)
+        cursor.execute(f"UPDATE library_stats SET {assignments}", [actual[col] for col in cls.COLUMNS])
+        conn.commit()
+
+        drift = {col: actual[col] - before[col] for col in cls.COLUMNS if actual[col] != before[col]}
+        if drift:
+            log.warning("Thống kê bị lệch, đã sửa: %s", drift)
+        return drift
+
+
+class OverdueEngine:
+    """
+    XỬ LÝ SÁCH QUÁ HẠN THEO LÔ (set-based, chạy định kỳ bằng PeriodicJobs)
+    - 1 câu UPDATE đánh dấu giao dịch MỚI quá hạn (overdue_marked_at); dòng đã đánh dấu
+      không bị ghi lại mỗi ngày -> lượng ghi chỉ bằng số sách vừa trễ hạn hôm nay
+    - 1 câu tính số ngày trễ + tiền phạt của mọi giao dịch đang quá hạn (đọc qua partial index
+      idx_transactions_open_due) và dựng lại bảng overdue_summary (mỗi user 1 dòng) cho dashboard
+    - Khi trả sách, return_book chốt số ngày trễ / tiền phạt vào giao dịch và cập nhật tổng hợp của user
+    """
+
+    FINE_PER_DAY = int(os.environ.get('OVERDUE_FINE_PER_DAY', 2000))   # Tiền phạt mỗi ngày trễ (VND)
+    FINE_MAX = int(os.environ.get('OVERDUE_FINE_MAX', 100000))         # Trần tiền phạt mỗi giao dịch
+
+    # Tiền phạt của 1 giao dịch (t) tính tới hôm nay
+    FINE_SQL = "LEAST(GREATEST(CURRENT_DATE - t.due_date, 0) * %(per_day)s, %(fine_max)s)"
+
+    @classmethod
+    def fine_params(cls):
+        return {'per_day': cls.FINE_PER_DAY, 'fine_max': cls.FINE_MAX}
+
+    @classmethod
+    def run(cls, conn):
         """
-        METHOD TRỪU TƯỢNG: Mỗi class con phải tự định nghĩa quyền hạn
-        - User: chỉ được mượn/trả sách
-        - Admin: toàn quyền
+        JOB: ĐÁNH DẤU GIAO DỊCH QUÁ HẠN VÀ DỰNG LẠI BẢNG TỔNG HỢP (1 transaction)
+        - Trả về: số giao dịch vừa đánh dấu, số giao dịch đang quá hạn, số user bị ảnh hưởng
         """
-        pass
-    
-    def get_info(self):
-        """TRẢ VỀ THÔNG TIN CƠ BẢN CỦA NGƯỜI DÙNG dưới dạng dictionary"""
-        return {
-            'id': self.user_id,
-            'username': self.username,
-            'email': self.email,
-            'role': self.role,
-            'points': self.points
-        }
+        cursor = conn.cursor()
+        cursor.execute('''
+            UPDATE transactions
+            SET overdue_marked_at = NOW()
+            WHERE status = 'borrowed'
+              AND due_date < CURRENT_DATE
+              AND overdue_marked_at IS NULL
+        ''')
+        marked = cursor.rowcount
+        overdue_loans, users = cls.refresh_summary(cursor)
+        conn.commit()
+        return {'marked': marked, 'overdue_loans': overdue_loans, 'users': users}
 
+    @classmethod
+    def refresh_summary(cls, cursor, user_ids=None):
+        """
+        DỰNG LẠI overdue_summary TỪ CÁC GIAO DỊCH ĐANG QUÁ HẠN (cả bảng, hoặc chỉ các user cho trước)
+        - Upsert user còn quá hạn, xóa user đã hết quá hạn (PostgreSQL: cùng 1 câu lệnh, xem BACKEND)
+        - Trả về (số giao dịch quá hạn, số user)
+        """
+        params = {**cls.fine_params(), 'user_ids': list(user_ids or [])}
+        only_user = "AND t.user_id = ANY(%(user_ids)s)" if user_ids else ""
+        only_summary_user = "s.user_id = ANY(%(user_ids)s) AND" if user_ids else ""
+        return BACKEND.refresh_summary(cursor, params, only_user, only_summary_user)
 
-class User(Person):
+    @staticmethod
+    def totals(cursor):
+        """TỔNG HỢP QUÁ HẠN TOÀN HỆ THỐNG (đọc overdue_summary)"""
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(overdue_loans), 0)::bigint, COALESCE(SUM(fines), 0)::bigint
+            FROM overdue_summary
+        ''')
+        users, loans, fines = cursor.fetchone()
+        return {'overdue_users': users, 'overdue_loans': loans, 'overdue_fines': fines}
+
+
+class Admin(Person):
     """
-    CLASS USER (NGƯỜI DÙNG THÔNG THƯỜNG)
+    CLASS ADMIN (QUẢN TRỊ VIÊN)
     - Kế thừa từ Person
-    - Có quyền: xem sách, thêm vào giỏ, mượn, trả sách
+    - Có toàn quyền: quản lý sách, xem thống kê, xem lịch sử
     """
     
     def __init__(self, user_id, username, email, points=0):
-        """KHỞI TẠO: Gọi constructor của class cha với role='user'"""
-        super().__init__(user_id, username, email, 'user', points)
-        self.db = DatabaseManager()  # Tạo kết nối database
+        """KHỞI TẠO: Gọi constructor của class cha với role='admin'"""
+        super().__init__(user_id, username, email, 'admin', points)
+        self.db = DatabaseManager()
     
     def get_permissions(self):
-        """QUYỀN HẠN CỦA USER: chỉ được browse và borrow sách"""
-        return ['browse_books', 'borrow_books', 'return_books']
+        """QUYỀN HẠN CỦA ADMIN: toàn quyền"""
+        return ['all']
     
-    def add_to_cart(self, book_id):
+    def add_book(self, title, author, category, year, quantity, image_url='', description=''):
         """
-        THÊM SÁCH VÀO GIỎ
-        - Kiểm tra sách còn available không
-        - Kiểm tra sách đã có trong giỏ chưa
-        - Thêm vào bảng cart
+        THÊM SÁCH MỚI VÀO HỆ THỐNG
+        - available = quantity (sách mới thì tất cả đều available)
         """
         conn = None
         try:
             conn = self.db.get_connection()
             cursor = conn.cursor()
             
-            # Kiểm tra sách còn available không
-            cursor.execute("SELECT available FROM books WHERE id = %s", (book_id,))
-            result = cursor.fetchone()
-            
-            if not result or result[0] <= 0:
-                return False, "Sách không có sẵn!"
-            
-            # Kiểm tra sách đã có trong giỏ chưa
-            cursor.execute('''
-                SELECT * FROM cart WHERE user_id = %s AND book_id = %s
-            ''', (self.user_id, book_id))
-            
-            if cursor.fetchone():
-                return False, "Sách đã có trong giỏ!"
-            
-            # Thêm sách vào giỏ
             cursor.execute('''
-                INSERT INTO cart (user_id, book_id) VALUES (%s, %s)
-            ''', (self.user_id, book_id))
+                INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id
+            ''', (title, author, category, year, quantity, quantity, image_url, description))
+            book_id = cursor.fetchone()[0]
+            LibraryStats.bump(cursor, total_books=1, total_copies=quantity, available_copies=quantity)
+            CATALOG.bump(cursor)
             
             conn.commit()
-            return True, "Đã thêm vào giỏ!"
+            CATALOG.touch()
+
+            # Cập nhật chỉ mục gợi ý tìm kiếm
+            SUGGEST_INDEX.upsert({'id': book_id, 'title': title, 'author': author, 'available': quantity})
+            return True, "Đã thêm sách mới!"
         except Exception as e:
             if conn:
                 conn.rollback()
@@ -360,66 +3218,36 @@ class User(Person):
             if conn:
                 conn.close()
     
-    def get_cart(self):
-        """
-        LẤY DANH SÁCH SÁCH TRONG GIỎ CỦA USER
-        - JOIN bảng cart với bảng books để lấy thông tin sách
-        """
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT c.id, b.id, b.title, b.author, b.category, b.image_url
-            FROM cart c
-            JOIN books b ON c.book_id = b.id
-            WHERE c.user_id = %s
-        ''', (self.user_id,))
-        
-        cart_items = cursor.fetchall()
-        conn.close()
-        return cart_items
-    
-    def checkout(self):
+    def delete_book(self, book_id):
         """
-        THANH TOÁN GIỎ HÀNG (MƯỢN TẤT CẢ SÁCH TRONG GIỎ)
-        - Lấy tất cả book_id trong giỏ
-        - Tạo transaction cho từng sách (thời hạn 14 ngày)
-        - Giảm available của sách
-        - Xóa giỏ hàng
+        XÓA SÁCH
+        - Kiểm tra sách có đang được mượn không (status='borrowed')
+        - Nếu không ai mượn thì mới được xóa
         """
         conn = None
         try:
             conn = self.db.get_connection()
             cursor = conn.cursor()
             
-            # Lấy tất cả sách trong giỏ
-            cursor.execute("SELECT book_id FROM cart WHERE user_id = %s", (self.user_id,))
-            book_ids = [row[0] for row in cursor.fetchall()]
-            
-            if not book_ids:
-                return False, "Giỏ trống!"
-            
-            # Tính ngày mượn và ngày phải trả (14 ngày sau)
-            borrow_date = datetime.now()
-            due_date = (borrow_date + timedelta(days=14)).date()
-            
-            # Tạo transaction cho từng sách
-            for book_id in book_ids:
-                cursor.execute('''
-                    INSERT INTO transactions (user_id, book_id, due_date)
-                    VALUES (%s, %s, %s)
-                ''', (self.user_id, book_id, due_date))
-                
-                # Giảm available của sách
-                cursor.execute('''
-                    UPDATE books SET available = available - 1 WHERE id = %s
-                ''', (book_id,))
+            # Kiểm tra sách có đang được mượn không
+            cursor.execute('''
+                SELECT COUNT(*) FROM transactions
+                WHERE book_id = %s AND status = 'borrowed'
+            ''', (book_id,))
             
-            # Xóa giỏ hàng sau khi mượn
-            cursor.execute("DELETE FROM cart WHERE user_id = %s", (self.user_id,))
+            if cursor.fetchone()[0] > 0:
+                return False, "Không thể xóa sách đang được mượn!"
             
+            # Xóa sách
+            cursor.execute("DELETE FROM books WHERE id = %s RETURNING quantity, available", (book_id,))
+            deleted = cursor.fetchone()
+            if deleted:
+                LibraryStats.bump(cursor, total_books=-1, total_copies=-deleted[0], available_copies=-deleted[1])
+                CATALOG.bump(cursor)
             conn.commit()
-            return True, f"Đã mượn {len(book_ids)} cuốn sách!"
+            CATALOG.touch()
+            SUGGEST_INDEX.remove(book_id)
+            return True, "Đã xóa sách!"
         except Exception as e:
             if conn:
                 conn.rollback()
@@ -428,102 +3256,385 @@ class User(Person):
             if conn:
                 conn.close()
     
-    def get_borrowed_books(self):
+    def get_statistics(self):
         """
-        LẤY DANH SÁCH SÁCH ĐANG MƯỢN CỦA USER
-        - Chỉ lấy transaction có status = 'borrowed'
+        LẤY THỐNG KÊ HỆ THỐNG (đọc bộ đếm có sẵn, không quét bảng)
+        - Tổng số đầu sách, tổng số bản, số bản available
+        - Số user, số lượt mượn hiện tại
+        - Số sách / user quá hạn và tổng tiền phạt (từ overdue_summary)
         """
-        conn = self.db.get_connection()
+        conn = self.db.get_read_connection()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT t.id, b.title, b.author, t.borrow_date, t.due_date, b.image_url
-            FROM transactions t
-            JOIN books b ON t.book_id = b.id
-            WHERE t.user_id = %s AND t.status = 'borrowed'
-        ''', (self.user_id,))
+        stats = LibraryStats.read(cursor)
+        stats['borrowed_copies'] = stats['total_copies'] - stats['available_copies']  # Số bản đang mượn
+        stats.update(OverdueEngine.totals(cursor))  # Quá hạn (bảng tổng hợp của job process_overdue)
         
-        borrowed = cursor.fetchall()
         conn.close()
-        return borrowed
-    
-    def return_book(self, transaction_id):
+        return stats
+
+    # Trả sách hàng loạt tại quầy
+    BULK_RETURN_MAX = int(os.environ.get('BULK_RETURN_MAX', 200))
+
+    def return_books(self, transaction_ids):
         """
-        TRẢ SÁCH
-        - Kiểm tra transaction có tồn tại và thuộc user này không
-        - Tính điểm: +20 nếu trả đúng hạn, +5 nếu trả trễ
-        - Cập nhật status = 'returned', lưu return_date
-        - Tăng available của sách
-        - Cộng điểm cho user
+        TRẢ NHIỀU SÁCH CÙNG LÚC (quầy trả sách, 1 database transaction)
+        - 1 câu: khóa các giao dịch đang mượn theo thứ tự id, chốt trả (điểm / ngày trễ / tiền phạt)
+          và cộng điểm gộp theo user (mỗi user 1 lần UPDATE)
+        - 1 câu: giải phóng bản sách gộp theo sách (Waitlist.release_copies)
+        - Trả về danh sách kết quả theo đúng thứ tự mã giao dịch gửi lên (mã trùng chỉ tính 1 lần)
         """
+        transaction_ids = list(dict.fromkeys(transaction_ids))
+        if not transaction_ids:
+            return []
+        if len(transaction_ids) > self.BULK_RETURN_MAX:
+            raise ValueError(f"Tối đa {self.BULK_RETURN_MAX} giao dịch mỗi lần!")
+
         conn = None
         try:
             conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            # Lấy thông tin transaction
-            cursor.execute('''
-                SELECT book_id, due_date FROM transactions
-                WHERE id = %s AND user_id = %s AND status = 'borrowed'
-            ''', (transaction_id, self.user_id))
-            
-            result = cursor.fetchone()
-            if not result:
-                return False, "Không tìm thấy giao dịch!"
-            
-            book_id, due_date = result
-            return_date = datetime.now()
-            
-            # Tính điểm: đúng hạn +20, trễ hạn +5
-            points = 20 if return_date.date() <= due_date else 5
-            
-            # Cập nhật transaction
-            cursor.execute('''
-                UPDATE transactions
-                SET status = 'returned', return_date = %s, points_earned = %s
-                WHERE id = %s
-            ''', (return_date, points, transaction_id))
-            
-            # Tăng available của sách
-            cursor.execute("UPDATE books SET available = available + 1 WHERE id = %s", (book_id,))
-            
-            # Cộng điểm cho user
-            cursor.execute("UPDATE users SET points = points + %s WHERE id = %s", (points, self.user_id))
-            
-            # Cập nhật points trong object
-            self.points += points
-            
+            rows = BACKEND.return_books(conn, transaction_ids)
+
+            done = [row for row in rows if row['book_id'] is not None]
+            held = {}
+            if done:
+                cursor = conn.cursor()  # Các hàm dùng chung đọc kết quả dạng tuple
+                slot = LibraryStats.random_slot()   # 1 slot thống kê cho cả transaction
+                held = Waitlist.release_copies(cursor, Counter(row['book_id'] for row in done), slot)
+                LibraryStats.bump(cursor, slot, active_borrows=-len(done))
+                late_users = {row['user_id'] for row in done if row['late_days'] > 0}
+                if late_users:
+                    OverdueEngine.refresh_summary(cursor, late_users)
+
             conn.commit()
-            return True, f"Đã trả sách! +{points} điểm"
-        except Exception as e:
+            if done:
+                CATALOG.touch()
+        except Exception:
             if conn:
                 conn.rollback()
-            return False, f"Lỗi: {e}"
+            raise
         finally:
             if conn:
                 conn.close()
 
+        results = []
+        for row in rows:
+            item = {'transaction_id': row['transaction_id'], 'success': row['book_id'] is not None}
+            if item['success']:
+                # Bản sách được giao cho người chờ theo thứ tự các giao dịch trong yêu cầu
+                waiters = held.get(row['book_id'])
+                item.update(user_id=row['user_id'], book_id=row['book_id'], points=row['points'],
+                            late_days=row['late_days'], fine=row['fine'],
+                            held_for=waiters.pop(0) if waiters else None,
+                            message=f"Đã trả sách! +{row['points']} điểm")
+            elif row['previous_status'] == 'returned':
+                item['message'] = "Giao dịch này đã được trả trước đó!"
+            else:
+                item['message'] = "Không tìm thấy giao dịch!"
+            results.append(item)
+        return results
+
+    # Lịch sử giao dịch
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 200
 
-class Admin(Person):
+    def get_transactions(self, after=None, before=None, limit=None, **filters):
+        """
+        LẤY 1 TRANG LỊCH SỬ MƯỢN TRẢ (KEYSET PAGINATION THEO (borrow_date, id), mới nhất trước)
+        - after / before: cursor cuối trang trước / đầu trang sau (như danh mục sách)
+        - filters: như transaction_filters (ngày, trạng thái, quá hạn, user, sách)
+        - Đi theo index (..., borrow_date DESC, id DESC) -> trang N tốn như trang 1, không sort cả bảng
+        - Trả về dict: transactions (list dict), next_cursor, prev_cursor
+        """
+        limit = min(max(int(limit or self.HISTORY_PAGE_SIZE), 1), self.HISTORY_MAX_PAGE_SIZE)
+        after = LibrarySystem.decode_cursor(after) if after else None
+        before = LibrarySystem.decode_cursor(before) if before else None
+
+        where, params = self.transaction_filters(**filters)
+        conditions = [where[len("WHERE "):]] if where else []
+        if before:
+            # Đi ngược: lấy các giao dịch mới hơn cursor rồi đảo lại thứ tự
+            conditions.append("(t.borrow_date, t.id) > (%s, %s)")
+            params.extend(before)
+            order = "t.borrow_date ASC, t.id ASC"
+        else:
+            if after:
+                conditions.append("(t.borrow_date, t.id) < (%s, %s)")
+                params.extend(after)
+            order = "t.borrow_date DESC, t.id DESC"
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(f'''
+            SELECT t.id, t.user_id, u.username, t.book_id, b.title,
+                   t.borrow_date, t.due_date, t.return_date, t.status, t.points_earned,
+                   (t.status = 'borrowed' AND t.due_date < CURRENT_DATE) AS overdue
+            FROM transactions t
+            JOIN users u ON t.user_id = u.id
+            JOIN books b ON t.book_id = b.id
+            {where}
+            ORDER BY {order}
+            LIMIT %s
+        ''', (*params, limit + 1))
+        rows = cursor.fetchall()
+        conn.close()
+
+        # Lấy dư 1 dòng để biết còn trang tiếp theo hay không
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+
+        has_next = has_more if not before else True
+        has_prev = has_more if before else bool(after)
+        first, last = (rows[0], rows[-1]) if rows else (None, None)
+        return {
+            'transactions': rows,
+            'next_cursor': LibrarySystem.encode_cursor(last['borrow_date'], last['id']) if rows and has_next else None,
+            'prev_cursor': LibrarySystem.encode_cursor(first['borrow_date'], first['id']) if rows and has_prev else None,
+        }
+
+    # Cột xuất lịch sử giao dịch (thứ tự cột trong file CSV / khóa trong NDJSON)
+    EXPORT_COLUMNS = ('id', 'user_id', 'username', 'book_id', 'title',
+                      'borrow_date', 'due_date', 'return_date', 'status', 'points_earned')
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 5000))
+
+    @staticmethod
+    def transaction_filters(date_from=None, date_to=None, status=None, overdue=False, user_id=None, book_id=None):
+        """
+        ĐIỀU KIỆN LỌC GIAO DỊCH -> (chuỗi WHERE, params)
+        - date_from / date_to: ngày (date) mượn, date_to tính trọn ngày
+        - status: 'borrowed' / 'returned'; overdue: đang mượn và đã quá hạn trả
+        - user_id / book_id: chỉ giao dịch của 1 user / 1 cuốn sách
+        """
+        conditions, params = [], []
+        if date_from:
+            conditions.append("t.borrow_date >= %s")
+            params.append(date_from)
+        if date_to:
+            conditions.append("t.borrow_date < %s")
+            params.append(date_to + timedelta(days=1))
+        if status:
+            conditions.append("t.status = %s")
+            params.append(status)
+        if overdue:
+            conditions.append("t.status = 'borrowed' AND t.due_date < CURRENT_DATE")
+        if user_id:
+            conditions.append("t.user_id = %s")
+            params.append(user_id)
+        if book_id:
+            conditions.append("t.book_id = %s")
+            params.append(book_id)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        return where, params
+
+    def export_transactions(self, **filters):
+        """
+        XUẤT LỊCH SỬ GIAO DỊCH (generator, mỗi lần yield 1 lô tuple theo EXPORT_COLUMNS)
+        - Đọc bằng named cursor (server-side): PostgreSQL giữ kết quả, Python chỉ giữ 1 lô
+          -> bộ nhớ không đổi dù có hàng chục triệu dòng
+        - Sắp theo id (quét theo khóa chính, dòng đầu tiên trả về ngay, không cần sort cả bảng)
+        """
+        where, params = self.transaction_filters(**filters)
+        conn = self.db.get_read_connection()
+        cursor = conn.cursor(name='transactions_export')
+        cursor.itersize = self.EXPORT_BATCH_SIZE
+        try:
+            cursor.execute(f'''
+                SELECT t.id, t.user_id, u.username, t.book_id, b.title,
+                       t.borrow_date, t.due_date, t.return_date, t.status, t.points_earned
+                FROM transactions t
+                JOIN users u ON t.user_id = u.id
+                JOIN books b ON t.book_id = b.id
+                {where}
+                ORDER BY t.id
+            ''', params)
+            while True:
+                rows = cursor.fetchmany(self.EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            conn.rollback()   # Chỉ đọc: kết thúc transaction giữ cursor
+            conn.close()
+
+    def get_book_by_id(self, book_id):
+        """
+        LẤY THÔNG TIN CHI TIẾT MỘT CUỐN SÁCH
+        - Dùng để hiển thị trang chi tiết hoặc form edit
+        - Dùng chung bản có cache của LibrarySystem
+        """
+        return library_system.get_book_by_id(book_id)
+
+
+class BookImporter:
     """
-    CLASS ADMIN (QUẢN TRỊ VIÊN)
-    - Kế thừa từ Person
-    - Có toàn quyền: quản lý sách, xem thống kê, xem lịch sử
+    NHẬP SÁCH HÀNG LOẠT TỪ CSV / JSONL (admin upload hoặc CLI: flask --app app import-books)
+    - Đọc file theo từng dòng (stream), kiểm tra hợp lệ, gom CHUNK_SIZE dòng rồi COPY vào bảng tạm
+    - Mỗi chunk 1 transaction: COPY -> INSERT ... SELECT các sách chưa có (trùng tên + tác giả,
+      không phân biệt hoa thường, thì bỏ qua) -> cập nhật thống kê và phiên bản danh mục
+    - Bộ nhớ không phụ thuộc kích thước file: chỉ giữ 1 chunk
+    - Chunk đã commit thì giữ nguyên nếu chunk sau lỗi (chạy lại file sẽ bỏ qua sách đã nhập)
+    - SQLite không có COPY: chunk được chèn vào bảng tạm bằng executemany
+    """
+
+    CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 5000))
+    LOCK_KEY = 4_271_002   # Advisory lock: 2 lần nhập chạy song song không chèn trùng lẫn nhau
+    FIELDS = ('title', 'author', 'category', 'year', 'quantity', 'image_url', 'description')
+
+    def __init__(self, db=None):
+        self.db = db or DatabaseManager()
+
+    @staticmethod
+    def detect_format(filename):
+        """ĐOÁN ĐỊNH DẠNG THEO ĐUÔI FILE: .jsonl / .ndjson -> 'jsonl', còn lại 'csv'"""
+        return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+    @staticmethod
+    def read_rows(stream, fmt):
+        """
+        ĐỌC FILE (text stream) THEO TỪNG DÒNG
+        - yield (số dòng, dict, lỗi đọc hoặc None)
+        - CSV phải có dòng tiêu đề: title,author,category,year,quantity,image_url,description
+        """
+        if fmt == 'csv':
+            reader = csv.DictReader(stream)
+            for row in reader:
+                yield reader.line_num, row, None
+        elif fmt == 'jsonl':
+            for line_no, line in enumerate(stream, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_no, json.loads(line), None
+                except ValueError as e:
+                    yield line_no, None, f"JSON không hợp lệ: {e}"
+        else:
+            raise ValueError(f"Định dạng không hỗ trợ: {fmt}")
+
+    @classmethod
+    def validate(cls, row):
+        """
+        KIỂM TRA 1 DÒNG (cùng luật với form thêm sách) -> tuple theo FIELDS
+        - Bắt buộc: title, author, category; quantity > 0 (mặc định 1)
+        - Sai thì raise ValueError kèm lý do
+        """
+        if not isinstance(row, dict):
+            raise ValueError("Mỗi dòng phải là 1 object")
+
+        def text(name, max_len=None):
+            value = row.get(name)
+            value = '' if value is None else str(value).replace('\x00', '').strip()
+            if max_len and len(value) > max_len:
+                raise ValueError(f"{name} dài quá {max_len} ký tự")
+            return value
+
+        def number(name, default):
+            value = row.get(name)
+            if value is None or str(value).strip() == '':
+                return default
+            try:
+                return int(str(value).strip())
+            except ValueError:
+                raise ValueError(f"{name} phải là số nguyên: {value!r}") from None
+
+        title, author, category = text('title', 255), text('author', 255), text('category', 100)
+        if not title or not author or not category:
+            raise ValueError("Thiếu title, author hoặc category")
+        year = number('year', None)
+        quantity = number('quantity', 1)
+        if quantity <= 0:
+            raise ValueError("quantity phải > 0")
+        return (title, author, category, year, quantity, text('image_url') or None, text('description') or None)
+
+    def run(self, stream, fmt):
+        """
+        NHẬP CẢ FILE (generator, để CLI / route hiển thị tiến độ trong lúc chạy)
+        - yield ('error', số dòng, lý do) cho mỗi dòng sai hoặc trùng
+        - yield ('progress', stats) sau mỗi chunk; stats: read, inserted, duplicates, invalid, seconds
+        """
+        stats = {'read': 0, 'inserted': 0, 'duplicates': 0, 'invalid': 0, 'seconds': 0.0}
+        start = time.monotonic()
+        chunk = []
+
+        def flush():
+            yield from self._copy_chunk(chunk, stats)
+            chunk.clear()
+            stats['seconds'] = round(time.monotonic() - start, 2)
+            yield 'progress', stats
+
+        for line_no, row, error in self.read_rows(stream, fmt):
+            stats['read'] += 1
+            if error is None:
+                try:
+                    chunk.append((line_no, *self.validate(row)))
+                except ValueError as e:
+                    error = str(e)
+            if error is not None:
+                stats['invalid'] += 1
+                yield 'error', line_no, error
+            elif len(chunk) >= self.CHUNK_SIZE:
+                yield from flush()
+
+        yield from flush()
+        if stats['inserted']:
+            SUGGEST_INDEX.invalidate()
+
+    def _copy_chunk(self, chunk, stats):
+        """COPY 1 CHUNK VÀO BẢNG TẠM RỒI CHÈN SÁCH MỚI (1 transaction)"""
+        if not chunk:
+            return
+
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.cursor()
+            inserted, copies, duplicate_lines = BACKEND.import_chunk(cursor, chunk)
+            if inserted:
+                LibraryStats.bump(cursor, total_books=inserted, total_copies=copies, available_copies=copies)
+                CATALOG.bump(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        if inserted:
+            CATALOG.touch()
+        stats['inserted'] += inserted
+        stats['duplicates'] += len(duplicate_lines)
+        for line_no in duplicate_lines:
+            yield 'error', line_no, "Trùng sách đã có (title + author)"
+
+
+def fold_text(text):
+    """
+    CHUẨN HÓA CHUỖI ĐỂ TÌM KIẾM: bỏ dấu tiếng Việt + chữ thường
+    - "Đắc Nhân Tâm" -> "dac nhan tam" (khớp với f_unaccent/lower phía PostgreSQL)
+    """
+    text = unicodedata.normalize('NFD', text or '')
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.replace('đ', 'd').replace('Đ', 'D').lower().strip()
+
+
+class LibrarySystem:
+    """
+    CLASS HỆ THỐNG THƯ VIỆN
+    - Quản lý đăng ký, đăng nhập
+    - Lấy danh sách sách
     """
     
-    def __init__(self, user_id, username, email, points=0):
-        """KHỞI TẠO: Gọi constructor của class cha với role='admin'"""
-        super().__init__(user_id, username, email, 'admin', points)
+    def __init__(self):
+        """KHỞI TẠO: Tạo kết nối database"""
         self.db = DatabaseManager()
     
-    def get_permissions(self):
-        """QUYỀN HẠN CỦA ADMIN: toàn quyền"""
-        return ['all']
-    
-    def add_book(self, title, author, category, year, quantity, image_url='', description=''):
+    def register(self, username, password, email):
         """
-        THÊM SÁCH MỚI VÀO HỆ THỐNG
-        - available = quantity (sách mới thì tất cả đều available)
+        ĐĂNG KÝ TÀI KHOẢN MỚI
+        - Mặc định role = 'user', points = 0
+        - Username phải unique (không trùng)
         """
         conn = None
         try:
@@ -531,12 +3642,18 @@ class Admin(Person):
             cursor = conn.cursor()
             
             cursor.execute('''
-                INSERT INTO books (title, author, category, year, quantity, available, image_url, description)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            ''', (title, author, category, year, quantity, quantity, image_url, description))
+                INSERT INTO users (username, password, email, role, points)
+                VALUES (%s, %s, %s, 'user', 0)
+            ''', (username, password, email))
+            LibraryStats.bump(cursor, total_users=1)
             
             conn.commit()
-            return True, "Đã thêm sách mới!"
+            return True, "Đăng ký thành công!"
+        except errors.UniqueViolation:
+            # Lỗi unique: username đã tồn tại
+            if conn:
+                conn.rollback()
+            return False, "Username đã tồn tại!"
         except Exception as e:
             if conn:
                 conn.rollback()
@@ -545,264 +3662,1001 @@ class Admin(Person):
             if conn:
                 conn.close()
     
-    def delete_book(self, book_id):
+    def login(self, username, password):
         """
-        XÓA SÁCH
-        - Kiểm tra sách có đang được mượn không (status='borrowed')
-        - Nếu không ai mượn thì mới được xóa
+        ĐĂNG NHẬP
+        - Kiểm tra username và password
+        - Trả về thông tin user nếu đúng
         """
         conn = None
         try:
             conn = self.db.get_connection()
             cursor = conn.cursor()
             
-            # Kiểm tra sách có đang được mượn không
             cursor.execute('''
-                SELECT COUNT(*) FROM transactions
-                WHERE book_id = %s AND status = 'borrowed'
-            ''', (book_id,))
+                SELECT id, username, email, role, points
+                FROM users
+                WHERE username = %s AND password = %s
+            ''', (username, password))
             
-            if cursor.fetchone()[0] > 0:
-                return False, "Không thể xóa sách đang được mượn!"
+            result = cursor.fetchone()
             
-            # Xóa sách
-            cursor.execute("DELETE FROM books WHERE id = %s", (book_id,))
-            conn.commit()
-            return True, "Đã xóa sách!"
+            if result:
+                # Tạo dictionary chứa thông tin user
+                user_dict = {
+                    'id': result[0],
+                    'username': result[1],
+                    'email': result[2],
+                    'role': result[3],
+                    'points': result[4]
+                }
+                return user_dict, "Đăng nhập thành công!"
+            else:
+                return None, "Sai username hoặc password!"
         except Exception as e:
-            if conn:
-                conn.rollback()
-            return False, f"Lỗi: {e}"
+            return None, f"Lỗi: {e}"
         finally:
             if conn:
                 conn.close()
     
-    def get_statistics(self):
+    # Phân trang danh mục sách
+    BOOKS_PAGE_SIZE = 24       # Số sách mặc định mỗi trang
+    BOOKS_MAX_PAGE_SIZE = 100  # Giới hạn trên, tránh client xin cả bảng
+
+    @classmethod
+    def page_limit(cls, limit):
+        """SỐ SÁCH MỖI TRANG: mặc định khi không có / bằng 0, kẹp trong [1, BOOKS_MAX_PAGE_SIZE]"""
+        return min(max(int(limit or cls.BOOKS_PAGE_SIZE), 1), cls.BOOKS_MAX_PAGE_SIZE)
+
+    @staticmethod
+    def encode_cursor(timestamp, row_id):
+        """MÃ HÓA VỊ TRÍ (thời điểm, id) CỦA 1 DÒNG thành chuỗi dùng trên URL (sách, giao dịch)"""
+        raw = f"{timestamp.isoformat()}|{row_id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """GIẢI MÃ CURSOR -> (thời điểm, id); cursor sai định dạng thì trả về None"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            timestamp, row_id = raw.rsplit('|', 1)
+            return datetime.fromisoformat(timestamp), int(row_id)
+        except (ValueError, TypeError):
+            return None
+
+    BOOK_COLUMNS = "id, title, author, category, year, quantity, available, image_url, description"
+
+    @classmethod
+    def book_from_row(cls, row):
+        """CHUYỂN 1 ROW (theo thứ tự BOOK_COLUMNS [, created_at]) THÀNH DICTIONARY"""
+        book = {
+            'id': row[0],
+            'title': row[1],
+            'author': row[2],
+            'category': row[3],
+            'year': row[4],
+            'quantity': row[5],
+            'available': row[6],
+            'image_url': row[7],
+            'description': row[8]
+        }
+        if len(row) > 9:
+            book['created_at'] = row[9]
+        return book
+
+    @classmethod
+    def catalog_query(cls, after, before, limit):
         """
-        LẤY THỐNG KÊ HỆ THỐNG
-        - Tổng số đầu sách, tổng số bản, số bản available
-        - Số user, số lượt mượn hiện tại
+        CÂU SQL LẤY 1 TRANG DANH MỤC: (sql, params)
+        - after / before là cursor đã giải mã; lấy dư 1 dòng để biết còn trang hay không
+        - Dùng chung cho get_all_books và API bất đồng bộ
         """
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        stats = {}
-        
-        # Thống kê sách
-        cursor.execute("SELECT COUNT(*), COALESCE(SUM(quantity), 0), COALESCE(SUM(available), 0) FROM books")
-        result = cursor.fetchone()
-        stats['total_books'] = result[0]        # Tổng số đầu sách
-        stats['total_copies'] = result[1]       # Tổng số bản
-        stats['available_copies'] = result[2]   # Số bản có sẵn
-        stats['borrowed_copies'] = stats['total_copies'] - stats['available_copies']  # Số bản đang mượn
-        
-        # Thống kê user
-        cursor.execute("SELECT COUNT(*) FROM users WHERE role = 'user'")
-        stats['total_users'] = cursor.fetchone()[0]
-        
-        # Số lượt mượn hiện tại
-        cursor.execute("SELECT COUNT(*) FROM transactions WHERE status = 'borrowed'")
-        stats['active_borrows'] = cursor.fetchone()[0]
-        
-        conn.close()
-        return stats
-    
-    def get_all_transactions(self):
+        columns = f"{cls.BOOK_COLUMNS}, created_at"
+        if before:
+            # Đi ngược: lấy các cuốn mới hơn cursor rồi đảo lại thứ tự
+            return f'''
+                SELECT {columns}
+                FROM books
+                WHERE (created_at, id) > (%s, %s)
+                ORDER BY created_at ASC, id ASC
+                LIMIT %s
+            ''', (*before, limit + 1)
+        if after:
+            return f'''
+                SELECT {columns}
+                FROM books
+                WHERE (created_at, id) < (%s, %s)
+                ORDER BY created_at DESC, id DESC
+                LIMIT %s
+            ''', (*after, limit + 1)
+        return f'''
+            SELECT {columns}
+            FROM books
+            ORDER BY created_at DESC, id DESC
+            LIMIT %s
+        ''', (limit + 1,)
+
+    @classmethod
+    def catalog_page(cls, rows, after, before, limit):
+        """GHÉP KẾT QUẢ catalog_query THÀNH dict: books, next_cursor, prev_cursor"""
+        # Lấy dư 1 dòng để biết còn trang tiếp theo hay không
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if before:
+            rows.reverse()
+
+        books = [cls.book_from_row(row) for row in rows]
+
+        has_next = has_more if not before else True
+        has_prev = has_more if before else bool(after)
+        return {
+            'books': books,
+            'next_cursor': cls.encode_cursor(books[-1]['created_at'], books[-1]['id']) if books and has_next else None,
+            'prev_cursor': cls.encode_cursor(books[0]['created_at'], books[0]['id']) if books and has_prev else None,
+        }
+
+    def get_all_books(self, after=None, before=None, limit=None):
         """
-        LẤY LỊCH SỬ MƯỢN TRẢ (50 GIAO DỊCH GẦN NHẤT)
-        - JOIN 3 bảng: transactions, users, books
-        - Sắp xếp theo thời gian mượn (mới nhất trước)
+        LẤY 1 TRANG SÁCH (KEYSET PAGINATION THEO (created_at, id))
+        - Sắp xếp theo ngày thêm (mới nhất trước), id để phân định khi trùng thời gian
+        - after: cursor của cuốn cuối trang trước -> lấy trang kế tiếp
+        - before: cursor của cuốn đầu trang sau -> lấy trang liền trước
+        - Chi phí mỗi trang như nhau dù danh mục lớn tới đâu (dùng index, không OFFSET)
+        - Trả về dict: books, next_cursor, prev_cursor (đọc qua BOOK_CACHE)
         """
-        conn = self.db.get_connection()
+        limit = self.page_limit(limit)
+        cache_key = ('page', after, before, limit, CATALOG.key())
+        page = BOOK_CACHE.get(cache_key)
+        if page is not None:
+            return page
+
+        after = self.decode_cursor(after) if after else None
+        before = self.decode_cursor(before) if before else None
+
+        conn = self.db.get_read_connection(catalog=True)
         cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT u.username, b.title, t.borrow_date, t.due_date, t.return_date, t.status
-            FROM transactions t
-            JOIN users u ON t.user_id = u.id
-            JOIN books b ON t.book_id = b.id
-            ORDER BY t.borrow_date DESC
-            LIMIT 50
-        ''')
-        
-        transactions = cursor.fetchall()
+        cursor.execute(*self.catalog_query(after, before, limit))
+        rows = cursor.fetchall()
         conn.close()
-        return transactions
+
+        page = self.catalog_page(rows, after, before, limit)
+        BOOK_CACHE.set(cache_key, page)
+        return page
+
+    BOOK_DETAIL_SQL = f"SELECT {BOOK_COLUMNS} FROM books WHERE id = %s"
 
     def get_book_by_id(self, book_id):
         """
-        LẤY THÔNG TIN CHI TIẾT MỘT CUỐN SÁCH
-        - Dùng để hiển thị trang chi tiết hoặc form edit
+        LẤY THÔNG TIN CHI TIẾT MỘT CUỐN SÁCH THEO ID
+        - Đọc qua cache (BOOK_CACHE), chỉ truy vấn database khi cache miss
         """
-        conn = self.db.get_connection()
+        key = ('book', book_id, CATALOG.key())
+        book = BOOK_CACHE.get(key)
+        if book is not None:
+            return book
+
+        conn = self.db.get_read_connection(catalog=True)
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT id, title, author, category, year, quantity, available, image_url, description
-            FROM books
-            WHERE id = %s
-        ''', (book_id,))
+        cursor.execute(self.BOOK_DETAIL_SQL, (book_id,))
         
         row = cursor.fetchone()
         conn.close()
         
         if row:
-            return {
-                'id': row[0],
-                'title': row[1],
-                'author': row[2],
-                'category': row[3],
-                'year': row[4],
-                'quantity': row[5],
-                'available': row[6],
-                'image_url': row[7],
-                'description': row[8]
-            }
+            book = self.book_from_row(row)
+            BOOK_CACHE.set(key, book)
+            return book
         return None
 
-class LibrarySystem:
+    # Tìm kiếm
+    SEARCH_PAGE_SIZE = 20   # Số kết quả mỗi trang
+    SEARCH_MAX_PAGE = 50    # Không cho lật quá sâu (OFFSET lớn vẫn tốn chi phí)
+
+    def search_books(self, query, page=1):
+        """
+        TÌM KIẾM SÁCH (dùng chỉ mục, không quét toàn bảng)
+        - Gõ đúng 4 chữ số (vd. 1984) -> sách xuất bản năm đó + sách có chữ đó trong tên / tác giả / mô tả
+        - Còn lại: full-text trên tên sách, tác giả, mô tả (đã bỏ dấu, khớp tiền tố từng từ)
+          hoặc trigram trên "tên + tác giả" để khớp một đoạn chữ bất kỳ
+        - Xếp theo độ liên quan; trả về dict: results, page, has_next
+        """
+        page = min(max(int(page or 1), 1), self.SEARCH_MAX_PAGE)
+        query_args = self.search_query(query, page)
+        if query_args is None:
+            return {'results': [], 'page': page, 'has_next': False}
+
+        conn = self.db.get_read_connection()
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(*query_args)
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        return self.search_page(rows, page)
+
+    @classmethod
+    def search_query(cls, query, page):
+        """
+        CÂU SQL TÌM KIẾM CHO 1 TRANG: (sql, params), hoặc None nếu không có từ khóa nào
+        - Dùng chung cho search_books và API bất đồng bộ
+        """
+        limit = cls.SEARCH_PAGE_SIZE
+        offset = (page - 1) * limit
+
+        folded = fold_text(query)
+        tokens = re.findall(r'[^\W_]+', folded)
+        if not tokens:
+            return None
+
+        # Từ khóa 4 chữ số: vừa là năm xuất bản vừa là chữ ("1984", "2001: A Space Odyssey")
+        year = int(query.strip()) if re.fullmatch(r'\d{4}', query.strip()) else None
+        # Escape ký tự đặc biệt của LIKE
+        pattern = '%' + re.sub(r'([\\%_])', r'\\\1', folded) + '%'
+        return BACKEND.search_query(tokens, folded, pattern, limit, offset, year)
+
+    @classmethod
+    def search_page(cls, rows, page):
+        """GHÉP KẾT QUẢ search_query THÀNH dict: results, page, has_next"""
+        # Lấy dư 1 dòng để biết còn trang sau hay không
+        return {
+            'results': rows[:cls.SEARCH_PAGE_SIZE],
+            'page': page,
+            'has_next': len(rows) > cls.SEARCH_PAGE_SIZE,
+        }
+
+
+
+class SuggestIndex:
     """
-    CLASS HỆ THỐNG THƯ VIỆN
-    - Quản lý đăng ký, đăng nhập
-    - Lấy danh sách sách
+    CHỈ MỤC GỢI Ý TÌM KIẾM TRONG BỘ NHỚ (autocomplete)
+    - Mảng đã sắp xếp các khóa (tên sách / tác giả đã bỏ dấu, cắt từ mỗi đầu từ) + bisect
+    - Nạp từ bảng books 1 lần cho mỗi process, sau đó cập nhật dần khi admin sửa danh mục
+    - Định kỳ nạp lại để đồng bộ thay đổi từ các worker khác
+    - Trả lời không cần chạm tới PostgreSQL
     """
-    
+
+    REFRESH_INTERVAL = float(os.environ.get('SUGGEST_REFRESH_INTERVAL', 300))  # Giây giữa 2 lần nạp lại
+    MAX_RESULTS = 10
+
     def __init__(self):
-        """KHỞI TẠO: Tạo kết nối database"""
-        self.db = DatabaseManager()
-    
-    def register(self, username, password, email):
+        self._lock = threading.Lock()
+        self._keys = []        # Danh sách (khóa, book_id) đã sắp xếp
+        self._book_keys = {}   # book_id -> các khóa của sách đó (để xóa nhanh)
+        self._books = {}       # book_id -> {'id', 'title', 'author', 'available'}
+        self.loaded_at = None
+        self._loading = False
+        self._retry_at = 0.0   # Nạp lỗi thì chờ 1 lúc mới thử lại
+
+    @staticmethod
+    def _make_keys(book):
+        """Mỗi đầu từ của tên sách và tác giả là 1 khóa: 'nhan tam' cũng gợi ý được 'Đắc Nhân Tâm'"""
+        keys = set()
+        for field in (book['title'], book['author']):
+            words = fold_text(field).split()
+            for i in range(len(words)):
+                keys.add(' '.join(words[i:]))
+        return keys
+
+    def load(self, db):
+        """NẠP LẠI TOÀN BỘ CHỈ MỤC TỪ BẢNG books"""
+        conn = db.get_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, title, author, available FROM books")
+            rows = cursor.fetchall()
+        finally:
+            conn.close()
+
+        books, book_keys, keys = {}, {}, []
+        for row in rows:
+            book = {'id': row[0], 'title': row[1], 'author': row[2], 'available': row[3]}
+            books[book['id']] = book
+            book_keys[book['id']] = self._make_keys(book)
+            keys.extend((key, book['id']) for key in book_keys[book['id']])
+        keys.sort()
+
+        with self._lock:
+            self._keys, self._book_keys, self._books = keys, book_keys, books
+            self.loaded_at = time.monotonic()
+        log.info("Đã nạp chỉ mục gợi ý: %d sách, %d khóa.", len(books), len(keys))
+
+    def refresh_async(self, db):
+        """NẠP (LẠI) Ở THREAD NỀN nếu chưa nạp hoặc đã quá REFRESH_INTERVAL"""
+        with self._lock:
+            now = time.monotonic()
+            stale = self.loaded_at is None or now - self.loaded_at > self.REFRESH_INTERVAL
+            if not stale or self._loading or now < self._retry_at:
+                return
+            self._loading = True
+
+        def run():
+            try:
+                self.load(db)
+            except Exception as e:
+                log.error("Nạp chỉ mục gợi ý thất bại: %s", e)
+                self._retry_at = time.monotonic() + 30
+            finally:
+                self._loading = False
+
+        threading.Thread(target=run, name='suggest-index-load', daemon=True).start()
+
+    def upsert(self, book):
+        """THÊM / CẬP NHẬT 1 SÁCH"""
+        with self._lock:
+            self._remove_locked(book['id'])
+            keys = self._make_keys(book)
+            for key in keys:
+                bisect.insort(self._keys, (key, book['id']))
+            self._book_keys[book['id']] = keys
+            self._books[book['id']] = dict(book)
+
+    def remove(self, book_id):
+        """XÓA 1 SÁCH KHỎI CHỈ MỤC"""
+        with self._lock:
+            self._remove_locked(book_id)
+
+    def invalidate(self):
+        """ĐÁNH DẤU CẦN NẠP LẠI (vd. sau khi nhập hàng loạt), lần refresh_async tới sẽ nạp ngay"""
+        with self._lock:
+            self.loaded_at = None
+
+    def _remove_locked(self, book_id):
+        for key in self._book_keys.pop(book_id, ()):
+            i = bisect.bisect_left(self._keys, (key, book_id))
+            if i < len(self._keys) and self._keys[i] == (key, book_id):
+                del self._keys[i]
+        self._books.pop(book_id, None)
+
+    def suggest(self, prefix, limit=MAX_RESULTS):
+        """TÌM CÁC SÁCH CÓ KHÓA BẮT ĐẦU BẰNG prefix (đã bỏ dấu)"""
+        prefix = ' '.join(fold_text(prefix).split())
+        if not prefix:
+            return []
+
+        results, seen = [], set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                key, book_id = self._keys[i]
+                if not key.startswith(prefix):
+                    break
+                if book_id not in seen:
+                    seen.add(book_id)
+                    results.append(self._books[book_id])
+                i += 1
+        return results
+
+    def stats(self):
+        with self._lock:
+            return {
+                'books': len(self._books),
+                'keys': len(self._keys),
+                'age_seconds': round(time.monotonic() - self.loaded_at, 1) if self.loaded_at else None,
+            }
+
+
+class PeriodicJobs:
+    """
+    CHẠY CÔNG VIỆC ĐỊNH KỲ Ở THREAD NỀN (hết hạn giữ sách, ...)
+    - Mỗi worker có 1 thread, nhưng mỗi lần chạy phải giành được advisory lock
+      của PostgreSQL nên cả cụm chỉ có 1 worker chạy 1 job tại 1 thời điểm
+    - Job nhận 1 kết nối (đang giữ lock) và tự commit
+    - Có thể chạy tay 1 job: flask --app app run-job <tên job>
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.jobs = {}          # name -> {'interval', 'func', 'next_run', 'last_result', 'last_error'}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, name, interval, func):
+        self.jobs[name] = {'interval': interval, 'func': func, 'next_run': 0.0,
+                           'last_run': None, 'last_result': None, 'last_error': None}
+
+    def start(self):
+        """KHỞI ĐỘNG THREAD NỀN (1 lần cho mỗi process, an toàn khi gọi nhiều lần)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._loop, name='periodic-jobs', daemon=True)
+            self._thread.start()
+
+    def run(self, name):
         """
-        ĐĂNG KÝ TÀI KHOẢN MỚI
-        - Mặc định role = 'user', points = 0
-        - Username phải unique (không trùng)
+        CHẠY 1 JOB NGAY (có giữ advisory lock)
+        - Trả về kết quả của job, hoặc None nếu process khác đang chạy job này
         """
-        conn = None
+        job = self.jobs[name]
+        lock_key = zlib.crc32(f"job:{name}".encode())
+        conn = self.db.get_connection()
         try:
-            conn = self.db.get_connection()
             cursor = conn.cursor()
-            
-            cursor.execute('''
-                INSERT INTO users (username, password, email, role, points)
-                VALUES (%s, %s, %s, 'user', 0)
-            ''', (username, password, email))
-            
-            conn.commit()
-            return True, "Đăng ký thành công!"
-        except errors.UniqueViolation:
-            # Lỗi unique: username đã tồn tại
-            if conn:
+            if not BACKEND.try_lock(cursor, lock_key):
                 conn.rollback()
-            return False, "Username đã tồn tại!"
-        except Exception as e:
-            if conn:
+                return None
+            try:
+                result = job['func'](conn)
+                job['last_result'], job['last_error'] = result, None
+                return result
+            except Exception as e:
                 conn.rollback()
-            return False, f"Lỗi: {e}"
+                job['last_error'] = str(e)
+                raise
+            finally:
+                BACKEND.unlock(conn.cursor(), lock_key)
+                conn.commit()
         finally:
-            if conn:
-                conn.close()
-    
-    def login(self, username, password):
+            job['last_run'] = datetime.now().isoformat(timespec='seconds')
+            conn.close()
+
+    def stats(self):
+        return {name: {key: job[key] for key in ('interval', 'last_run', 'last_result', 'last_error')}
+                for name, job in self.jobs.items()}
+
+    def _loop(self):
+        while True:
+            now = time.monotonic()
+            for name, job in self.jobs.items():
+                if job['next_run'] > now:
+                    continue
+                job['next_run'] = now + job['interval']
+                try:
+                    self.run(name)
+                except Exception as e:
+                    log.exception("Job định kỳ '%s' thất bại: %s", name, e)
+            time.sleep(1)
+
+
+class LRUCache:
+    """
+    CACHE LRU + TTL TRONG BỘ NHỚ (mỗi process 1 bản)
+    - Giới hạn theo dung lượng ước tính (max_bytes), đầy thì bỏ mục ít dùng nhất
+    - Mục quá ttl giây bị coi như không có
+    - Đếm hit / miss / eviction để theo dõi
+    """
+
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = self._estimate_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size, time.monotonic() + self.ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    @classmethod
+    def _estimate_size(cls, value):
+        """Ước lượng dung lượng (byte) của dict/list/chuỗi lồng nhau"""
+        if isinstance(value, dict):
+            return 64 + sum(cls._estimate_size(k) + cls._estimate_size(v) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return 56 + sum(cls._estimate_size(v) for v in value)
+        if isinstance(value, str):
+            return 49 + len(value.encode())
+        return 32
+
+
+class CatalogVersion:
+    """
+    PHIÊN BẢN DANH MỤC SÁCH (dùng làm khóa cache)
+    - Mỗi thao tác đổi sách gọi bump(cursor) trong transaction của nó: lấy số mới từ
+      catalog_version_seq và NOTIFY cho mọi worker (NOTIFY chỉ được gửi khi commit)
+    - Mỗi worker có 1 thread LISTEN để cập nhật version -> cache các worker cùng hết hạn
+    - touch() gọi sau commit để chính worker vừa ghi thấy thay đổi ngay, không chờ NOTIFY
+    - Mất kết nối LISTEN thì tự tăng epoch (bỏ cache) và kết nối lại; TTL của cache là lưới an toàn
+    - live = True khi đang LISTEN: chỉ khi đó version mới đủ tin cậy để làm ETag
+    """
+
+    CHANNEL = 'catalog_changed'
+
+    def __init__(self):
+        self.version = 0     # Phiên bản chung (giống nhau giữa các worker)
+        self.epoch = 0       # Bộ đếm riêng của process
+        self.changed_at = datetime.now()   # Lần cuối thấy danh mục đổi (Last-Modified)
+        self.live = False
+        self._lock = threading.Lock()
+        self._local = threading.local()    # Version vừa lấy trong transaction chưa commit
+        self._thread = None
+        self._pid = None
+
+    def key(self):
+        return (self.version, self.epoch)
+
+    def bump(self, cursor):
+        """GHI NHẬN DANH MỤC ĐÃ ĐỔI (gọi trong transaction, trước commit)"""
+        # SQLite: không có sequence / NOTIFY -> touch() sau commit tự tăng epoch của process
+        self._local.pending = BACKEND.next_catalog_version(cursor, self.CHANNEL)
+
+    def touch(self):
+        """GỌI SAU COMMIT: worker hiện tại bỏ cache cũ ngay"""
+        pending = getattr(self._local, 'pending', None)
+        self._local.pending = None
+        if pending:
+            self._advance(pending)
+        with self._lock:
+            self.epoch += 1
+
+    def _advance(self, version):
+        with self._lock:
+            if version > self.version:
+                self.version = version
+                self.changed_at = datetime.now()
+
+    def start(self):
+        """KHỞI ĐỘNG THREAD LISTEN (1 lần cho mỗi process; SQLite không có LISTEN)"""
+        if not BACKEND.LISTEN:
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen_loop, name='catalog-listen', daemon=True)
+            self._thread.start()
+
+    def _listen_loop(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                backend = FAILOVER.active or next(iter(FAILOVER.candidates()), None)
+                if backend is None:
+                    raise RuntimeError("Không có backend database nào khả dụng")
+                conn = DatabaseManager._connect_backend(backend)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.CHANNEL}")
+                cursor.execute("SELECT last_value FROM catalog_version_seq")
+                self._advance(cursor.fetchone()[0])
+                self.touch()   # Có thể đã lỡ NOTIFY trong lúc mất kết nối
+                self.live = True
+                backoff = 1
+
+                while True:
+                    if select.select([conn], [], [], 30) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self._advance(int(notify.payload))
+            except Exception as e:
+                log.warning("Mất kết nối LISTEN phiên bản danh mục: %s", e)
+                self.live = False
+                self.touch()
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60)
+
+
+class FragmentCache:
+    """
+    CACHE HTML ĐÃ RENDER (lưới sách giống nhau cho mọi người dùng cùng vai trò)
+    - Tầng 1: LRUCache trong process; tầng 2: bảng UNLOGGED fragment_cache dùng chung giữa các worker
+    - Khóa gồm phiên bản danh mục -> sách đổi thì khóa mới, bản cũ tự bị bỏ qua
+    - Tầng 2 chỉ dùng khi đang LISTEN được phiên bản (version giống nhau giữa các worker)
+    - Lỗi ở tầng 2 không làm hỏng trang: chỉ render lại như không có cache
+    """
+
+    def __init__(self, db, local):
+        self.db = db
+        self.local = local
+        self.shared_hits = 0
+        self.renders = 0
+
+    def fetch(self, name, render):
         """
-        ĐĂNG NHẬP
-        - Kiểm tra username và password
-        - Trả về thông tin user nếu đúng
+        LẤY FRAGMENT THEO TÊN, CHƯA CÓ THÌ GỌI render() VÀ LƯU LẠI
+        - Khóa tính TRƯỚC khi render: nếu sách đổi giữa chừng thì bản render mới bị gắn khóa cũ (vô hại)
         """
-        conn = None
+        version = CATALOG.version if CATALOG.live else None
+        local_key = (name, CATALOG.key())
+        html = self.local.get(local_key)
+        if html is not None:
+            return html
+
+        html = self._load_shared(name, version) if version is not None else None
+        if html is None:
+            html = str(render())
+            self.renders += 1
+            if version is not None:
+                self._store_shared(name, version, html)
+        else:
+            self.shared_hits += 1
+
+        html = Markup(html)
+        self.local.set(local_key, html)
+        return html
+
+    def _load_shared(self, name, version):
+        conn = self.db.get_connection()   # Bảng UNLOGGED không có trên replica -> luôn đọc ở primary
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT html FROM fragment_cache WHERE key = %s AND version = %s", (name, version))
+            row = cursor.fetchone()
+            conn.commit()
+            return row[0] if row else None
+        except psycopg2.Error as e:
+            conn.rollback()
+            log.warning("Không đọc được fragment_cache: %s", e)
+            return None
+        finally:
+            conn.close()
+
+    def _store_shared(self, name, version, html):
+        conn = self.db.get_bookkeeping_connection()   # Ghi cache không phải ghi của người xem (xem ReplicaRouter)
+        try:
+            cursor = conn.cursor()
+            # Không ghi đè bản của phiên bản mới hơn (worker khác có thể đã nhận NOTIFY trước)
+            cursor.execute('''
+                INSERT INTO fragment_cache (key, version, html) VALUES (%s, %s, %s)
+                ON CONFLICT (key) DO UPDATE
+                SET version = EXCLUDED.version, html = EXCLUDED.html, created_at = NOW()
+                WHERE fragment_cache.version < EXCLUDED.version
+            ''', (name, version, html))
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            log.warning("Không ghi được fragment_cache: %s", e)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def prune(conn):
+        """JOB: XÓA FRAGMENT CỦA CÁC PHIÊN BẢN CŨ (trả về số dòng đã xóa)"""
+        cursor = conn.cursor()
+        cursor.execute('''
+            DELETE FROM fragment_cache
+            WHERE version < (SELECT last_value FROM catalog_version_seq)
+        ''')
+        deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update(shared_hits=self.shared_hits, renders=self.renders)
+        return stats
+
+
+def connect_public(address, timeout, source_address=None):
+    """
+    MỞ SOCKET TỚI HOST CHỈ KHI MỌI ĐỊA CHỈ CỦA NÓ LÀ PUBLIC (chống SSRF khi tải ảnh bìa)
+    - Phân giải tên miền 1 lần rồi nối thẳng vào IP đã kiểm tra -> không bị đổi DNS giữa lúc kiểm tra và lúc nối
+    - Từ chối private / loopback / link-local / reserved / multicast (kể cả IPv6 ánh xạ IPv4)
+    """
+    host, port = address
+    addresses = []
+    for *_, sockaddr in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM):
+        ip = ipaddress.ip_address(sockaddr[0])
+        mapped = getattr(ip, 'ipv4_mapped', None)
+        if not ip.is_global or ip.is_multicast or (mapped and not mapped.is_global):
+            raise ValueError(f"Không tải ảnh từ địa chỉ nội bộ {ip} ({host})")
+        addresses.append(sockaddr[0])
+    error = None
+    for ip in addresses:
+        try:
+            return socket.create_connection((ip, port), timeout, source_address)
+        except OSError as e:
+            error = e
+    raise error or OSError(f"Không phân giải được {host}")
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    """Kết nối HTTP đi qua connect_public"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    """Kết nối HTTPS đi qua connect_public (SNI / kiểm tra chứng chỉ vẫn theo tên miền)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = connect_public
+
+
+class PublicHTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+class CoverRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Mỗi lần chuyển hướng kiểm tra lại URL đích (scheme / danh sách host); địa chỉ IP do connect_public kiểm tra"""
+
+    max_redirections = 3
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        CoverCache.check_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+class CoverCache:
+    """
+    ẢNH BÌA SÁCH: TẢI VỀ Ổ ĐĨA 1 LẦN, PHỤC VỤ THUMBNAIL CỐ ĐỊNH KÍCH THƯỚC
+    - Ảnh gốc (URL ngoài hoặc /static/...) được tải và thu nhỏ trong pool thread nền, không chặn request
+    - Mỗi cỡ (SIZES) lưu 1 file WebP, tên file = hash(nội dung ảnh gốc + cỡ) -> URL đổi khi ảnh đổi,
+      nên trình duyệt được cache vĩnh viễn (immutable)
+    - COVER_DIR/src/ ghi URL gốc -> hash nội dung, dùng chung giữa các worker trên cùng máy
+    - Chưa xử lý xong / tải lỗi -> ảnh mặc định; tải lỗi thì RETRY_AFTER giây sau mới thử lại
+    """
+
+    DIRECTORY = os.environ.get('COVER_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'covers'))
+    SIZES = {'card': (240, 360), 'detail': (480, 720)}    # Gấp đôi kích thước hiển thị (màn hình retina)
+    QUALITY = int(os.environ.get('COVER_QUALITY', 80))
+    WORKERS = int(os.environ.get('COVER_WORKERS', 2))
+    FETCH_TIMEOUT = float(os.environ.get('COVER_FETCH_TIMEOUT', 10))
+    MAX_BYTES = int(os.environ.get('COVER_MAX_BYTES', 10 * 1024 * 1024))   # Ảnh gốc lớn hơn thì bỏ qua
+    MAX_PIXELS = int(os.environ.get('COVER_MAX_PIXELS', 40_000_000))      # Ảnh gốc nhiều điểm ảnh hơn thì bỏ qua
+    RETRY_AFTER = float(os.environ.get('COVER_RETRY_AFTER', 600))
+    MAX_FAILED = int(os.environ.get('COVER_MAX_FAILED', 10000))          # Số URL lỗi nhớ tối đa
+    USER_AGENT = 'Mozilla/5.0 (compatible; library-cover-cache)'   # Vài CDN chặn User-Agent mặc định của urllib
+    DEFAULT = 'images/default_book.jpg'    # Ảnh mặc định (trong thư mục static)
+    # Chỉ tải ảnh từ các host này (và tên miền con), vd. "covers.openlibrary.org,books.google.com"; trống = mọi host public
+    ALLOWED_HOSTS = [h.strip().lower() for h in os.environ.get('COVER_ALLOWED_HOSTS', '').split(',') if h.strip()]
+    # Không dùng proxy trong biến môi trường; mọi kết nối (kể cả sau chuyển hướng) chỉ tới địa chỉ public
+    OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}), PublicHTTPHandler,
+                                         PublicHTTPSHandler, CoverRedirectHandler)
+
+    def __init__(self, directory=DIRECTORY, static_folder=None):
+        self.directory = directory
+        self.static_folder = static_folder
+        self._hashes = LRUCache(max_bytes=2 * 1024 * 1024, ttl=3600)   # URL gốc -> hash nội dung
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
+        self._failed = {}          # URL gốc -> thời điểm được thử lại
+        self.processed = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+
+    @staticmethod
+    def _key(image_url):
+        return hashlib.sha1(image_url.encode()).hexdigest()
+
+    def _source_path(self, image_url):
+        key = self._key(image_url)
+        return os.path.join(self.directory, 'src', key[:2], key)
+
+    @classmethod
+    def thumb_digest(cls, content_hash, size):
+        """Tên file thumbnail: đổi khi ảnh gốc đổi hoặc khi đổi kích thước / chất lượng"""
+        width, height = cls.SIZES[size]
+        return hashlib.sha256(f"{content_hash}:{width}x{height}:q{cls.QUALITY}".encode()).hexdigest()[:32]
+
+    def thumb_path(self, size, digest):
+        return os.path.join(self.directory, size, digest[:2], f"{digest}.webp")
+
+    def lookup(self, image_url):
+        """HASH CỦA THUMBNAIL cỡ đã xử lý xong: {size: digest}, chưa có thì None (không I/O mạng)"""
+        content_hash = self._hashes.get(image_url)
+        if content_hash is None:
+            try:
+                with open(self._source_path(image_url)) as f:
+                    content_hash = f.read().strip()
+            except OSError:
+                return None
+            self._hashes.set(image_url, content_hash)
+        return {size: self.thumb_digest(content_hash, size) for size in self.SIZES}
+
+    def request(self, image_url):
+        """ĐƯA ẢNH VÀO HÀNG ĐỢI XỬ LÝ (bỏ qua nếu đang xử lý hoặc vừa lỗi)"""
+        with self._lock:
+            if image_url in self._pending:
+                return None
+            retry_at = self._failed.get(image_url)
+            if retry_at is not None:
+                if retry_at > time.monotonic():
+                    return None
+                del self._failed[image_url]
+            self._pending.add(image_url)
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.WORKERS, thread_name_prefix='cover')
+            return self._executor.submit(self._run, image_url)
+
+    def _run(self, image_url):
         try:
-            conn = self.db.get_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute('''
-                SELECT id, username, email, role, points
-                FROM users
-                WHERE username = %s AND password = %s
-            ''', (username, password))
-            
-            result = cursor.fetchone()
-            
-            if result:
-                # Tạo dictionary chứa thông tin user
-                user_dict = {
-                    'id': result[0],
-                    'username': result[1],
-                    'email': result[2],
-                    'role': result[3],
-                    'points': result[4]
-                }
-                return user_dict, "Đăng nhập thành công!"
-            else:
-                return None, "Sai username hoặc password!"
+            self.process(image_url)
+            return True
         except Exception as e:
-            return None, f"Lỗi: {e}"
+            with self._lock:
+                self._remember_failure(image_url)
+                self.failures += 1
+            log.warning("Không xử lý được ảnh bìa %s: %s", image_url, e)
+            return False
         finally:
-            if conn:
-                conn.close()
-    
-    def get_all_books(self):
+            with self._lock:
+                self._pending.discard(image_url)
+
+    def _remember_failure(self, image_url):
         """
-        LẤY TẤT CẢ SÁCH TRONG HỆ THỐNG
-        - Sắp xếp theo ngày thêm (mới nhất trước)
-        - Trả về dạng list of dictionaries
+        GHI NHỚ URL LỖI tới lúc được thử lại (gọi khi đang giữ self._lock)
+        - Đầy MAX_FAILED: bỏ các mục đã hết hạn, vẫn đầy thì bỏ mục cũ nhất -> bộ nhớ có giới hạn
         """
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, title, author, category, year, quantity, available, image_url, description
-            FROM books
-            ORDER BY created_at DESC
-        ''')
-        
-        rows = cursor.fetchall()
-        conn.close()
-        
-        # Chuyển đổi từng row thành dictionary
-        books = []
-        for row in rows:
-            books.append({
-                'id': row[0],
-                'title': row[1],
-                'author': row[2],
-                'category': row[3],
-                'year': row[4],
-                'quantity': row[5],
-                'available': row[6],
-                'image_url': row[7],
-                'description': row[8]
-            })
-        return books
-        
-    def get_book_by_id(self, book_id):
+        now = time.monotonic()
+        self._failed.pop(image_url, None)
+        if len(self._failed) >= self.MAX_FAILED:
+            self._failed = {url: at for url, at in self._failed.items() if at > now}
+            while len(self._failed) >= self.MAX_FAILED:
+                del self._failed[next(iter(self._failed))]
+        self._failed[image_url] = now + self.RETRY_AFTER
+
+    def process(self, image_url):
         """
-        LẤY THÔNG TIN CHI TIẾT MỘT CUỐN SÁCH THEO ID
+        TẢI ẢNH GỐC, TẠO THUMBNAIL MỌI CỠ rồi mới ghi URL -> hash (nên lookup thấy là file đã có)
+        - Kiểm tra số điểm ảnh (đọc từ header, chưa giải mã) trước khi giải mã: chặn ảnh nén nhỏ
+          nhưng bung ra hàng GB bộ nhớ (decompression bomb)
         """
-        conn = self.db.get_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT id, title, author, category, year, quantity, available, image_url, description
-            FROM books
-            WHERE id = %s
-        ''', (book_id,))
-        
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row:
+        start = time.perf_counter()
+        data = self._fetch(image_url)
+        content_hash = hashlib.sha256(data).hexdigest()
+        written = 0
+
+        image = None
+        for size, (width, height) in sorted(self.SIZES.items(), key=lambda item: -item[1][0]):
+            path = self.thumb_path(size, self.thumb_digest(content_hash, size))
+            if os.path.exists(path):
+                continue   # Cùng nội dung với 1 URL khác đã xử lý
+            if image is None:
+                image = Image.open(io.BytesIO(data))
+                if image.size[0] * image.size[1] > self.MAX_PIXELS:
+                    raise ValueError(f"Ảnh {image.size[0]}x{image.size[1]} vượt quá {self.MAX_PIXELS} điểm ảnh")
+                image.draft('RGB', (width, height))   # JPEG: giải mã thẳng ở tỉ lệ nhỏ, nhanh hơn nhiều
+                image = self._flatten(ImageOps.exif_transpose(image))
+            thumb = ImageOps.fit(image, (width, height), Image.Resampling.LANCZOS)
+            written += self._write(path, lambda f: thumb.save(f, 'WEBP', quality=self.QUALITY, method=4))
+
+        self._write(self._source_path(image_url), lambda f: f.write(content_hash.encode()))
+        self._hashes.set(image_url, content_hash)
+        with self._lock:
+            self._failed.pop(image_url, None)
+            self.processed += 1
+            self.bytes_in += len(data)
+            self.bytes_out += written
+            self.seconds += time.perf_counter() - start
+        return content_hash
+
+    def _fetch(self, image_url):
+        """ĐỌC ẢNH GỐC: file trong thư mục static hoặc URL http(s), tối đa MAX_BYTES"""
+        if image_url.startswith('/static/'):
+            path = safe_join(self.static_folder, image_url[len('/static/'):])
+            if path is None:
+                raise ValueError("Đường dẫn ảnh không hợp lệ")
+            with open(path, 'rb') as f:
+                data = f.read(self.MAX_BYTES + 1)
+        elif image_url.startswith(('http://', 'https://')):
+            self.check_url(image_url)
+            req = urllib.request.Request(image_url, headers={'User-Agent': self.USER_AGENT})
+            with self.OPENER.open(req, timeout=self.FETCH_TIMEOUT) as response:
+                data = response.read(self.MAX_BYTES + 1)
+        else:
+            raise ValueError("Chỉ hỗ trợ URL http(s) hoặc /static/...")
+        if len(data) > self.MAX_BYTES:
+            raise ValueError(f"Ảnh lớn hơn {self.MAX_BYTES} byte")
+        return data
+
+    @classmethod
+    def check_url(cls, url):
+        """URL ẢNH BÌA HỢP LỆ: http(s), có host, thuộc ALLOWED_HOSTS (nếu có cấu hình); sai thì ValueError"""
+        parts = urllib.parse.urlsplit(url)
+        host = (parts.hostname or '').lower()
+        if parts.scheme not in ('http', 'https') or not host:
+            raise ValueError(f"URL ảnh không hợp lệ: {url}")
+        if cls.ALLOWED_HOSTS and not any(host == h or host.endswith('.' + h) for h in cls.ALLOWED_HOSTS):
+            raise ValueError(f"Host {host} không nằm trong COVER_ALLOWED_HOSTS")
+
+    @staticmethod
+    def _flatten(image):
+        """Ảnh trong suốt / bảng màu -> nền trắng RGB (thumbnail không cần kênh alpha)"""
+        if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+
+    @staticmethod
+    def _write(path, write):
+        """GHI FILE NGUYÊN TỬ (file tạm + os.replace): worker khác không bao giờ đọc phải file ghi dở"""
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return os.path.getsize(path)
+
+    def stats(self):
+        with self._lock:
             return {
-                'id': row[0],
-                'title': row[1],
-                'author': row[2],
-                'category': row[3],
-                'year': row[4],
-                'quantity': row[5],
-                'available': row[6],
-                'image_url': row[7],
-                'description': row[8]
+                'processed': self.processed,
+                'failures': self.failures,
+                'pending': len(self._pending),
+                'retry_later': sum(1 for at in self._failed.values() if at > time.monotonic()),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'avg_ms': round(self.seconds / self.processed * 1000, 1) if self.processed else 0.0,
+                'lookup_cache': self._hashes.stats(),
             }
-        return None
 
+    def reset_after_fork(self):
+        """Pool thread không tồn tại trong process con -> tạo lại khi cần"""
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = set()
 
 
 # ============================================
@@ -813,9 +4667,153 @@ class LibrarySystem:
 try:
     library_system = LibrarySystem()
 except ConnectionError as e:
-    print(f"\nLỖI: {e}\n")
+    log.critical("%s", e)
     exit(1)
 
+# Kiểm tra / nâng cấp schema khi khởi động (đã mới nhất thì chỉ tốn 1 câu SELECT)
+if os.environ.get('AUTO_MIGRATE', '1') == '1':
+    try:
+        library_system.db.init_database()
+    except RuntimeError as e:
+        log.error("Không kiểm tra được schema database: %s", e)
+
+# Chỉ mục gợi ý tìm kiếm (mỗi worker 1 bản, nạp ở thread nền)
+SUGGEST_INDEX = SuggestIndex()
+
+# Cache sách / trang danh mục (mỗi worker 1 bản), khóa theo phiên bản danh mục
+CATALOG = CatalogVersion()
+BOOK_CACHE = LRUCache(max_bytes=int(os.environ.get('BOOK_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+                      ttl=float(os.environ.get('BOOK_CACHE_TTL', 60)))
+
+# Cache HTML lưới sách (tầng 1 trong process, tầng 2 trong database)
+FRAGMENT_CACHE = FragmentCache(library_system.db, LRUCache(
+    max_bytes=int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 8 * 1024 * 1024)),
+    ttl=float(os.environ.get('BOOK_CACHE_TTL', 60))))
+
+# Ảnh bìa đã thu nhỏ trên ổ đĩa (mỗi worker 1 pool thread xử lý, file dùng chung)
+COVERS = CoverCache(static_folder=app.static_folder)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=COVERS.reset_after_fork)
+
+@app.teardown_request
+def release_request_connection(exc):
+    """Kết thúc request: trả các kết nối dùng chung (primary, replica) về pool, phần chưa commit bị rollback (RequestConnection.release)"""
+    for name in ('_db_conn', '_db_read_conn'):
+        conn = g.pop(name, None)
+        if conn is not None:
+            conn.release()
+
+@app.after_request
+def stick_to_primary(response):
+    """Request vừa ghi: các lần đọc sau của người dùng này đọc ở primary thêm STICKY_SECONDS giây (xem ReplicaRouter)"""
+    if g.get('_db_wrote'):
+        session[REPLICAS.SESSION_KEY] = time.time() + REPLICAS.STICKY_SECONDS
+    return response
+
+# Công việc định kỳ
+JOBS = PeriodicJobs(library_system.db)
+JOBS.register('expire_holds', 300, Waitlist.expire_holds)
+JOBS.register('reconcile_stats', 3600, LibraryStats.reconcile)
+if BACKEND.FRAGMENT_TABLE:   # SQLite không dùng tầng cache HTML trong database
+    JOBS.register('prune_fragments', 600, FragmentCache.prune)
+JOBS.register('process_overdue', 3600, OverdueEngine.run)
+
+# Đo thời gian request (SERVER_TIMING=0 để không gửi header Server-Timing cho trình duyệt)
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '1') == '1'
+
+@app.before_request
+def start_request_timer():
+    """Bắt đầu đo request: thời gian cả request, thời gian / số câu SQL, thời gian mượn kết nối"""
+    g._timing = {'start': time.perf_counter(), 'db': 0.0, 'queries': 0, 'conn': 0.0}
+
+@app.after_request
+def record_request_timing(response):
+    """
+    KẾT THÚC ĐO REQUEST
+    - Ghi histogram theo route (mẫu URL, vd. /book/<int:book_id>), method, status
+    - Gửi header Server-Timing (xem được trong tab Network của DevTools)
+    - Response dạng stream chỉ được đo tới lúc bắt đầu gửi body
+    """
+    timing = g.get('_timing')
+    if timing is None:
+        return response
+    elapsed = time.perf_counter() - timing['start']
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    METRICS.observe('library_http_request_duration_seconds',
+                    (('route', route), ('method', request.method), ('status', str(response.status_code))),
+                    elapsed)
+    if SERVER_TIMING:
+        parts = [f"app;dur={elapsed * 1000:.2f}"]
+        if timing['queries']:
+            parts.append(f'db;dur={timing["db"] * 1000:.2f};desc="{timing["queries"]} queries"')
+        if timing['conn']:
+            parts.append(f"conn;dur={timing['conn'] * 1000:.2f}")
+        response.headers['Server-Timing'] = ', '.join(parts)
+    return response
+
+@app.before_request
+def start_background_tasks():
+    """Khởi động các việc chạy nền (chỉ mục gợi ý, job định kỳ, LISTEN danh mục, ghi metrics), không chặn request"""
+    SUGGEST_INDEX.refresh_async(library_system.db)
+    JOBS.start()
+    CATALOG.start()
+    METRICS.start()
+
+@app.cli.command('run-job')
+@click.argument('name')
+def run_job_command(name):
+    """Chạy ngay 1 job định kỳ (dùng với cron): flask --app app run-job expire_holds"""
+    if name not in JOBS.jobs:
+        raise click.BadParameter(f"Không có job '{name}'. Các job: {', '.join(JOBS.jobs)}")
+    result = JOBS.run(name)
+    click.echo(f"Job '{name}': {'đang chạy ở process khác' if result is None else result}")
+
+@app.cli.command('import-books')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help="Mặc định: đoán theo đuôi file")
+@click.option('--errors', 'errors_path', type=click.Path(dir_okay=False),
+              help="Ghi dòng lỗi / trùng ra file CSV (line,error) thay vì in ra màn hình")
+def import_books_command(path, fmt, errors_path):
+    """Nhập sách hàng loạt từ CSV / JSONL: flask --app app import-books books.csv"""
+    fmt = fmt or BookImporter.detect_format(path)
+    errors_file = open(errors_path, 'w', newline='', encoding='utf-8') if errors_path else None
+    errors = csv.writer(errors_file) if errors_file else None
+    if errors:
+        errors.writerow(['line', 'error'])
+    try:
+        with open(path, newline='', encoding='utf-8-sig') as stream:
+            for event in BookImporter().run(stream, fmt):
+                if event[0] == 'error':
+                    if errors:
+                        errors.writerow(event[1:])
+                    else:
+                        click.echo(f"Dòng {event[1]}: {event[2]}", err=True)
+                else:
+                    stats = event[1]
+                    rate = stats['read'] / stats['seconds'] if stats['seconds'] else 0
+                    click.echo(f"Đã đọc {stats['read']} dòng: {stats['inserted']} sách mới, "
+                               f"{stats['duplicates']} trùng, {stats['invalid']} lỗi ({rate:,.0f} dòng/s)")
+    finally:
+        if errors_file:
+            errors_file.close()
+
+@app.cli.command('warm-covers')
+def warm_covers_command():
+    """Tạo trước thumbnail cho mọi ảnh bìa chưa xử lý (sau khi deploy / nhập sách): flask --app app warm-covers"""
+    conn = library_system.db.get_read_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT image_url FROM books WHERE image_url <> ''")
+        urls = [row[0] for row in cursor.fetchall() if COVERS.lookup(row[0]) is None]
+    finally:
+        conn.close()
+
+    start = time.perf_counter()
+    futures = [COVERS.request(url) for url in urls]
+    done = sum(1 for future in futures if future is not None and future.result())
+    click.echo(f"Ảnh bìa: {len(urls)} cần xử lý, {done} xong, {len(urls) - done} lỗi "
+               f"({time.perf_counter() - start:.1f}s)")
+
 # ============================================
 # DECORATOR: KIỂM TRA ĐĂNG NHẬP
 # ============================================
@@ -848,11 +4846,112 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def catalog_validators(user=None):
+    """
+    ETAG + LAST-MODIFIED THEO PHIÊN BẢN DANH MỤC (dùng chung cho trang web và API JSON)
+    - user (session['user']): ETag riêng cho người đó, không có Last-Modified (ngày sửa không
+      phân biệt được người xem); None: nội dung giống nhau cho mọi người xem
+    - Trả về (etag, last_modified)
+    """
+    if user:
+        return f"c{CATALOG.version}-{user['role']}{user['id']}", None
+    # Header HTTP chỉ chính xác tới giây -> làm tròn lên để không báo "chưa đổi" sai
+    return f"c{CATALOG.version}-guest", CATALOG.changed_at.replace(microsecond=0) + timedelta(seconds=1)
+
+def set_catalog_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True   # Luôn hỏi lại server, nhưng được dùng bản đã lưu nếu 304
+    return response
+
+def catalog_conditional(f):
+    """
+    DECORATOR: TRẢ 304 NẾU DANH MỤC SÁCH CHƯA ĐỔI
+    - ETag = phiên bản danh mục + người xem (vai trò + id khi đã đăng nhập): trang hiển thị thanh
+      menu / nút giỏ hàng / đăng ký chờ theo người đăng nhập, nên bản đã lưu của người này
+      không bao giờ được xác nhận cho người khác dùng chung trình duyệt (xem catalog_validators)
+    - Kiểm tra If-None-Match / If-Modified-Since TRƯỚC khi truy vấn database hay render template
+    - Bỏ qua khi: không phải GET, còn flash message chờ hiển thị, hoặc chưa LISTEN được phiên bản
+    """
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET' or session.get('_flashes') or not CATALOG.live:
+            return f(*args, **kwargs)
+
+        etag, last_modified = catalog_validators(session.get('user'))
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = app.response_class(status=304)
+        else:
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        set_catalog_validators(response, etag, last_modified)
+        response.vary.add('Cookie')
+        return response
+    return decorated_function
+
+def catalog_page_args():
+    """
+    ĐỌC THAM SỐ PHÂN TRANG TỪ URL (?after=...&before=...&size=...)
+    - Dùng chung cho trang chủ, các dashboard và lịch sử giao dịch
+    """
+    return {
+        'after': request.args.get('after'),
+        'before': request.args.get('before'),
+        'limit': request.args.get('size', type=int),
+    }
+
+def render_book_grid(macro):
+    """
+    HTML LƯỚI SÁCH CỦA TRANG HIỆN TẠI (macro trong book_grids.html), LẤY TỪ FRAGMENT_CACHE
+    - Khóa: tên macro + vai trò người xem + cursor đã giải mã rồi mã hóa lại + số sách đã kẹp
+      -> mỗi trang hợp lệ chỉ có 1 khóa, chuỗi query tùy ý không tạo thêm dòng trong cache
+    - Cursor sai định dạng: hiện trang đầu như trước nhưng không lưu cache
+    - Chỉ khi cache miss mới đọc danh mục và render template
+    """
+    args = catalog_page_args()
+    role = session['user']['role'] if 'user' in session else 'guest'
+    valid = True
+    for key in ('after', 'before'):
+        position = LibrarySystem.decode_cursor(args[key]) if args[key] else None
+        valid = valid and (position is not None or not args[key])
+        args[key] = LibrarySystem.encode_cursor(*position) if position else None
+    args['limit'] = LibrarySystem.page_limit(args['limit'])
+
+    def render():
+        page = library_system.get_all_books(**args)
+        return get_template_attribute('book_grids.html', macro)(page)
+
+    if not valid:
+        return Markup(render())
+    name = f"{macro}:{role}:{args['after'] or ''}:{args['before'] or ''}:{args['limit']}"
+    return FRAGMENT_CACHE.fetch(name, render)
+
+@app.template_global()
+def cover_url(book_id, image_url, size='card'):
+    """
+    URL ẢNH BÌA CỠ size DÙNG TRONG TEMPLATE (không chờ tải ảnh)
+    - Thumbnail đã có: URL theo nội dung (trình duyệt cache vĩnh viễn)
+    - Chưa có: đưa vào hàng đợi xử lý, trả URL cố định của sách (xem book_cover) -> HTML đã cache
+      (FragmentCache, ETag danh mục) vẫn hiện đúng ảnh sau khi xử lý xong
+    - Sách không có ảnh: ảnh mặc định
+    """
+    if not image_url:
+        return url_for('static', filename=CoverCache.DEFAULT)
+    digests = COVERS.lookup(image_url)
+    if digests is None:
+        COVERS.request(image_url)
+        return url_for('book_cover', book_id=book_id, size=size)
+    return url_for('cover_image', book_id=book_id, size=size, digest=digests[size])
+
 # ============================================
 # ROUTES: TRANG CHỦ VÀ XÁC THỰC
 # ============================================
 
 @app.route('/')
+@catalog_conditional
 def index():
     """
     TRANG CHỦ
@@ -864,10 +4963,10 @@ def index():
             return redirect(url_for('admin_dashboard'))
         return redirect(url_for('user_dashboard'))
     
-    books = library_system.get_all_books()
-    return render_template('index.html', books=books)
+    return render_template('index.html', book_grid=render_book_grid('index_grid'))
 
 @app.route('/book/<int:book_id>')
+@catalog_conditional
 def book_detail(book_id):
     """
     TRANG CHI TIẾT SÁCH
@@ -882,6 +4981,50 @@ def book_detail(book_id):
     # Render trang chi tiết sách
     return render_template('book_detail.html', book=book)
 
+@app.route('/covers/<int:book_id>/<size>')
+def book_cover(book_id, size):
+    """
+    ẢNH BÌA CỦA 1 CUỐN SÁCH (URL cố định, dùng khi lúc render trang thumbnail chưa có)
+    - Đã có thumbnail: chuyển tới URL theo nội dung (trình duyệt nhớ chuyển hướng 1 giờ)
+    - Chưa có: đưa vào hàng đợi xử lý, tạm chuyển tới ảnh mặc định (không cache để lần sau hỏi lại)
+    """
+    if size not in CoverCache.SIZES:
+        abort(404)
+    book = library_system.get_book_by_id(book_id)
+    image_url = book['image_url'] if book else None
+    digests = COVERS.lookup(image_url) if image_url else None
+
+    if digests and os.path.exists(COVERS.thumb_path(size, digests[size])):
+        response = redirect(url_for('cover_image', book_id=book_id, size=size, digest=digests[size]))
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+        return response
+
+    response = redirect(url_for('static', filename=CoverCache.DEFAULT))
+    if image_url:
+        COVERS.request(image_url)
+        response.cache_control.no_store = True
+    else:
+        response.cache_control.public = True
+        response.cache_control.max_age = 3600
+    return response
+
+@app.route('/covers/<int:book_id>/<size>/<digest>.webp')
+def cover_image(book_id, size, digest):
+    """
+    THUMBNAIL THEO NỘI DUNG: file không bao giờ đổi -> Cache-Control immutable 1 năm
+    - File không có trên máy này (trang render ở máy khác / thư mục ảnh bị xóa) -> xử lý lại theo sách
+    """
+    if size not in CoverCache.SIZES or not re.fullmatch(r'[0-9a-f]{32}', digest):
+        abort(404)
+    path = COVERS.thumb_path(size, digest)
+    if not os.path.exists(path):
+        return book_cover(book_id, size)
+    response = send_file(path, mimetype='image/webp', max_age=365 * 24 * 3600)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
 @app.route('/register', methods=['GET', 'POST'])
 def register():
     """
@@ -977,12 +5120,15 @@ def user_dashboard():
     
     cart = user_obj.get_cart()                  # Giỏ hàng
     borrowed = user_obj.get_borrowed_books()     # Sách đang mượn
-    books = library_system.get_all_books()       # Tất cả sách
+    waitlist = user_obj.get_waitlist()           # Sách đang chờ / được giữ
+    overdue = user_obj.get_overdue_summary()     # Sách quá hạn, tiền phạt
     
     return render_template('user_dashboard.html', 
                            cart=cart, 
                            borrowed=borrowed,
-                           books=books,
+                           waitlist=waitlist,
+                           overdue=overdue,
+                           book_grid=render_book_grid('user_grid'),  # 1 trang sách (HTML đã cache)
                            user=user_info)
 
 @app.route('/user/add-to-cart/<int:book_id>')
@@ -1039,6 +5185,42 @@ def return_book(transaction_id):
     flash(message, 'success' if success else 'error')
     return redirect(url_for('user_dashboard'))
 
+@app.route('/user/waitlist/<int:book_id>')
+@login_required
+def join_waitlist(book_id):
+    """
+    ĐĂNG KÝ CHỜ SÁCH ĐANG HẾT BẢN
+    - Khi có người trả, sách được giữ cho người đăng ký sớm nhất
+    """
+    user_info = session['user']
+    user_obj = User(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
+
+    success, message = user_obj.join_waitlist(book_id)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('user_dashboard'))
+
+@app.route('/user/waitlist/<int:book_id>/cancel')
+@login_required
+def cancel_waitlist(book_id):
+    """HỦY ĐĂNG KÝ CHỜ (hoặc bỏ lượt giữ sách)"""
+    user_info = session['user']
+    user_obj = User(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
+
+    success, message = user_obj.cancel_waitlist(book_id)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('user_dashboard'))
+
+@app.route('/user/claim/<int:book_id>')
+@login_required
+def claim_hold(book_id):
+    """NHẬN SÁCH ĐANG ĐƯỢC GIỮ -> chuyển thành lượt mượn"""
+    user_info = session['user']
+    user_obj = User(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
+
+    success, message = user_obj.claim_hold(book_id)
+    flash(message, 'success' if success else 'error')
+    return redirect(url_for('user_dashboard'))
+
 # ============================================
 # ROUTES: DASHBOARD VÀ CHỨC NĂNG ADMIN
 # ============================================
@@ -1048,20 +5230,17 @@ def return_book(transaction_id):
 def admin_dashboard():
     """
     DASHBOARD CỦA ADMIN
-    - Hiển thị: thống kê, danh sách sách, lịch sử giao dịch
+    - Hiển thị: thống kê, danh sách sách (lịch sử giao dịch ở trang /admin/transactions)
     """
     user_info = session['user']
     # Tạo object Admin để gọi các method
     admin_obj = Admin(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
     
     stats = admin_obj.get_statistics()          # Thống kê
-    books = library_system.get_all_books()       # Danh sách sách
-    transactions = admin_obj.get_all_transactions()  # Lịch sử
     
     return render_template('admin_dashboard.html',
                            stats=stats,
-                           books=books,
-                           transactions=transactions,
+                           book_grid=render_book_grid('admin_grid'),  # 1 trang sách (HTML đã cache)
                            user=user_info)
 
 @app.route('/admin/add-book', methods=['POST'])
@@ -1094,6 +5273,198 @@ def admin_add_book():
     
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/import-books', methods=['POST'])
+@admin_required
+def admin_import_books():
+    """
+    NHẬP SÁCH HÀNG LOẠT (ADMIN) TỪ FILE CSV / JSONL
+    - Trả về dạng text stream: tiến độ sau mỗi chunk và các dòng lỗi / trùng
+    - Chỉ in tối đa IMPORT_MAX_ERRORS dòng lỗi (vẫn đếm đủ trong tổng kết)
+    """
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        flash('Vui lòng chọn file CSV hoặc JSONL!', 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    fmt = BookImporter.detect_format(upload.filename)
+    max_errors = int(os.environ.get('IMPORT_MAX_ERRORS', 1000))
+
+    # File upload bị đóng khi request kết thúc, trước khi response stream chạy xong
+    # -> chép sang file tạm của riêng mình (chép theo khối, không đọc cả file vào RAM)
+    spool = tempfile.TemporaryFile()
+    upload.save(spool)
+    spool.seek(0)
+
+    def generate():
+        stream = io.TextIOWrapper(spool, encoding='utf-8-sig', newline='')
+        shown = 0
+        try:
+            for event in BookImporter().run(stream, fmt):
+                if event[0] == 'error':
+                    shown += 1
+                    if shown <= max_errors:
+                        yield f"Dòng {event[1]}: {event[2]}\n"
+                else:
+                    stats = event[1]
+                    yield (f"Đã đọc {stats['read']} dòng: {stats['inserted']} sách mới, "
+                           f"{stats['duplicates']} trùng, {stats['invalid']} lỗi ({stats['seconds']}s)\n")
+        except Exception as e:
+            yield f"Lỗi, dừng nhập (các phần đã báo ở trên vẫn được giữ): {e}\n"
+        finally:
+            stream.close()
+
+    return app.response_class(stream_with_context(generate()), mimetype='text/plain')
+
+@app.route('/admin/return-books', methods=['POST'])
+@admin_required
+def admin_return_books():
+    """
+    TRẢ SÁCH HÀNG LOẠT (ADMIN, quầy trả sách)
+    - JSON {"transaction_ids": [...]} -> JSON kết quả từng giao dịch (cho máy quét / ứng dụng quầy)
+    - Form (ô transaction_ids, mã cách nhau bởi dấu phẩy / khoảng trắng) -> flash tổng kết, về dashboard
+    - Mọi giao dịch hợp lệ được chốt trong 1 database transaction
+    """
+    data = request.get_json(silent=True)
+    try:
+        if data is not None:
+            ids = data.get('transaction_ids') if isinstance(data, dict) else None
+            # Chỉ nhận mảng số nguyên (chuỗi "12" không được hiểu thành 2 mã 1 và 2)
+            if not isinstance(ids, list) or not all(type(value) is int for value in ids):
+                raise ValueError("transaction_ids phải là mảng số nguyên")
+        else:
+            ids = [int(value) for value in re.split(r'[\s,;]+', request.form.get('transaction_ids', '')) if value]
+        if len(set(ids)) > Admin.BULK_RETURN_MAX:
+            raise ValueError(f"Tối đa {Admin.BULK_RETURN_MAX} giao dịch mỗi lần!")
+    except ValueError as e:
+        if data is not None:
+            return jsonify({'error': f"Dữ liệu không hợp lệ: {e}"}), 400
+        flash(f"Mã giao dịch không hợp lệ: {e}", 'error')
+        return redirect(url_for('admin_dashboard'))
+
+    admin_info = session['user']
+    admin_obj = Admin(admin_info['id'], admin_info['username'], admin_info['email'])
+    results = admin_obj.return_books(ids)
+
+    returned = sum(1 for item in results if item['success'])
+    if data is not None:
+        return jsonify({'returned': returned, 'failed': len(results) - returned, 'results': results})
+
+    flash(f"Đã trả {returned}/{len(results)} sách!", 'success' if returned == len(results) else 'error')
+    for item in results:
+        if not item['success']:
+            flash(f"Giao dịch #{item['transaction_id']}: {item['message']}", 'error')
+    return redirect(url_for('admin_dashboard'))
+
+def transaction_filter_args():
+    """
+    ĐỌC BỘ LỌC GIAO DỊCH TỪ URL (?from=YYYY-MM-DD&to=YYYY-MM-DD&status=...&user_id=...&book_id=...)
+    - status: borrowed / returned / overdue (đang mượn và quá hạn)
+    - Giá trị sai định dạng -> ValueError
+    """
+    def parse_date(name):
+        value = request.args.get(name, '').strip()
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+
+    def parse_id(name):
+        value = request.args.get(name, '').strip()
+        return int(value) if value else None
+
+    status = request.args.get('status', '').strip()
+    if status and status not in ('borrowed', 'returned', 'overdue'):
+        raise ValueError(f"Trạng thái không hợp lệ: {status}")
+    return {
+        'date_from': parse_date('from'),
+        'date_to': parse_date('to'),
+        'status': status if status in ('borrowed', 'returned') else None,
+        'overdue': status == 'overdue',
+        'user_id': parse_id('user_id'),
+        'book_id': parse_id('book_id'),
+    }
+
+@app.route('/admin/transactions')
+@admin_required
+def admin_transactions():
+    """
+    LỊCH SỬ MƯỢN TRẢ (ADMIN)
+    - Lọc theo user, sách, trạng thái / quá hạn, khoảng ngày mượn
+    - Phân trang keyset (?after=...&before=...&size=...), giữ nguyên bộ lọc khi lật trang
+    """
+    try:
+        filters = transaction_filter_args()
+    except ValueError as e:
+        flash(f'Bộ lọc không hợp lệ: {e}', 'error')
+        return redirect(url_for('admin_transactions'))
+
+    user_info = session['user']
+    admin_obj = Admin(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
+    page = admin_obj.get_transactions(**catalog_page_args(), **filters)
+
+    # Tham số lọc giữ lại trên link phân trang / xuất file
+    filter_args = {name: request.args[name] for name in ('from', 'to', 'status', 'user_id', 'book_id')
+                   if request.args.get(name)}
+    return render_template('admin_transactions.html',
+                           transactions=page['transactions'],
+                           page=page,
+                           filter_args=filter_args,
+                           user=user_info)
+
+@app.route('/admin/export/transactions')
+@admin_required
+def admin_export_transactions():
+    """
+    XUẤT LỊCH SỬ GIAO DỊCH (ADMIN): ?format=csv|ndjson&gzip=1 + bộ lọc của transaction_filter_args
+    - Stream từng lô: đọc từ server-side cursor, ghi ngay ra response (không giữ cả file trong RAM)
+    - gzip=1: nén ngay trong lúc stream, tải về file .gz
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        flash('Định dạng xuất chỉ hỗ trợ csv hoặc ndjson!', 'error')
+        return redirect(url_for('admin_dashboard'))
+    try:
+        filters = transaction_filter_args()
+    except ValueError as e:
+        flash(f'Bộ lọc không hợp lệ: {e}', 'error')
+        return redirect(url_for('admin_dashboard'))
+    use_gzip = request.args.get('gzip') == '1'
+
+    user_info = session['user']
+    admin_obj = Admin(user_info['id'], user_info['username'], user_info['email'], user_info['points'])
+    columns = Admin.EXPORT_COLUMNS
+
+    def encode_batches():
+        if fmt == 'csv':
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(columns)
+            for rows in admin_obj.export_transactions(**filters):
+                writer.writerows(rows)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+        else:
+            for rows in admin_obj.export_transactions(**filters):
+                yield ''.join(json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + '\n'
+                              for row in rows)
+
+    def generate():
+        if not use_gzip:
+            for chunk in encode_batches():
+                yield chunk.encode()
+            return
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits=31: định dạng gzip
+        for chunk in encode_batches():
+            data = compressor.compress(chunk.encode())
+            if data:
+                yield data
+        yield compressor.flush()
+
+    filename = f"transactions.{fmt}" + ('.gz' if use_gzip else '')
+    mimetype = 'application/gzip' if use_gzip else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    response = app.response_class(stream_with_context(generate()), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @app.route('/admin/delete-book/<int:book_id>')
 @admin_required
 def admin_delete_book(book_id):
@@ -1114,7 +5485,8 @@ def admin_delete_book(book_id):
 def admin_add_stock(book_id):
     """
     THÊM SỐ LƯỢNG SÁCH VÀO KHO
-    - Tăng cả quantity (tổng số) và available (có sẵn)
+    - Tăng quantity (tổng số); các bản mới đi qua hàng chờ như sách vừa trả
+      (Waitlist.release_copies): giữ cho người chờ đầu hàng trước, phần còn lại cộng vào available
     - Dùng khi nhập thêm sách vào thư viện
     """
     conn = None 
@@ -1136,21 +5508,28 @@ def admin_add_stock(book_id):
         cursor = conn.cursor()
         
         # 2. LỆNH SQL CẬP NHẬT KHO SÁCH
-        # Tăng cả TỔNG SỐ LƯỢNG (quantity) và SẴN CÓ (available)
+        # Tăng TỔNG SỐ LƯỢNG (quantity); SẴN CÓ (available) do hàng chờ quyết định
         cursor.execute(
             """
             UPDATE books 
-            SET quantity = quantity + %s, 
-                available = available + %s
+            SET quantity = quantity + %s
             WHERE id = %s;
             """, 
-            (quantity_to_add, quantity_to_add, book_id)
+            (quantity_to_add, book_id)
         )
+        if cursor.rowcount:
+            slot = LibraryStats.random_slot()
+            LibraryStats.bump(cursor, slot, total_copies=quantity_to_add)
+            Waitlist.release_copies(cursor, {book_id: quantity_to_add}, slot)
         conn.commit()  # BẮT BUỘC: Lưu thay đổi vào database
+        CATALOG.touch()
         
         # Lấy tên sách để hiển thị thông báo
-        cursor.execute("SELECT title FROM books WHERE id = %s", (book_id,))
-        book_title = cursor.fetchone()[0] if cursor.rowcount else f'ID: {book_id}'
+        cursor.execute("SELECT id, title, author, available FROM books WHERE id = %s", (book_id,))
+        row = cursor.fetchone()
+        book_title = row[1] if row else f'ID: {book_id}'
+        if row:
+            SUGGEST_INDEX.upsert({'id': row[0], 'title': row[1], 'author': row[2], 'available': row[3]})
         
         flash(f'Đã thêm {quantity_to_add} cuốn vào kho sách "{book_title}" thành công!', 'success')
         
@@ -1167,60 +5546,100 @@ def admin_add_stock(book_id):
 
     return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/db-stats')
+@admin_required
+def admin_db_stats():
+    """
+    THỐNG KÊ POOL KẾT NỐI VÀ CACHE (JSON)
+    - Backend đang dùng, kích thước pool, số lần checkout, thời gian chờ
+    - Hit/miss/eviction của cache sách và cache HTML lưới sách, số ảnh bìa đã xử lý
+    """
+    stats = DatabaseManager.pool_stats()
+    stats['book_cache'] = BOOK_CACHE.stats()
+    stats['fragment_cache'] = FRAGMENT_CACHE.stats()
+    stats['catalog_version'] = CATALOG.key()
+    stats['covers'] = COVERS.stats()
+    return jsonify(stats)
+
+@app.route('/admin/slow-queries')
+@admin_required
+def admin_slow_queries():
+    """
+    CÁC CÂU SQL CHẬM NHẤT (xếp theo tổng thời gian, gộp mọi worker)
+    - Method gọi, kiểu tham số, số lần, trung bình / lớn nhất, plan EXPLAIN gần nhất
+    """
+    return render_template('admin_slow_queries.html', queries=SlowQueryLog.top(),
+                           threshold_ms=SlowQueryLog.THRESHOLD * 1000,
+                           explain_rate=SlowQueryLog.EXPLAIN_RATE)
+
+@app.route('/admin/slow-queries/reset', methods=['POST'])
+@admin_required
+def admin_slow_queries_reset():
+    """XÓA SỐ LIỆU CÂU CHẬM (vd. sau khi thêm index, để đo lại từ đầu)"""
+    SlowQueryLog.reset()
+    flash('Đã xóa thống kê câu SQL chậm!', 'success')
+    return redirect(url_for('admin_slow_queries'))
+
+@app.route('/metrics')
+def metrics():
+    """
+    SỐ LIỆU CHO PROMETHEUS (gộp mọi worker)
+    - Histogram thời gian theo route, theo câu SQL (fingerprint), thời gian mượn kết nối
+    - Mặc định chỉ mở cho localhost (gọi thẳng, không qua proxy)
+    - Đặt METRICS_TOKEN thì nơi khác gửi header Authorization: Bearer <token> cũng xem được
+    - Không được phép: 401 nếu có cấu hình token, ngược lại 404 (không lộ endpoint)
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    local = request.remote_addr in ('127.0.0.1', '::1') and 'X-Forwarded-For' not in request.headers
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}")
+    if not (local or authorized):
+        if not token:
+            abort(404)
+        return "Unauthorized\n", 401, {'Content-Type': 'text/plain; charset=utf-8'}
+    return METRICS.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
 #===========================================
 # TÌM KIẾM SÁCH
 #===========================================
 @app.route('/search', methods=['GET', 'POST'])
+@catalog_conditional
 def search_books():
-    query = ''
-    results = []
-    conn = None
-    cursor = None  #  đảm bảo biến này luôn tồn tại
+    """
+    TÌM KIẾM SÁCH
+    - Nhận từ khóa qua form (POST) hoặc URL (?query=...&page=...) để có thể lật trang
+    - Tìm theo tên sách, tác giả, mô tả (không cần gõ dấu) hoặc năm xuất bản
+    """
+    query = request.values.get('query', '').strip()
+    page = request.args.get('page', 1, type=int)
+    search = {'results': [], 'page': 1, 'has_next': False}
 
-    if request.method == 'POST':
-        query = request.form.get('query', '').strip()
-        if not query:
-            flash('Vui lòng nhập từ khóa tìm kiếm!', 'error')
-            return redirect(url_for('search_books'))
+    if request.method == 'POST' and not query:
+        flash('Vui lòng nhập từ khóa tìm kiếm!', 'error')
+        return redirect(url_for('search_books'))
 
+    if query:
         try:
-            #  Kết nối database PostgreSQL
-            conn = library_system.db.get_connection()
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-
-            # Tìm theo tên, tác giả, hoặc năm
-            sql = """
-                SELECT * FROM books
-                WHERE title ILIKE %s
-                OR author ILIKE %s
-                OR CAST(year AS TEXT) ILIKE %s
-                ORDER BY title ASC
-            """
-            values = (f'%{query}%', f'%{query}%', f'%{query}%')
-            cursor.execute(sql, values)
-            results = cursor.fetchall()
-
-            if not results:
+            search = library_system.search_books(query, page)
+            if not search['results']:
                 flash(f'Không tìm thấy sách nào phù hợp với từ khóa "{query}"!', 'info')
-
-
         except Exception as e:
             flash(f'Lỗi khi tìm kiếm sách: {e}', 'error')
 
-        finally:
-            # Chỉ đóng nếu thực sự tồn tại
-            if cursor is not None:
-                try:
-                    cursor.close()
-                except:
-                    pass
-            if conn is not None:
-                try:
-                    conn.close()
-                except:
-                    pass
+    return render_template('search.html', query=query, results=search['results'], search=search)
 
-    return render_template('search.html', query=query, results=results)
+@app.route('/api/suggest')
+def api_suggest():
+    """
+    GỢI Ý TÌM KIẾM (JSON) CHO Ô TÌM KIẾM
+    - ?q=dac nh -> các sách có tên/tác giả bắt đầu bằng chuỗi đó (không cần dấu)
+    - Trả lời từ chỉ mục trong bộ nhớ, không truy vấn database
+    """
+    query = request.args.get('q', '')
+    limit = min(request.args.get('limit', SuggestIndex.MAX_RESULTS, type=int), 50)
+    return jsonify({
+        'query': query,
+        'suggestions': SUGGEST_INDEX.suggest(query, limit),
+    })
 
 # ============================================
 # KHỞI CHẠY ỨNG DỤNG
@@ -0,0 +1,294 @@
+# ============================================
+# API JSON BẤT ĐỒNG BỘ (Quart + psycopg 3)
+# ============================================
+# - Chạy song song với app Flask (HTML): cùng database, cùng schema, cùng câu SQL / luật nghiệp vụ
+#   của LibrarySystem và User (import từ app.py), chỉ khác driver: psycopg 3 async + pool async
+# - Mỗi request chờ database bằng await chứ không giữ cả 1 worker -> 1 process phục vụ được
+#   hàng nghìn request đang chờ I/O (Render / Neon qua TLS)
+# - Đọc chung cookie session với Flask (cùng secret_key): đăng nhập ở web là gọi được API giỏ hàng
+# - Câu đọc đi tới read replica như app Flask (cùng ReplicaRouter, cùng mốc sticky trong session)
+#
+# Chạy: hypercorn async_api:api --bind 0.0.0.0:8001
+#
+# Endpoint (tiền tố /api/v1):
+#   GET  /books?after=&before=&size=   -> 1 trang danh mục (keyset)
+#   GET  /books/<id>                   -> chi tiết sách
+#   GET  /search?q=&page=              -> tìm kiếm
+#   GET  /cart      POST /cart/<id>    -> giỏ hàng của user đang đăng nhập
+#   GET  /borrowed                     -> sách đang mượn
+
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+
+from psycopg import Error as PsycopgError
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool, PoolTimeout
+from quart import Quart, jsonify, request, session
+from werkzeug.sansio.http import is_resource_modified
+
+from app import (app as flask_app, DatabaseManager, FAILOVER, REPLICAS, CATALOG, LibrarySystem, User, log,
+                 catalog_validators, set_catalog_validators)
+
+api = Quart(__name__)
+api.secret_key = flask_app.secret_key  # Đọc được cookie session do Flask tạo ra
+
+
+class AsyncDatabase:
+    """
+    POOL KẾT NỐI BẤT ĐỒNG BỘ (1 pool psycopg_pool cho mỗi backend)
+    - Thử backend theo cùng thứ tự và cùng bộ ngắt mạch (FAILOVER) với app Flask
+    - Pool đầy thì request await chờ tới lượt, không chặn event loop
+    - connection(read=True): ưu tiên replica đang khỏe và đủ mới, không được thì về primary
+    """
+
+    POOL_MAX_SIZE = int(os.environ.get('ASYNC_POOL_MAX', 20))
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = asyncio.Lock()
+
+    async def _get_pool(self, name):
+        """
+        LẤY (HOẶC TẠO) POOL CỦA 1 BACKEND
+        - Chỉ đưa pool vào self._pools sau khi open() xong -> request khác không dùng phải pool chưa mở
+        - Backend chưa cấu hình (không có DSN) -> lỗi, người gọi chuyển sang backend kế tiếp
+        """
+        pool = self._pools.get(name)
+        if pool is not None:
+            return pool
+        async with self._lock:
+            pool = self._pools.get(name)
+            if pool is None:
+                dsn, kwargs = DatabaseManager.connect_args(name)
+                # autocommit: câu đọc không mở transaction treo; câu ghi dùng conn.transaction()
+                pool = AsyncConnectionPool(dsn, kwargs={**kwargs, 'autocommit': True}, min_size=0,
+                                           max_size=self.POOL_MAX_SIZE, timeout=DatabaseManager.POOL_TIMEOUT,
+                                           open=False, name=f"async-{name}")
+                await pool.open()
+                self._pools[name] = pool
+        return pool
+
+    @asynccontextmanager
+    async def connection(self, read=False):
+        """
+        MƯỢN 1 KẾT NỐI: async with db.connection() as conn: ...
+        - Kết nối ở chế độ autocommit; cần transaction thì dùng async with conn.transaction()
+        - read=True: chỉ đọc -> thử replica trước, trừ khi user vừa ghi (mốc sticky trong session)
+        """
+        reason = REPLICAS.primary_reason(primary_until=session.get(REPLICAS.SESSION_KEY, 0)) if read else None
+        replicas = REPLICAS.candidates() if read and reason is None else []
+
+        for name in replicas + FAILOVER.candidates():
+            replica = name in REPLICAS.names
+            health = REPLICAS.health if replica else FAILOVER
+            try:
+                pool = await self._get_pool(name)
+            except Exception as e:
+                log.warning("%s DB không khả dụng (async): %s", name.upper(), e)
+                health.mark_down(name, e)
+                continue
+            try:
+                conn = await pool.getconn()
+            except PoolTimeout as e:
+                # Pool đang có kết nối mà vẫn hết giờ -> chỉ là quá tải, không phải backend chết
+                if pool.get_stats().get('pool_size', 0) > 0:
+                    if replica:
+                        continue   # Replica quá tải thì đọc ở nơi khác
+                    raise
+                log.warning("%s DB không khả dụng (async): %s", name.upper(), e)
+                health.mark_down(name, e)
+                continue
+
+            if replica:
+                try:
+                    fresh = await self._replica_fresh(name, conn)
+                except PsycopgError as e:
+                    log.warning("Replica %s không khả dụng (async): %s", name.upper(), e)
+                    await pool.putconn(conn)
+                    health.mark_down(name, e)
+                    continue
+                if not fresh:
+                    await pool.putconn(conn)
+                    continue
+                REPLICAS.count(name, 'replica')
+            else:
+                FAILOVER.mark_up(name)
+                if read and REPLICAS.names:
+                    REPLICAS.count('primary', reason or 'fallback')
+            try:
+                yield conn
+            finally:
+                await pool.putconn(conn)
+            return
+
+        raise RuntimeError("Không thể kết nối tới bất kỳ database nào!")
+
+    @staticmethod
+    async def _replica_fresh(name, conn):
+        """Như ReplicaRouter.is_fresh nhưng đo độ trễ bằng await"""
+        fresh, ok = REPLICAS.lag_status(name)
+        if fresh:
+            return ok
+        cursor = await conn.execute(REPLICAS.LAG_SQL)
+        return REPLICAS.record_lag(name, (await cursor.fetchone())[0])
+
+    async def close(self):
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools = {}
+
+    def stats(self):
+        return {name: pool.get_stats() for name, pool in self._pools.items()}
+
+
+db = AsyncDatabase()
+
+# Tên cột cho các câu SQL trả về tuple của User (cart có 2 cột id nên không dùng dict_row)
+CART_FIELDS = ('cart_id', 'book_id', 'title', 'author', 'category', 'image_url')
+BORROWED_FIELDS = ('transaction_id', 'title', 'author', 'borrow_date', 'due_date', 'image_url', 'book_id')
+
+
+@api.before_serving
+async def listen_catalog():
+    """Nghe phiên bản danh mục (như app Flask) để trả 304 cho các endpoint danh mục"""
+    CATALOG.start()
+
+
+@api.after_serving
+async def close_pools():
+    await db.close()
+
+
+@api.errorhandler(RuntimeError)
+@api.errorhandler(PoolTimeout)
+async def database_unavailable(e):
+    """Không có backend nào / pool quá tải -> 503 để client thử lại sau"""
+    return jsonify({'error': str(e)}), 503
+
+
+def api_login_required(f):
+    """DECORATOR: API CHỈ DÀNH CHO USER ĐÃ ĐĂNG NHẬP (401 thay vì chuyển trang)"""
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if 'user' not in session or session['user']['role'] != 'user':
+            return jsonify({'error': 'Vui lòng đăng nhập!'}), 401
+        return await f(*args, **kwargs)
+    return decorated_function
+
+
+def api_catalog_conditional(f):
+    """
+    DECORATOR: 304 NẾU DANH MỤC CHƯA ĐỔI (cùng phiên bản / cách kiểm tra với catalog_conditional)
+    - JSON danh mục giống nhau cho mọi người xem -> ETag không gồm người xem, có Last-Modified
+    - Bỏ qua khi chưa LISTEN được phiên bản
+    """
+    @wraps(f)
+    async def decorated_function(*args, **kwargs):
+        if not CATALOG.live:
+            return await f(*args, **kwargs)
+
+        etag, last_modified = catalog_validators()
+        modified = is_resource_modified(
+            http_range=None, http_if_range=None,
+            http_if_modified_since=request.headers.get('If-Modified-Since'),
+            http_if_none_match=request.headers.get('If-None-Match'),
+            http_if_match=None, etag=etag, last_modified=last_modified,
+        )
+        if not modified:
+            response = api.response_class('', status=304)
+        else:
+            response = await api.make_response(await f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        return set_catalog_validators(response, etag, last_modified)
+    return decorated_function
+
+
+@api.route('/api/v1/books')
+@api_catalog_conditional
+async def books():
+    """1 TRANG DANH MỤC (cùng cursor với trang web)"""
+    after, before = request.args.get('after'), request.args.get('before')
+    limit = request.args.get('size', type=int)
+    limit = LibrarySystem.page_limit(limit)
+    after = LibrarySystem.decode_cursor(after) if after else None
+    before = LibrarySystem.decode_cursor(before) if before else None
+
+    async with db.connection(read=True) as conn:
+        cursor = await conn.execute(*LibrarySystem.catalog_query(after, before, limit))
+        rows = await cursor.fetchall()
+
+    return jsonify(LibrarySystem.catalog_page(rows, after, before, limit))
+
+
+@api.route('/api/v1/books/<int:book_id>')
+@api_catalog_conditional
+async def book_detail(book_id):
+    """CHI TIẾT 1 CUỐN SÁCH"""
+    async with db.connection(read=True) as conn:
+        cursor = await conn.execute(LibrarySystem.BOOK_DETAIL_SQL, (book_id,))
+        row = await cursor.fetchone()
+
+    if not row:
+        return jsonify({'error': 'Không tìm thấy sách!'}), 404
+    return jsonify(LibrarySystem.book_from_row(row))
+
+
+@api.route('/api/v1/search')
+async def search():
+    """TÌM KIẾM SÁCH (cùng cách xếp hạng với trang /search)"""
+    query = request.args.get('q', '').strip()
+    page = min(max(request.args.get('page', 1, type=int), 1), LibrarySystem.SEARCH_MAX_PAGE)
+    query_args = LibrarySystem.search_query(query, page)
+    if query_args is None:
+        return jsonify({'query': query, 'results': [], 'page': page, 'has_next': False})
+
+    async with db.connection(read=True) as conn:
+        cursor = conn.cursor(row_factory=dict_row)
+        await cursor.execute(*query_args)
+        rows = await cursor.fetchall()
+
+    return jsonify({'query': query, **LibrarySystem.search_page(rows, page)})
+
+
+@api.route('/api/v1/cart')
+@api_login_required
+async def cart():
+    """GIỎ HÀNG CỦA USER ĐANG ĐĂNG NHẬP"""
+    async with db.connection(read=True) as conn:
+        cursor = await conn.execute(User.CART_SQL, (session['user']['id'],))
+        rows = await cursor.fetchall()
+    return jsonify({'cart': [dict(zip(CART_FIELDS, row)) for row in rows]})
+
+
+@api.route('/api/v1/cart/<int:book_id>', methods=['POST'])
+@api_login_required
+async def add_to_cart(book_id):
+    """THÊM SÁCH VÀO GIỎ (cùng luật với User.add_to_cart)"""
+    async with db.connection() as conn, conn.transaction():
+        cursor = await conn.execute(User.ADD_TO_CART_SQL,
+                                    {'user_id': session['user']['id'], 'book_id': book_id})
+        success, message = User.add_to_cart_result(await cursor.fetchone())
+    if success and REPLICAS.names:
+        # Vừa ghi: giỏ hàng đọc ngay sau đó (ở đây hay ở web) phải thấy cuốn vừa thêm
+        session[REPLICAS.SESSION_KEY] = time.time() + REPLICAS.STICKY_SECONDS
+    return jsonify({'success': success, 'message': message}), 200 if success else 409
+
+
+@api.route('/api/v1/borrowed')
+@api_login_required
+async def borrowed():
+    """SÁCH USER ĐANG MƯỢN"""
+    async with db.connection(read=True) as conn:
+        cursor = await conn.execute(User.BORROWED_SQL, (session['user']['id'],))
+        rows = await cursor.fetchall()
+    return jsonify({'borrowed': [dict(zip(BORROWED_FIELDS, row)) for row in rows]})
+
+
+@api.route('/api/v1/db-stats')
+async def db_stats():
+    """THỐNG KÊ POOL BẤT ĐỒNG BỘ"""
+    return jsonify({'active_db': FAILOVER.active, 'pools': db.stats(), 'replicas': REPLICAS.stats()})
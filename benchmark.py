@@ -0,0 +1,538 @@
+# ============================================
+# ĐO HIỆU NĂNG: SINH DỮ LIỆU + TẢI GIẢ LẬP
+# ============================================
+# - seed:    sinh dữ liệu giả (sách / user / lịch sử mượn trả) bằng COPY vào database LOCAL
+#            (không bao giờ ghi vào Render / Neon); cùng --seed thì ra cùng bộ dữ liệu
+# - run:     nhiều người dùng ảo đồng thời gọi các route thật qua HTTP (trang chủ, tìm kiếm, chi tiết
+#            sách, dashboard, thêm giỏ -> mượn -> trả); báo throughput + p50/p95/p99 từng route
+#            và lưu kết quả JSON (kèm commit git) để so giữa các lần thay đổi
+# - compare: so 2 file kết quả
+#
+# Ví dụ:
+#   python benchmark.py seed --books 1000000 --users 100000 --transactions 10000000 --reset
+#   gunicorn app:app -w 4 -b 127.0.0.1:8000          (khởi động lại server sau khi seed)
+#   python benchmark.py run --url http://127.0.0.1:8000 --vus 50 --duration 60
+#   python benchmark.py compare bench_results/truoc.json bench_results/sau.json
+
+import csv
+import http.client
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+import click
+import psycopg2
+
+BENCH_USER_PREFIX = 'bench_user_'
+BENCH_PASSWORD = 'bench123'
+RESULTS_DIR = 'bench_results'
+
+# Từ vựng sinh tên sách / tác giả (trình điều khiển tải cũng tìm kiếm bằng các từ này)
+TITLE_WORDS = [
+    'Đắc', 'Nhân', 'Tâm', 'Nhà', 'Giả', 'Kim', 'Hoàng', 'Tử', 'Bé', 'Lịch', 'Sử', 'Thế', 'Giới',
+    'Việt', 'Nam', 'Con', 'Đường', 'Hạnh', 'Phúc', 'Tuổi', 'Trẻ', 'Đáng', 'Giá', 'Bao', 'Nhiêu',
+    'Mùa', 'Xuân', 'Hà', 'Nội', 'Sài', 'Gòn', 'Biển', 'Núi', 'Sông', 'Trăng', 'Gió', 'Mưa',
+    'Tình', 'Yêu', 'Gia', 'Đình', 'Ký', 'Ức', 'Hành', 'Trình', 'Khám', 'Phá', 'Bí', 'Mật',
+    'Clean', 'Code', 'Python', 'Data', 'Design', 'Pattern', 'Sapiens', 'Atomic', 'Habits',
+]
+AUTHOR_FIRST = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Vũ', 'Đặng', 'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương']
+AUTHOR_MIDDLE = ['Văn', 'Thị', 'Minh', 'Ngọc', 'Quang', 'Thanh', 'Hữu', 'Đức', 'Bảo', 'Gia']
+AUTHOR_LAST = ['An', 'Bình', 'Châu', 'Dũng', 'Giang', 'Hải', 'Hương', 'Khoa', 'Lan', 'Long',
+               'Mai', 'Nam', 'Phong', 'Quân', 'Sơn', 'Thảo', 'Trung', 'Tú', 'Vy', 'Yến']
+CATEGORIES = ['Văn học', 'Lịch sử', 'Công nghệ', 'Kỹ năng sống', 'Kinh tế', 'Khoa học',
+              'Thiếu nhi', 'Tâm lý', 'Triết học', 'Nghệ thuật']
+
+# Tỉ lệ các hành động của người dùng ảo (tổng không cần bằng 100)
+DEFAULT_MIX = {'index': 30, 'search': 25, 'book': 25, 'dashboard': 10, 'borrow': 10}
+
+
+# ============================================
+# SINH DỮ LIỆU
+# ============================================
+
+class DataGenerator:
+    """
+    SINH DỮ LIỆU GIẢ QUY MÔ LỚN BẰNG COPY (chỉ database local)
+    - Sinh từng chunk CSV trong bộ nhớ rồi COPY -> RAM không đổi dù 10 triệu dòng
+    - Cùng seed -> cùng dữ liệu (so sánh được giữa các lần chạy)
+    - Sau khi nạp: sửa available theo số sách đang mượn, tính lại bộ đếm thống kê,
+      chạy job quá hạn, VACUUM ANALYZE
+    """
+
+    CHUNK_SIZE = 100_000
+    OPEN_LOAN_DAYS = 30     # Chỉ giao dịch mượn trong 30 ngày gần nhất có thể còn đang mượn
+    HISTORY_DAYS = 730      # Lịch sử mượn trả trải trong 2 năm
+
+    def __init__(self, seed=42):
+        self.rng = random.Random(seed)
+        self.now = datetime.now().replace(microsecond=0)
+
+    @staticmethod
+    def connect():
+        """Kết nối thẳng tới database LOCAL (không qua failover -> không thể ghi nhầm lên cloud)"""
+        from app import DatabaseManager
+        dsn, kwargs = DatabaseManager.connect_args('local')
+        return psycopg2.connect(dsn, **kwargs)
+
+    def copy(self, conn, table, columns, rows, total):
+        """COPY các dòng (generator) vào bảng theo từng chunk, in tiến độ"""
+        cursor = conn.cursor()
+        sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+        started, done = time.perf_counter(), 0
+        while done < total:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            count = min(self.CHUNK_SIZE, total - done)
+            for _ in range(count):
+                writer.writerow(next(rows))
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
+            conn.commit()
+            done += count
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            click.echo(f"{table}: {done:,}/{total:,} dòng ({rate:,.0f} dòng/s)")
+
+    def book_rows(self):
+        rng = self.rng
+        while True:
+            title = ' '.join(rng.sample(TITLE_WORDS, rng.randint(2, 4)))
+            if rng.random() < 0.2:
+                title += f" - Tập {rng.randint(1, 20)}"
+            author = f"{rng.choice(AUTHOR_FIRST)} {rng.choice(AUTHOR_MIDDLE)} {rng.choice(AUTHOR_LAST)}"
+            quantity = rng.randint(1, 10)
+            created_at = self.now - timedelta(seconds=rng.randint(0, 5 * 365 * 86400))
+            yield (title, author, rng.choice(CATEGORIES), rng.randint(1950, self.now.year),
+                   quantity, quantity, '', f"Sách {title} của {author}", created_at)
+
+    def user_rows(self, start):
+        rng = self.rng
+        n = start
+        while True:
+            n += 1
+            yield (f"{BENCH_USER_PREFIX}{n}", BENCH_PASSWORD, f"{BENCH_USER_PREFIX}{n}@example.com",
+                   'user', rng.randint(0, 500))
+
+    def transaction_rows(self, users, books):
+        """users / books: (id nhỏ nhất, id lớn nhất) của dữ liệu vừa sinh"""
+        from app import OverdueEngine
+        rng = self.rng
+        while True:
+            borrow = self.now - timedelta(seconds=rng.randint(0, self.HISTORY_DAYS * 86400))
+            due = borrow.date() + timedelta(days=14)
+            user_id, book_id = rng.randint(*users), rng.randint(*books)
+            if (self.now - borrow).days < self.OPEN_LOAN_DAYS and rng.random() < 0.5:
+                yield (user_id, book_id, borrow, due, None, 'borrowed', 0, 0, 0)
+                continue
+            returned = min(borrow + timedelta(seconds=rng.randint(3600, 20 * 86400)), self.now)
+            late_days = max((returned.date() - due).days, 0)
+            fine = min(late_days * OverdueEngine.FINE_PER_DAY, OverdueEngine.FINE_MAX)
+            yield (user_id, book_id, borrow, due, returned, 'returned',
+                   20 if late_days == 0 else 5, late_days, fine)
+
+    @staticmethod
+    def max_id(cursor, table):
+        cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+        return cursor.fetchone()[0]
+
+    def run(self, books, users, transactions, reset=False):
+        from app import CATALOG, LibraryStats, OverdueEngine, library_system
+
+        conn = self.connect()
+        cursor = conn.cursor()
+        if reset:
+            cursor.execute('''
+                TRUNCATE books, users, cart, transactions, waitlist, overdue_summary, fragment_cache
+                RESTART IDENTITY CASCADE
+            ''')
+            conn.commit()
+            library_system.db.create_sample_data(cursor, conn)  # Lại có admin / user1 như lúc mới cài
+
+        book_start, user_start = self.max_id(cursor, 'books'), self.max_id(cursor, 'users')
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username LIKE %s", (BENCH_USER_PREFIX + '%',))
+        bench_users = cursor.fetchone()[0]
+        conn.commit()
+
+        self.copy(conn, 'books', ['title', 'author', 'category', 'year', 'quantity', 'available',
+                                  'image_url', 'description', 'created_at'], self.book_rows(), books)
+        self.copy(conn, 'users', ['username', 'password', 'email', 'role', 'points'],
+                  self.user_rows(bench_users), users)
+
+        book_ids = (book_start + 1, self.max_id(cursor, 'books'))
+        cursor.execute("SELECT MIN(id), MAX(id) FROM users WHERE username LIKE %s", (BENCH_USER_PREFIX + '%',))
+        user_ids = cursor.fetchone()
+        transaction_start = self.max_id(cursor, 'transactions')
+        conn.commit()
+        if transactions and book_ids[0] <= book_ids[1] and user_ids[0] is not None:
+            self.copy(conn, 'transactions', ['user_id', 'book_id', 'borrow_date', 'due_date', 'return_date',
+                                             'status', 'points_earned', 'late_days', 'fine'],
+                      self.transaction_rows(user_ids, book_ids), transactions)
+
+        click.echo("Đang đồng bộ available / thống kê...")
+        # Sách bị sinh nhiều lượt đang mượn hơn số bản -> các lượt dư coi như đã trả
+        cursor.execute('''
+            UPDATE transactions t
+            SET status = 'returned', return_date = t.borrow_date + INTERVAL '1 day', points_earned = 20
+            FROM (
+                SELECT o.id
+                FROM (SELECT id, book_id, ROW_NUMBER() OVER (PARTITION BY book_id ORDER BY id) AS n
+                      FROM transactions
+                      WHERE id > %(tx_start)s AND status = 'borrowed') o
+                JOIN books b ON b.id = o.book_id
+                WHERE o.n > b.quantity
+            ) extra
+            WHERE t.id = extra.id
+        ''', {'tx_start': transaction_start})
+        cursor.execute('''
+            UPDATE books b SET available = b.quantity - o.loans
+            FROM (SELECT book_id, COUNT(*) AS loans FROM transactions
+                  WHERE id > %(tx_start)s AND status = 'borrowed'
+                  GROUP BY book_id) o
+            WHERE b.id = o.book_id AND b.id > %(book_start)s
+        ''', {'tx_start': transaction_start, 'book_start': book_start})
+        CATALOG.bump(cursor)
+        conn.commit()
+        CATALOG.touch()
+
+        LibraryStats.reconcile(conn)
+        OverdueEngine.run(conn)
+
+        conn.autocommit = True
+        for table in ('books', 'users', 'transactions'):
+            cursor.execute(f"VACUUM (ANALYZE) {table}")
+        conn.close()
+
+
+def dataset_info():
+    """Quy mô dữ liệu hiện có + khoảng id để người dùng ảo chọn sách / tài khoản"""
+    conn = DataGenerator.connect()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT (SELECT COUNT(*) FROM books), (SELECT MIN(id) FROM books), (SELECT MAX(id) FROM books),
+               (SELECT COUNT(*) FROM users WHERE username LIKE %(prefix)s),
+               (SELECT reltuples::bigint FROM pg_class WHERE relname = 'transactions')
+    ''', {'prefix': BENCH_USER_PREFIX + '%'})
+    books, min_book, max_book, users, transactions = cursor.fetchone()
+    conn.close()
+    return {'books': books, 'book_ids': [min_book, max_book], 'bench_users': users,
+            'transactions_estimate': max(transactions, 0)}
+
+
+# ============================================
+# TẢI GIẢ LẬP
+# ============================================
+
+class VirtualUser(threading.Thread):
+    """
+    1 NGƯỜI DÙNG ẢO: đăng nhập rồi lặp các hành động theo tỉ lệ trong mix tới hết giờ
+    - Giữ 1 kết nối HTTP keep-alive + cookie session riêng
+    - Không tự đi theo redirect: đo đúng route được gọi
+    - Chỉ ghi nhận request bắt đầu sau thời gian khởi động (warmup)
+    """
+
+    RETURN_LINK = re.compile(r'/user/return/(\d+)')
+    NEXT_PAGE_LINK = re.compile(r'href="(/\?after=[^"]+)"')
+
+    def __init__(self, runner, index, username):
+        super().__init__(daemon=True)
+        self.runner = runner
+        self.username = username
+        self.rng = random.Random(runner.seed * 1_000_003 + index)
+        self.cookies = {}
+        self.samples = {}   # route -> [thời gian (ms)]
+        self.errors = {}    # route -> số lỗi
+        self.conn = None
+
+    def connect(self):
+        url = urlsplit(self.runner.url)
+        cls = http.client.HTTPSConnection if url.scheme == 'https' else http.client.HTTPConnection
+        return cls(url.hostname, url.port, timeout=30)
+
+    def request(self, route, path, method='GET', form=None, expect=(200,), anonymous=False):
+        """
+        Gửi 1 request, ghi nhận thời gian của route; trả về (status, body) hoặc (None, '') khi lỗi
+        - anonymous: gửi như khách chưa đăng nhập (không gửi / không nhận cookie session)
+        """
+        headers = {} if anonymous else {'Cookie': '; '.join(f"{k}={v}" for k, v in self.cookies.items())}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        started = time.perf_counter()
+        status, text = None, ''
+        for attempt in range(2):
+            try:
+                if self.conn is None:
+                    self.conn = self.connect()
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                text = response.read().decode('utf-8', 'replace')
+                status = response.status
+                for header in [] if anonymous else response.headers.get_all('Set-Cookie') or []:
+                    for name, morsel in SimpleCookie(header).items():
+                        self.cookies[name] = morsel.value
+                break
+            except (http.client.HTTPException, OSError):
+                # Kết nối keep-alive bị server đóng -> mở lại và thử 1 lần nữa
+                self.conn.close()
+                self.conn = None
+                started = time.perf_counter()
+        elapsed = (time.perf_counter() - started) * 1000
+
+        if started >= self.runner.measure_from and time.perf_counter() <= self.runner.deadline:
+            self.samples.setdefault(route, []).append(elapsed)
+            if status not in expect:
+                self.errors[route] = self.errors.get(route, 0) + 1
+        return status, text
+
+    def random_book(self):
+        return self.rng.randint(*self.runner.book_ids)
+
+    def random_query(self):
+        from app import fold_text
+        words = ' '.join(self.rng.sample(TITLE_WORDS, self.rng.randint(1, 2)))
+        # Phần lớn người dùng gõ không dấu
+        return words if self.rng.random() < 0.3 else fold_text(words)
+
+    def do_index(self):
+        """Trang chủ chỉ hiện danh mục cho khách (user đăng nhập bị chuyển sang dashboard)"""
+        status, html = self.request('index', '/', anonymous=True)
+        match = self.NEXT_PAGE_LINK.search(html)
+        if match and self.rng.random() < 0.5:
+            self.request('index_next_page', match.group(1).replace('&amp;', '&'), anonymous=True)
+
+    def do_search(self):
+        self.request('search', '/search?' + urlencode({'q': self.random_query()}))
+
+    def do_book(self):
+        self.request('book', f"/book/{self.random_book()}", expect=(200, 302))
+
+    def do_dashboard(self):
+        return self.request('dashboard', '/user/dashboard')[1]
+
+    def do_borrow(self):
+        """Thêm 1 sách vào giỏ -> mượn -> xem dashboard -> trả 1 cuốn đang mượn"""
+        self.request('add_to_cart', f"/user/add-to-cart/{self.random_book()}", expect=(302,))
+        self.request('checkout', '/user/checkout', expect=(302,))
+        match = self.RETURN_LINK.search(self.do_dashboard())
+        if match:
+            self.request('return', f"/user/return/{match.group(1)}", expect=(302,))
+
+    def run(self):
+        self.request('login', '/login', method='POST',
+                     form={'username': self.username, 'password': BENCH_PASSWORD}, expect=(302,))
+        actions = [getattr(self, f"do_{name}") for name in self.runner.mix]
+        weights = list(self.runner.mix.values())
+        while time.perf_counter() < self.runner.deadline:
+            self.rng.choices(actions, weights)[0]()
+            if self.runner.think:
+                time.sleep(self.rng.uniform(0, 2 * self.runner.think))
+        if self.conn is not None:
+            self.conn.close()
+
+
+def percentile(values, p):
+    """Phân vị theo hạng gần nhất (values đã sắp xếp)"""
+    if not values:
+        return None
+    return values[max(math.ceil(p / 100 * len(values)) - 1, 0)]
+
+
+def summarize(samples, errors, seconds):
+    values = sorted(samples)
+    return {
+        'requests': len(values),
+        'errors': errors,
+        'rps': round(len(values) / seconds, 2),
+        'mean_ms': round(sum(values) / len(values), 2) if values else None,
+        **{f"p{p}_ms": round(percentile(values, p), 2) if values else None for p in (50, 95, 99)},
+        'max_ms': round(values[-1], 2) if values else None,
+    }
+
+
+class LoadRunner:
+    """
+    CHẠY TẢI: vus người dùng ảo song song trong warmup + duration giây, gộp kết quả
+    - Thread đủ cho phía client: thời gian chờ nằm ở server, không ở Python
+    """
+
+    def __init__(self, url, vus, duration, warmup, mix, think, seed, dataset):
+        self.url = url.rstrip('/')
+        self.vus = vus
+        self.duration = duration
+        self.warmup = warmup
+        self.mix = mix
+        self.think = think
+        self.seed = seed
+        self.dataset = dataset
+        self.book_ids = dataset['book_ids']
+
+    def run(self):
+        if not self.dataset['bench_users']:
+            raise click.ClickException("Chưa có user benchmark, hãy chạy: python benchmark.py seed")
+        rng = random.Random(self.seed)
+        usernames = [f"{BENCH_USER_PREFIX}{n}"
+                     for n in rng.sample(range(1, self.dataset['bench_users'] + 1),
+                                         min(self.vus, self.dataset['bench_users']))]
+        started_at = datetime.now().isoformat(timespec='seconds')
+        start = time.perf_counter()
+        self.measure_from = start + self.warmup
+        self.deadline = self.measure_from + self.duration
+
+        users = [VirtualUser(self, i, usernames[i % len(usernames)]) for i in range(self.vus)]
+        for user in users:
+            user.start()
+        for user in users:
+            user.join()
+
+        routes = {}
+        for user in users:
+            for route, values in user.samples.items():
+                merged = routes.setdefault(route, {'samples': [], 'errors': 0})
+                merged['samples'].extend(values)
+            for route, count in user.errors.items():
+                routes.setdefault(route, {'samples': [], 'errors': 0})['errors'] += count
+
+        return {
+            'meta': {
+                'started_at': started_at,
+                'url': self.url,
+                'virtual_users': self.vus,
+                'duration_s': self.duration,
+                'warmup_s': self.warmup,
+                'think_s': self.think,
+                'mix': self.mix,
+                'seed': self.seed,
+                'git': git_revision(),
+                'dataset': self.dataset,
+            },
+            'total': summarize([v for r in routes.values() for v in r['samples']],
+                               sum(r['errors'] for r in routes.values()), self.duration),
+            'routes': {route: summarize(r['samples'], r['errors'], self.duration)
+                       for route, r in sorted(routes.items())},
+        }
+
+
+def git_revision():
+    """Commit hiện tại (+ '-dirty' nếu có thay đổi chưa commit), để biết kết quả đo cho phiên bản nào"""
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+        dirty = subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no'], text=True,
+                                        stderr=subprocess.DEVNULL).strip()
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result):
+    click.echo(f"\n{'route':<18}{'req':>9}{'err':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}  (ms)")
+    for route, r in [*result['routes'].items(), ('TỔNG', result['total'])]:
+        click.echo(f"{route:<18}{r['requests']:>9}{r['errors']:>6}{r['rps']:>9}"
+                   f"{r['p50_ms'] or '-':>9}{r['p95_ms'] or '-':>9}{r['p99_ms'] or '-':>9}{r['max_ms'] or '-':>9}")
+
+
+def parse_mix(value):
+    """'index=30,search=25' -> {'index': 30, 'search': 25}"""
+    mix = {}
+    for part in filter(None, (p.strip() for p in value.split(','))):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise click.BadParameter(f"Không có hành động '{name}'. Các hành động: {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise click.BadParameter(f"Tỉ lệ không hợp lệ: {part}")
+    if not mix or sum(mix.values()) <= 0:
+        raise click.BadParameter("Mix phải có ít nhất 1 hành động tỉ lệ > 0")
+    return mix
+
+
+# ============================================
+# CLI
+# ============================================
+
+@click.group()
+def cli():
+    """Đo hiệu năng hệ thống thư viện"""
+
+
+@cli.command()
+@click.option('--books', default=100_000, show_default=True, help="Số sách sinh thêm")
+@click.option('--users', default=10_000, show_default=True, help="Số user benchmark sinh thêm")
+@click.option('--transactions', default=1_000_000, show_default=True, help="Số giao dịch mượn trả sinh thêm")
+@click.option('--seed', default=42, show_default=True, help="Cùng seed -> cùng dữ liệu")
+@click.option('--reset', is_flag=True, help="XÓA toàn bộ sách / user / giao dịch trước khi sinh")
+def seed(books, users, transactions, seed, reset):
+    """Sinh dữ liệu giả bằng COPY vào database local"""
+    if reset:
+        click.confirm("Xóa toàn bộ dữ liệu trong database LOCAL?", abort=True)
+    started = time.perf_counter()
+    DataGenerator(seed).run(books, users, transactions, reset=reset)
+    click.echo(f"Xong sau {time.perf_counter() - started:.1f}s: {dataset_info()}")
+
+
+@cli.command()
+@click.option('--url', default='http://127.0.0.1:5000', show_default=True, help="Server đang chạy app")
+@click.option('--vus', default=20, show_default=True, help="Số người dùng ảo đồng thời")
+@click.option('--duration', default=60.0, show_default=True, help="Thời gian đo (giây)")
+@click.option('--warmup', default=10.0, show_default=True, help="Thời gian khởi động, không tính vào kết quả (giây)")
+@click.option('--mix', default=','.join(f"{k}={v}" for k, v in DEFAULT_MIX.items()), show_default=True,
+              help="Tỉ lệ hành động")
+@click.option('--think', default=0.0, show_default=True, help="Thời gian nghỉ trung bình giữa 2 hành động (giây)")
+@click.option('--seed', default=42, show_default=True)
+@click.option('--out', type=click.Path(dir_okay=False), help=f"File JSON kết quả (mặc định {RESULTS_DIR}/<thời gian>.json)")
+def run(url, vus, duration, warmup, mix, think, seed, out):
+    """Chạy tải giả lập lên server và lưu kết quả JSON"""
+    runner = LoadRunner(url, vus, duration, warmup, parse_mix(mix), think, seed, dataset_info())
+    click.echo(f"{vus} người dùng ảo -> {url} trong {warmup:g}s khởi động + {duration:g}s đo...")
+    result = runner.run()
+    print_report(result)
+
+    if not out:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        out = os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{result['meta']['git'] or 'nogit'}.json")
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    click.echo(f"\nĐã lưu kết quả: {out}")
+
+
+@cli.command()
+@click.argument('baseline', type=click.Path(exists=True, dir_okay=False))
+@click.argument('candidate', type=click.Path(exists=True, dir_okay=False))
+def compare(baseline, candidate):
+    """So 2 file kết quả (throughput và p50/p95/p99 từng route)"""
+    with open(baseline, encoding='utf-8') as f:
+        old = json.load(f)
+    with open(candidate, encoding='utf-8') as f:
+        new = json.load(f)
+
+    def delta(a, b):
+        if not a or b is None:
+            return '-'
+        return f"{(b - a) / a * 100:+.0f}%"
+
+    click.echo(f"{old['meta']['git']} ({old['meta']['started_at']}) -> {new['meta']['git']} ({new['meta']['started_at']})")
+    click.echo(f"\n{'route':<18}{'rps':>22}{'p50 (ms)':>22}{'p95 (ms)':>22}{'p99 (ms)':>22}")
+    routes = sorted(set(old['routes']) | set(new['routes']))
+    rows = [(route, old['routes'].get(route), new['routes'].get(route)) for route in routes]
+    rows.append(('TỔNG', old['total'], new['total']))
+    for route, a, b in rows:
+        cells = []
+        for key in ('rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            va, vb = (a or {}).get(key), (b or {}).get(key)
+            cells.append(f"{va if va is not None else '-'} -> {vb if vb is not None else '-'} {delta(va, vb)}")
+        click.echo(f"{route:<18}" + ''.join(f"{cell:>22}" for cell in cells))
+
+
+if __name__ == '__main__':
+    cli()
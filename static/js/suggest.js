@@ -0,0 +1,43 @@
+// GỢI Ý TÌM KIẾM (autocomplete) cho ô tìm kiếm trong search.html
+// - Gọi /api/suggest?q=... sau khi người dùng ngừng gõ 150ms
+// - Hiển thị danh sách sách gợi ý, bấm vào để xem chi tiết
+
+document.addEventListener('DOMContentLoaded', () => {
+    const input = document.querySelector('.search-input');
+    const list = document.querySelector('.suggest-list');
+    if (!input || !list) return;
+
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(async () => {
+            const q = input.value.trim();
+            if (!q) {
+                list.innerHTML = '';
+                return;
+            }
+
+            // Hủy request cũ nếu người dùng đã gõ tiếp
+            if (controller) controller.abort();
+            controller = new AbortController();
+
+            try {
+                const res = await fetch(`/api/suggest?q=${encodeURIComponent(q)}`, { signal: controller.signal });
+                const data = await res.json();
+                list.innerHTML = '';
+                data.suggestions.forEach(book => {
+                    const li = document.createElement('li');
+                    const a = document.createElement('a');
+                    a.href = `/book/${book.id}`;
+                    a.textContent = `${book.title} — ${book.author}`;
+                    li.appendChild(a);
+                    list.appendChild(li);
+                });
+            } catch (e) {
+                if (e.name !== 'AbortError') console.log('Lỗi gợi ý tìm kiếm:', e);
+            }
+        }, 150);
+    });
+});
@@ -0,0 +1,98 @@
+# ============================================
+# CẤU HÌNH PYTEST
+# ============================================
+# - Mặc định chạy trên engine SQLite (DB_ENGINE=sqlite) với file database tạm, không đụng library.db
+# - Chạy trên PostgreSQL: DB_ENGINE=postgres DB_BACKENDS=local python -m pytest
+#   (mỗi test tự tạo user / sách tên ngẫu nhiên nên không cần database trống)
+
+import os
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+_TMP = tempfile.mkdtemp(prefix='library-tests-')
+os.environ.setdefault('DB_ENGINE', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(_TMP, 'library.db'))
+os.environ.setdefault('COVER_DIR', os.path.join(_TMP, 'covers'))
+os.environ.setdefault('METRICS_DIR', os.path.join(_TMP, 'metrics'))
+os.environ.setdefault('SERVER_TIMING', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as library_app  # noqa: E402  (phải import sau khi đặt biến môi trường)
+
+# Không chạy job định kỳ / thread nền trong lúc test (test tự gọi job khi cần)
+library_app.app.before_request_funcs[None].remove(library_app.start_background_tasks)
+
+
+@pytest.fixture
+def app_module():
+    return library_app
+
+
+@pytest.fixture
+def client():
+    library_app.app.config['TESTING'] = True
+    return library_app.app.test_client()
+
+
+def query(sql, params=None):
+    """Chạy 1 câu SQL trên kết nối riêng rồi commit; trả về các dòng (nếu có)"""
+    conn = library_app.library_system.db.get_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+        rows = cursor.fetchall() if cursor.description else None
+        conn.commit()
+        return rows
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def make_user():
+    """Tạo user mới (tên ngẫu nhiên) -> object User; mật khẩu luôn là 'secret'"""
+    def make():
+        username = f"u_{uuid.uuid4().hex[:10]}"
+        ok, message = library_app.library_system.register(username, 'secret', f"{username}@test.local")
+        assert ok, message
+        info, _ = library_app.library_system.login(username, 'secret')
+        return library_app.User(info['id'], info['username'], info['email'], info['points'])
+    return make
+
+
+@pytest.fixture
+def admin():
+    info, _ = library_app.library_system.login('admin', 'admin123')
+    return library_app.Admin(info['id'], info['username'], info['email'])
+
+
+@pytest.fixture
+def make_book(admin):
+    """Thêm sách mới (tên ngẫu nhiên) với quantity bản -> book_id"""
+    def make(quantity=1, image_url=''):
+        title = f"Sách {uuid.uuid4().hex[:10]}"
+        ok, message = admin.add_book(title, 'Tác giả Test', 'Test', 2024, quantity, image_url, '')
+        assert ok, message
+        return query("SELECT id FROM books WHERE title = %s", (title,))[0][0]
+    return make
+
+
+def borrow(user, book_id):
+    """Mượn 1 cuốn qua giỏ hàng -> transaction_id"""
+    assert user.add_to_cart(book_id)[0]
+    ok, message = user.checkout()
+    assert ok, message
+    return query("SELECT id FROM transactions WHERE user_id = %s AND book_id = %s AND status = 'borrowed'",
+                 (user.user_id, book_id))[0][0]
+
+
+def available(book_id):
+    return query("SELECT available FROM books WHERE id = %s", (book_id,))[0][0]
+
+
+def waitlist_status(book_id):
+    """{user_id: status} của hàng chờ 1 cuốn sách"""
+    return dict(query("SELECT user_id, status FROM waitlist WHERE book_id = %s", (book_id,)))
@@ -0,0 +1,74 @@
+# ============================================
+# TEST: API JSON BẤT ĐỒNG BỘ (chỉ PostgreSQL)
+# ============================================
+
+import asyncio
+
+import pytest
+
+
+@pytest.fixture
+def async_api(app_module, monkeypatch):
+    if app_module.DatabaseManager.SQLITE:
+        pytest.skip("API bất đồng bộ chỉ chạy trên PostgreSQL")
+    module = pytest.importorskip('async_api')
+    # Pool async gắn với event loop -> mỗi test 1 bộ pool mới (mỗi test 1 asyncio.run)
+    monkeypatch.setattr(module, 'db', module.AsyncDatabase())
+    return module
+
+
+def run(async_api, scenario):
+    async def main():
+        try:
+            return await scenario(async_api.api.test_client())
+        finally:
+            await async_api.db.close()
+    return asyncio.run(main())
+
+
+def test_catalog_endpoints_revalidate(app_module, async_api, monkeypatch, make_book):
+    monkeypatch.setattr(app_module.CATALOG, 'live', True)
+    book_id = make_book()
+
+    async def scenario(client):
+        for path in ('/api/v1/books?size=2', f'/api/v1/books/{book_id}'):
+            first = await client.get(path)
+            assert first.status_code == 200
+            etag = first.headers['ETag']
+            assert first.headers['Last-Modified']
+            again = await client.get(path, headers={'If-None-Match': etag})
+            assert again.status_code == 304
+            assert await again.get_data() == b''
+
+        app_module.CATALOG._advance(app_module.CATALOG.version + 1)
+        changed = await client.get(f'/api/v1/books/{book_id}', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        missing = await client.get('/api/v1/books/999999999')
+        assert missing.status_code == 404 and 'ETag' not in missing.headers
+
+    run(async_api, scenario)
+
+
+def test_unconfigured_backend_skipped(app_module, async_api, monkeypatch):
+    """Backend không có DSN (vd. chưa đặt DATABASE_URL_RENDER) -> ngắt mạch và dùng backend kế tiếp"""
+    failover = app_module.FAILOVER
+    monkeypatch.setattr(failover, 'backends', ['render', *failover.backends])
+    monkeypatch.setattr(failover, '_down', {})
+    monkeypatch.setattr(app_module.DatabaseManager, 'DATABASE_URL_RENDER', None, raising=False)
+
+    async def scenario(client):
+        response = await client.get('/api/v1/books?size=1')
+        assert response.status_code == 200
+
+    run(async_api, scenario)
+    assert 'render' in failover.stats()['down']
+
+
+def test_pool_published_once_open(async_api):
+    async def scenario(client):
+        pools = await asyncio.gather(*(async_api.db._get_pool('local') for _ in range(5)))
+        assert all(pool is pools[0] for pool in pools)
+        assert not pools[0].closed
+        assert list(async_api.db._pools) == ['local']
+
+    run(async_api, scenario)
@@ -0,0 +1,88 @@
+# ============================================
+# TEST: LRU + TTL CACHE / PHIÊN BẢN DANH MỤC
+# ============================================
+
+from conftest import borrow, query
+
+
+def test_lru_evicts_least_recently_used(app_module):
+    cache = app_module.LRUCache(max_bytes=200, ttl=60)
+    cache.set('a', 'x' * 40)
+    cache.set('b', 'y' * 40)
+    assert cache.get('a') is not None   # 'a' vừa dùng -> 'b' là mục cũ nhất
+    cache.set('c', 'z' * 40)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None and cache.get('c') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.bytes <= cache.max_bytes
+
+
+def test_oversized_value_not_cached(app_module):
+    cache = app_module.LRUCache(max_bytes=100, ttl=60)
+    cache.set('big', 'x' * 500)
+    assert cache.get('big') is None
+    assert cache.bytes == 0
+
+
+def test_ttl_expiry(app_module, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(app_module.time, 'monotonic', lambda: clock[0])
+    cache = app_module.LRUCache(max_bytes=1024, ttl=30)
+    cache.set('k', 'v')
+    clock[0] += 29
+    assert cache.get('k') == 'v'
+    clock[0] += 2
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+    assert cache.bytes == 0
+
+
+def test_book_cache_invalidated_by_catalog_change(app_module, make_user, make_book):
+    system = app_module.library_system
+    book_id = make_book(quantity=2)
+    assert system.get_book_by_id(book_id)['available'] == 2
+
+    # Sửa thẳng database (không qua bump/touch): vẫn đọc bản trong cache
+    query("UPDATE books SET description = 'sửa tay' WHERE id = %s", (book_id,))
+    assert system.get_book_by_id(book_id)['description'] == ''
+
+    # Mượn sách: bump() trong transaction + touch() sau commit -> khóa cache mới
+    key = app_module.CATALOG.key()
+    borrow(make_user(), book_id)
+    assert app_module.CATALOG.key() != key
+    book = system.get_book_by_id(book_id)
+    assert book['available'] == 1
+    assert book['description'] == 'sửa tay'
+
+
+def test_catalog_page_cache_follows_version(app_module, make_book):
+    system = app_module.library_system
+    first = system.get_all_books(limit=1)
+    assert system.get_all_books(limit=1) is first   # Cache hit: cùng object
+    book_id = make_book()
+    assert system.get_all_books(limit=1)['books'][0]['id'] == book_id
+
+
+def test_fragment_cache_keys_are_canonical(app_module, client, make_book):
+    make_book()
+    fragments = app_module.FRAGMENT_CACHE
+    assert client.get('/?size=100').status_code == 200
+    renders = fragments.renders
+    for variant in ('/?size=100', '/?size=5000', '/?size=100&after='):
+        assert client.get(variant).status_code == 200
+    assert fragments.renders == renders   # Cùng 1 trang -> cùng 1 khóa
+
+    cursor = client.get('/?size=1').get_data(as_text=True).split('after=')[1].split('"')[0].split('&')[0]
+    renders = fragments.renders
+    assert client.get(f'/?size=1&after={cursor}').status_code == 200
+    assert client.get(f'/?size=1&after={cursor}==').status_code == 200
+    assert fragments.renders == renders + 1
+
+
+def test_invalid_cursor_not_cached(app_module, client):
+    fragments = app_module.FRAGMENT_CACHE
+    for _ in range(2):
+        renders = fragments.renders
+        assert client.get('/?after=garbage').status_code == 200
+        assert fragments.renders == renders   # Render thẳng, không qua FRAGMENT_CACHE
+    assert not any('garbage' in key[0] for key in list(fragments.local._data))
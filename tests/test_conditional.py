@@ -0,0 +1,83 @@
+# ============================================
+# TEST: ETAG / 304 CỦA TRANG DANH MỤC
+# ============================================
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def live_catalog(app_module, monkeypatch):
+    """Giả lập worker đang LISTEN được phiên bản danh mục (SQLite không có LISTEN)"""
+    monkeypatch.setattr(app_module.CATALOG, 'live', True)
+
+
+def login(client, user):
+    response = client.post('/login', data={'username': user.username, 'password': 'secret'})
+    assert response.status_code == 302
+    client.get(response.headers['Location'])   # Hiển thị xong flash "đăng nhập thành công"
+
+
+def test_guest_revalidation(client, app_module, make_book):
+    book_id = make_book()
+    first = client.get(f'/book/{book_id}')
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Last-Modified']
+    assert 'Cookie' in first.headers['Vary']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get(f'/book/{book_id}', headers={'If-None-Match': etag})
+    assert again.status_code == 304
+    assert again.get_data() == b''
+
+    # Danh mục đổi -> ETag mới, trang được render lại
+    app_module.CATALOG._advance(app_module.CATALOG.version + 1)
+    changed = client.get(f'/book/{book_id}', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+
+
+def test_etag_is_per_user(app_module, make_user, make_book):
+    page = f'/book/{make_book()}'
+    first_user, second_user = make_user(), make_user()
+    first, second = app_module.app.test_client(), app_module.app.test_client()
+    login(first, first_user)
+    login(second, second_user)
+
+    response = first.get(page)
+    etag = response.headers['ETag']
+    assert str(first_user.user_id) in etag
+    assert 'Last-Modified' not in response.headers
+    assert first.get(page, headers={'If-None-Match': etag}).status_code == 304
+
+    # Cùng vai trò nhưng người khác -> không được dùng bản đã lưu của người trước
+    assert second.get(page, headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_logged_in_page_not_validated_by_guest_etag(client, make_user, make_book):
+    page = f'/book/{make_book()}'
+    etag = client.get(page).headers['ETag']
+    login(client, make_user())
+    response = client.get(page, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_pending_flash_skips_conditional(client, make_book):
+    page = f'/book/{make_book()}'
+    etag = client.get(page).headers['ETag']
+    with client.session_transaction() as sess:
+        sess['_flashes'] = [('success', 'Đã trả sách!')]
+    response = client.get(page, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Đã trả sách!' in response.get_data(as_text=True)
+    assert client.get(page, headers={'If-None-Match': etag}).status_code == 304
+
+
+def test_not_live_skips_conditional(client, app_module, monkeypatch, make_book):
+    page = f'/book/{make_book()}'
+    etag = client.get(page).headers['ETag']
+    monkeypatch.setattr(app_module.CATALOG, 'live', False)
+    response = client.get(page, headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'ETag' not in response.headers
@@ -0,0 +1,102 @@
+# ============================================
+# TEST: KẾT NỐI DÙNG CHUNG (RequestConnection / kết nối SQLite của thread)
+# ============================================
+
+import pytest
+
+from conftest import available
+
+
+@pytest.fixture
+def postgres_only(app_module):
+    if app_module.DatabaseManager.SQLITE:
+        pytest.skip("SQLite không dùng RequestConnection")
+
+
+@pytest.fixture
+def request_db(app_module):
+    with app_module.app.test_request_context('/'):
+        yield app_module.library_system.db
+        app_module.release_request_connection(None)
+
+
+def test_early_return_does_not_leak_into_next_commit(app_module, request_db, make_book):
+    book_id = make_book(quantity=3)
+
+    # Method 1 ghi rồi return sớm, không commit
+    conn = request_db.get_connection()
+    conn.cursor().execute("UPDATE books SET available = 0 WHERE id = %s", (book_id,))
+    conn.close()
+
+    # Method 2 dùng lại kết nối của request và commit phần của nó
+    conn = request_db.get_connection()
+    conn.cursor().execute("SELECT 1")
+    conn.commit()
+    conn.close()
+
+    assert available(book_id) == 3
+
+
+def test_nested_handle_does_not_leak_into_next_commit(request_db, make_book):
+    """Method ngoài còn giữ kết nối (handle chưa đóng) trong lúc method bên trong return sớm"""
+    book_id = make_book(quantity=3)
+    outer = request_db.get_connection()
+    try:
+        inner = request_db.get_connection()
+        inner.cursor().execute("UPDATE books SET available = 0 WHERE id = %s", (book_id,))
+        inner.close()
+
+        other = request_db.get_connection()
+        other.cursor().execute("SELECT 1")
+        other.commit()
+        other.close()
+    finally:
+        outer.close()
+
+    assert available(book_id) == 3
+
+
+def test_teardown_rolls_back_before_returning_to_pool(app_module, postgres_only, make_book):
+    book_id = make_book(quantity=3)
+    with app_module.app.test_request_context('/'):
+        conn = app_module.library_system.db.get_connection()
+        conn.cursor().execute("SELECT id FROM books WHERE id = %s FOR UPDATE", (book_id,))
+        raw = conn._conn._conn
+        app_module.release_request_connection(None)
+    assert raw.get_transaction_status() == app_module.psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    assert available(book_id) == 3
+
+
+def test_fragment_store_does_not_pin_viewer_to_primary(app_module, postgres_only, monkeypatch):
+    monkeypatch.setattr(app_module.REPLICAS, 'names', ['replica'])
+    with app_module.app.test_request_context('/'):
+        conn = app_module.library_system.db.get_connection()   # Request đã có kết nối primary dùng chung
+        conn.close()
+        app_module.FRAGMENT_CACHE._store_shared('test:grid', app_module.CATALOG.version, '<div></div>')
+        assert not app_module.g.get('_db_wrote')
+        response = app_module.stick_to_primary(app_module.app.response_class())
+        assert app_module.REPLICAS.SESSION_KEY not in app_module.session
+        app_module.release_request_connection(None)
+    assert response.status_code == 200
+
+
+def test_broken_connection_discarded_once(app_module):
+    class Broken:
+        closed = False
+
+        def get_transaction_status(self):
+            return app_module.psycopg2.extensions.TRANSACTION_STATUS_INERROR
+
+        def rollback(self):
+            raise app_module.psycopg2.OperationalError("server closed the connection")
+
+        def close(self):
+            self.closed = True
+
+    pool = app_module.ConnectionPool('test', Broken, maxconn=1)
+    conn = pool.getconn()
+    raw = conn._conn
+    conn.close()
+    stats = pool.stats()
+    assert raw.closed
+    assert (stats['discarded'], stats['in_use'], stats['idle']) == (1, 0, 0)
@@ -0,0 +1,113 @@
+# ============================================
+# TEST: ẢNH BÌA (CoverCache)
+# ============================================
+
+import http.server
+import socket
+import threading
+
+import pytest
+
+
+def test_static_cover_processed(app_module, tmp_path):
+    covers = app_module.CoverCache(str(tmp_path), static_folder=app_module.app.static_folder)
+    image_url = '/static/' + app_module.CoverCache.DEFAULT
+    covers.process(image_url)
+    digests = covers.lookup(image_url)
+    assert set(digests) == set(app_module.CoverCache.SIZES)
+    for size, digest in digests.items():
+        assert (tmp_path / size / digest[:2] / f"{digest}.webp").exists()
+
+
+@pytest.mark.parametrize('image_url', [
+    'http://127.0.0.1/cover.jpg',
+    'http://localhost/cover.jpg',
+    'http://10.0.0.8/cover.jpg',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/cover.jpg',
+    'http://[::ffff:127.0.0.1]/cover.jpg',
+    'https://0.0.0.0/cover.jpg',
+])
+def test_fetch_rejects_internal_addresses(app_module, tmp_path, image_url):
+    covers = app_module.CoverCache(str(tmp_path))
+    with pytest.raises(ValueError):
+        covers._fetch(image_url)
+
+
+@pytest.mark.parametrize('image_url', ['file:///etc/passwd', 'ftp://example.com/a.jpg', '/static/../app.py'])
+def test_fetch_rejects_other_sources(app_module, tmp_path, image_url):
+    covers = app_module.CoverCache(str(tmp_path), static_folder=app_module.app.static_folder)
+    with pytest.raises(ValueError):
+        covers._fetch(image_url)
+
+
+def test_redirect_to_internal_address_rejected(app_module, tmp_path, monkeypatch):
+    """Máy chủ ảnh (giả lập là public) chuyển hướng sang địa chỉ metadata nội bộ -> bị chặn"""
+    class Redirect(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(302)
+            self.send_header('Location', 'http://169.254.169.254/latest/meta-data/')
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(('127.0.0.1', 0), Redirect)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    real_getaddrinfo, real_connect = socket.getaddrinfo, socket.create_connection
+    connected = []
+
+    def fake_getaddrinfo(host, port, *args, **kwargs):
+        # images.example.com -> địa chỉ public (thực ra nối tới máy chủ test); host khác phân giải thật
+        if host == 'images.example.com':
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', ('93.184.216.34', port))]
+        return real_getaddrinfo(host, port, *args, **kwargs)
+
+    def fake_create_connection(address, *args, **kwargs):
+        connected.append(address)
+        return real_connect(('127.0.0.1', server.server_port), *args, **kwargs)
+
+    monkeypatch.setattr(socket, 'getaddrinfo', fake_getaddrinfo)
+    monkeypatch.setattr(socket, 'create_connection', fake_create_connection)
+    try:
+        with pytest.raises(ValueError, match='nội bộ'):
+            app_module.CoverCache(str(tmp_path))._fetch('http://images.example.com/cover.jpg')
+    finally:
+        server.shutdown()
+    assert connected == [('93.184.216.34', 80)]   # Chỉ nối tới trang đầu, không tới địa chỉ chuyển hướng
+
+
+def test_allowed_hosts(app_module, monkeypatch):
+    monkeypatch.setattr(app_module.CoverCache, 'ALLOWED_HOSTS', ['openlibrary.org'])
+    app_module.CoverCache.check_url('https://covers.openlibrary.org/b/id/1-L.jpg')
+    app_module.CoverCache.check_url('https://openlibrary.org/a.jpg')
+    with pytest.raises(ValueError):
+        app_module.CoverCache.check_url('https://evilopenlibrary.org/a.jpg')
+    with pytest.raises(ValueError):
+        app_module.CoverCache.check_url('https://example.com/a.jpg')
+
+
+def test_oversized_image_rejected_before_decoding(app_module, tmp_path, monkeypatch):
+    covers = app_module.CoverCache(str(tmp_path), static_folder=app_module.app.static_folder)
+    monkeypatch.setattr(covers, 'MAX_PIXELS', 100)
+    monkeypatch.setattr(app_module.ImageOps, 'exif_transpose', lambda image: pytest.fail("đã giải mã ảnh"))
+    with pytest.raises(ValueError, match='điểm ảnh'):
+        covers.process('/static/' + app_module.CoverCache.DEFAULT)
+    assert covers.lookup('/static/' + app_module.CoverCache.DEFAULT) is None
+
+
+def test_failed_urls_are_bounded(app_module, tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(app_module.time, 'monotonic', lambda: clock[0])
+    covers = app_module.CoverCache(str(tmp_path))
+    monkeypatch.setattr(covers, 'MAX_FAILED', 3)
+    monkeypatch.setattr(covers, 'process', lambda image_url: 1 / 0)
+
+    for i in range(5):
+        covers._run(f'https://example.com/{i}.jpg')
+    assert list(covers._failed) == [f'https://example.com/{i}.jpg' for i in (2, 3, 4)]
+    assert covers.request('https://example.com/4.jpg') is None   # Chưa tới lúc thử lại
+
+    clock[0] += covers.RETRY_AFTER + 1
+    covers._run('https://example.com/5.jpg')
+    assert list(covers._failed) == ['https://example.com/5.jpg']   # Mục hết hạn bị dọn khi đầy
@@ -0,0 +1,28 @@
+# ============================================
+# TEST: /metrics
+# ============================================
+
+
+def test_metrics_open_to_localhost_only(client):
+    assert client.get('/metrics').status_code == 200
+    assert client.get('/metrics', environ_base={'REMOTE_ADDR': '10.0.0.5'}).status_code == 404
+    # Proxy chạy cùng máy: request đến từ 127.0.0.1 nhưng người gọi thật ở ngoài
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.7'}).status_code == 404
+
+
+def test_metrics_token(client, monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 's3cret')
+    remote = {'REMOTE_ADDR': '10.0.0.5'}
+    assert client.get('/metrics', environ_base=remote).status_code == 401
+    assert client.get('/metrics', environ_base=remote,
+                      headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    assert client.get('/metrics', environ_base=remote,
+                      headers={'Authorization': 'Bearer s3cret'}).status_code == 200
+
+
+def test_query_series_labelled_by_hash(client, make_book):
+    make_book()
+    body = client.get('/metrics').get_data(as_text=True)
+    series = [line for line in body.splitlines() if line.startswith('library_db_query_duration_seconds_count')]
+    assert series
+    assert all('SELECT' not in line and 'INSERT' not in line for line in series)
@@ -0,0 +1,111 @@
+# ============================================
+# TEST: FILE DATABASE SQLITE / MIGRATION
+# ============================================
+
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import query
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def tables(path):
+    conn = sqlite3.connect(path)
+    try:
+        return sorted(row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'index')"))
+    finally:
+        conn.close()
+
+
+def migrate(engine):
+    conn = engine.connection()
+    try:
+        return engine.migrate(conn)
+    finally:
+        conn.close()
+
+
+def test_open_creates_missing_directory(app_module, tmp_path):
+    path = tmp_path / 'instance' / 'library.db'
+    engine = app_module.SQLiteEngine(str(path))
+    conn = engine.connection()
+    conn.close()
+    assert path.exists()
+
+
+def test_sqlite_migrations_idempotent(app_module, tmp_path):
+    path = str(tmp_path / 'library.db')
+    engine = app_module.SQLiteEngine(path)
+    latest = app_module.SQLiteEngine.latest()
+
+    assert migrate(engine) == list(range(1, latest + 1))
+    schema = tables(path)
+    assert migrate(engine) == []
+    assert migrate(app_module.SQLiteEngine(path)) == []   # Process khác mở lại cùng file
+    assert tables(path) == schema
+
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT version FROM schema_migrations ORDER BY version").fetchall() == \
+        [(v,) for v in range(1, latest + 1)]
+    conn.close()
+
+
+def test_sqlite_migrations_upgrade_legacy_file(app_module, tmp_path):
+    """File library.db cũ (chưa có schema_migrations, thiếu cột quá hạn) được nâng cấp, giữ dữ liệu"""
+    path = str(tmp_path / 'legacy.db')
+    shutil.copyfile(os.path.join(REPO, 'library.db'), path)
+    conn = sqlite3.connect(path)
+    books_before = conn.execute("SELECT COUNT(*) FROM books").fetchone()[0]
+    conn.close()
+
+    engine = app_module.SQLiteEngine(path)
+    assert migrate(engine) == list(range(1, app_module.SQLiteEngine.latest() + 1))
+    assert migrate(engine) == []
+
+    conn = sqlite3.connect(path)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(transactions)")}
+    assert {'late_days', 'fine'} <= columns
+    assert conn.execute("SELECT COUNT(*) FROM books").fetchone()[0] == books_before
+    conn.close()
+
+
+def test_init_database_rerun_is_noop(app_module):
+    """Database của phiên test đã ở phiên bản mới nhất: chạy lại không áp dụng gì, không thêm dữ liệu mẫu"""
+    users = query("SELECT COUNT(*) FROM users")[0][0]
+    conn = app_module.library_system.db.get_connection()
+    try:
+        if app_module.DatabaseManager.SQLITE:
+            assert app_module.SQLITE_ENGINE.migrate(conn) == []
+        else:
+            assert app_module.SchemaMigrations.migrate(conn) == []
+            assert app_module.SchemaMigrations.current_version(conn) == app_module.SchemaMigrations.latest()
+    finally:
+        conn.close()
+    app_module.library_system.db.init_database()
+    assert query("SELECT COUNT(*) FROM users")[0][0] == users
+
+
+@pytest.mark.parametrize('statement', [
+    "SELECT COUNT(*) FROM waitlist",
+    "SELECT COUNT(*) FROM library_stats",
+    "SELECT late_days, fine FROM transactions LIMIT 1",
+])
+def test_latest_schema_present(statement):
+    query(statement)
+
+
+def test_translate_leaves_string_literals_alone(app_module):
+    sql, write = app_module.SQLiteEngine.translate(
+        "UPDATE books b SET description = 'x::text FOR UPDATE, UPDATE a b; 50%%' "
+        "WHERE b.id = %s::int AND b.title <> 'it''s %s'")
+    assert sql == ("UPDATE books AS b SET description = 'x::text FOR UPDATE, UPDATE a b; 50%' "
+                   "WHERE b.id = ? AND b.title <> 'it''s %s'")
+    assert write
+
+    sql, write = app_module.SQLiteEngine.translate("SELECT 'FOR UPDATE' FROM books", has_params=False)
+    assert sql == "SELECT 'FOR UPDATE' FROM books"
+    assert not write
@@ -0,0 +1,71 @@
+# ============================================
+# TEST: PHÂN TRANG KEYSET (cursor)
+# ============================================
+
+from conftest import query
+
+
+def all_ids():
+    return [row[0] for row in query("SELECT id FROM books ORDER BY created_at DESC, id DESC")]
+
+
+def test_walk_forward_and_back(app_module, make_book):
+    for _ in range(5):
+        make_book()
+    system = app_module.library_system
+    expected = all_ids()
+
+    pages, cursor = [], None
+    while True:
+        page = system.get_all_books(after=cursor, limit=2)
+        pages.append(page)
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    walked = [book['id'] for page in pages for book in page['books']]
+    assert walked == expected   # Không trùng, không sót, đúng thứ tự mới nhất trước
+    assert pages[0]['prev_cursor'] is None
+    assert all(len(page['books']) == 2 for page in pages[:-1])
+
+    # Lùi từ trang 2 về trang 1
+    back = system.get_all_books(before=pages[1]['prev_cursor'], limit=2)
+    assert [b['id'] for b in back['books']] == [b['id'] for b in pages[0]['books']]
+    assert back['next_cursor'] == pages[0]['next_cursor']
+
+
+def test_same_timestamp_split_by_id(app_module, make_book):
+    """Nhiều sách cùng created_at: id phân định thứ tự, trang sau không lặp lại trang trước"""
+    ids = [make_book() for _ in range(4)]
+    moment = app_module.datetime(2000, 1, 1, 12, 0, 0)
+    query("UPDATE books SET created_at = %s WHERE id = ANY(%s)", (moment, ids))
+    app_module.CATALOG.touch()
+
+    system = app_module.library_system
+    start = system.encode_cursor(moment, max(ids) + 1)   # Ngay trước nhóm sách cùng thời điểm
+    first = system.get_all_books(after=start, limit=3)
+    second = system.get_all_books(after=first['next_cursor'], limit=3)
+    assert [b['id'] for b in first['books']] == sorted(ids, reverse=True)[:3]
+    assert second['books'][0]['id'] == min(ids)
+
+
+def test_cursor_round_trip(app_module):
+    system = app_module.LibrarySystem
+    moment = app_module.datetime(2024, 5, 6, 7, 8, 9, 123000)
+    assert system.decode_cursor(system.encode_cursor(moment, 42)) == (moment, 42)
+
+
+def test_invalid_cursor_falls_back_to_first_page(app_module, make_book):
+    make_book()
+    system = app_module.library_system
+    first = system.get_all_books(limit=3)
+    assert system.decode_cursor('không-hợp-lệ') is None
+    assert system.get_all_books(after='không-hợp-lệ', limit=3)['books'] == first['books']
+
+
+def test_page_size_clamped(app_module, make_book):
+    make_book()
+    system = app_module.library_system
+    assert len(system.get_all_books(limit=-5)['books']) == 1
+    assert len(system.get_all_books(limit=0)['books']) == min(system.BOOKS_PAGE_SIZE, len(all_ids()))
+    assert len(system.get_all_books(limit=10_000)['books']) <= system.BOOKS_MAX_PAGE_SIZE
@@ -0,0 +1,17 @@
+# ============================================
+# TEST: TÌM KIẾM SÁCH
+# ============================================
+
+import random
+import uuid
+
+
+def test_four_digit_query_matches_year_and_text(app_module, admin):
+    number = str(random.randint(1100, 1899))   # Năm hiếm -> ít sách khác trùng
+    tag = uuid.uuid4().hex[:8]
+    assert admin.add_book(f"{number} Tiểu thuyết {tag}", 'Tác giả Test', 'Test', 2020, 1)[0]
+    assert admin.add_book(f"Sách cổ {tag}", 'Tác giả Test', 'Test', int(number), 1)[0]
+
+    titles = [book['title'] for book in app_module.library_system.search_books(number)['results']]
+    assert f"{number} Tiểu thuyết {tag}" in titles
+    assert f"Sách cổ {tag}" in titles
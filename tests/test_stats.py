@@ -0,0 +1,59 @@
+# ============================================
+# TEST: BỘ ĐẾM THỐNG KÊ (library_stats)
+# ============================================
+
+import pytest
+
+from conftest import borrow
+
+
+@pytest.fixture
+def slot_draws(app_module, monkeypatch):
+    """Ghi lại các slot được chọn (mỗi lần random_slot() là 1 lần chọn)"""
+    draws = []
+    real = app_module.LibraryStats.random_slot.__func__
+
+    def record(cls):
+        draws.append(real(cls))
+        return draws[-1]
+
+    monkeypatch.setattr(app_module.LibraryStats, 'random_slot', classmethod(record))
+    return draws
+
+
+def test_return_uses_one_slot(make_user, make_book, slot_draws):
+    user = make_user()
+    book_id = make_book(quantity=1)
+    transaction_id = borrow(user, book_id)
+    make_user().join_waitlist(book_id)
+
+    slot_draws.clear()
+    assert user.return_book(transaction_id)[0]
+    assert len(slot_draws) == 1
+
+
+def test_bulk_return_uses_one_slot(admin, make_user, make_book, slot_draws):
+    book_id = make_book(quantity=3)
+    transactions = [borrow(make_user(), book_id) for _ in range(3)]
+
+    slot_draws.clear()
+    admin.return_books(transactions)
+    assert len(slot_draws) == 1
+
+
+def test_counters_match_tables(app_module, admin, make_user, make_book):
+    conn = app_module.library_system.db.get_connection()
+    try:
+        app_module.LibraryStats.reconcile(conn)   # Các test khác có thể sửa tay bảng -> đưa về đúng trước
+
+        user = make_user()
+        book_id = make_book(quantity=2)
+        transaction_id = borrow(user, book_id)
+        borrow(make_user(), book_id)
+        make_user().join_waitlist(book_id)
+        user.return_book(transaction_id)            # Bản trả được giữ cho người chờ
+        admin.return_books([borrow(user, make_book(quantity=4))])
+
+        assert app_module.LibraryStats.reconcile(conn) == {}
+    finally:
+        conn.close()
@@ -0,0 +1,207 @@
+# ============================================
+# TEST: GIỎ HÀNG / TRẢ SÁCH / HÀNG CHỜ FIFO
+# ============================================
+
+import threading
+
+import pytest
+
+from conftest import available, borrow, query, waitlist_status
+
+
+def test_checkout_and_return_restore_available(make_user, make_book):
+    user = make_user()
+    book_id = make_book(quantity=2)
+
+    transaction_id = borrow(user, book_id)
+    assert available(book_id) == 1
+    assert user.get_cart() == []
+
+    ok, message = user.return_book(transaction_id)
+    assert ok, message
+    assert available(book_id) == 2
+    assert not user.return_book(transaction_id)[0]  # Trả lần 2 -> không tìm thấy giao dịch
+
+
+def test_out_of_stock_stays_in_cart(make_user, make_book):
+    first, second = make_user(), make_user()
+    book_id = make_book(quantity=1)
+
+    assert second.add_to_cart(book_id)[0]
+    borrow(first, book_id)
+    second.checkout()
+    assert available(book_id) == 0
+    assert len(second.get_cart()) == 1
+
+
+def test_return_holds_copy_for_first_waiter(make_user, make_book):
+    borrower = make_user()
+    book_id = make_book(quantity=1)
+    transaction_id = borrow(borrower, book_id)
+
+    waiters = [make_user() for _ in range(3)]
+    for waiter in waiters:
+        assert waiter.join_waitlist(book_id)[0]
+    assert not waiters[0].join_waitlist(book_id)[0]  # Không xếp hàng 2 lần
+
+    assert borrower.return_book(transaction_id)[0]
+    status = waitlist_status(book_id)
+    assert [status[w.user_id] for w in waiters] == ['held', 'waiting', 'waiting']
+    assert available(book_id) == 0
+
+
+def test_concurrent_returns_assign_holds_fifo(app_module, make_user, make_book):
+    """
+    2 lượt trả cùng 1 cuốn chồng lên nhau, hàng chờ có N người
+    - Lượt 1 giữ transaction (và khóa người chờ) cho tới khi lượt 2 đã chạy
+    - 2 bản được giữ cho đúng 2 người đầu hàng, theo thứ tự đăng ký
+    - available không tăng vì bản nào cũng đã có người chờ
+    """
+    waiting = 4
+    book_id = make_book(quantity=2)
+    for user in (make_user(), make_user()):
+        borrow(user, book_id)
+    waiters = [make_user() for _ in range(waiting)]
+    for waiter in waiters:
+        assert waiter.join_waitlist(book_id)[0]
+
+    db = app_module.library_system.db
+    held = []
+
+    def release():
+        conn = db.get_connection()
+        try:
+            held.append(app_module.Waitlist.release_copy(conn.cursor(), book_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    first = db.get_connection()
+    try:
+        held.append(app_module.Waitlist.release_copy(first.cursor(), book_id))
+        second = threading.Thread(target=release)
+        second.start()
+        # PostgreSQL: lượt 2 bỏ qua người đã bị khóa và chạy xong ngay
+        # SQLite: lượt 2 chờ khóa ghi tới khi lượt 1 commit
+        second.join(timeout=1)
+        first.commit()
+    finally:
+        first.close()
+    second.join()
+
+    assert held == [w.user_id for w in waiters[:2]]
+    status = waitlist_status(book_id)
+    assert [status[w.user_id] for w in waiters] == ['held', 'held'] + ['waiting'] * (waiting - 2)
+    assert available(book_id) == 0
+
+
+def test_concurrent_returns_free_only_unclaimed_copies(make_user, make_book):
+    """3 lượt trả song song, chỉ 1 người chờ -> 1 bản giữ cho người đó, available + 2"""
+    borrowers = [make_user() for _ in range(3)]
+    book_id = make_book(quantity=3)
+    transactions = [borrow(user, book_id) for user in borrowers]
+    waiter = make_user()
+    assert waiter.join_waitlist(book_id)[0]
+
+    barrier = threading.Barrier(len(borrowers))
+    results = []
+
+    def give_back(user, transaction_id):
+        barrier.wait()
+        results.append(user.return_book(transaction_id))
+
+    threads = [threading.Thread(target=give_back, args=pair) for pair in zip(borrowers, transactions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert all(ok for ok, _ in results), results
+    assert waitlist_status(book_id) == {waiter.user_id: 'held'}
+    assert available(book_id) == 2
+
+
+def test_bulk_return_releases_copies_in_queue_order(admin, make_user, make_book):
+    borrowers = [make_user() for _ in range(3)]
+    book_id = make_book(quantity=3)
+    transactions = [borrow(user, book_id) for user in borrowers]
+    waiters = [make_user() for _ in range(2)]
+    for waiter in waiters:
+        assert waiter.join_waitlist(book_id)[0]
+
+    results = admin.return_books(transactions)
+    assert len(results) == 3
+    status = waitlist_status(book_id)
+    assert [status[w.user_id] for w in waiters] == ['held', 'held']
+    assert available(book_id) == 1
+    assert query("SELECT COUNT(*) FROM transactions WHERE book_id = %s AND status = 'borrowed'",
+                 (book_id,))[0][0] == 0
+
+
+def admin_client(app_module):
+    client = app_module.app.test_client()
+    with client.session_transaction() as sess:
+        info, _ = app_module.library_system.login('admin', 'admin123')
+        sess['user'] = info
+    return client
+
+
+@pytest.mark.parametrize('payload', [
+    {'transaction_ids': '12'},
+    {'transaction_ids': ['1', '2']},
+    {'transaction_ids': [1.5]},
+    {'transaction_ids': [True]},
+    {},
+    [1, 2],
+])
+def test_bulk_return_route_rejects_non_integer_lists(app_module, payload):
+    response = admin_client(app_module).post('/admin/return-books', json=payload)
+    assert response.status_code == 400
+
+
+def test_bulk_return_route(app_module, make_user, make_book):
+    book_id = make_book(quantity=2)
+    transactions = [borrow(make_user(), book_id) for _ in range(2)]
+    response = admin_client(app_module).post('/admin/return-books', json={'transaction_ids': transactions})
+    assert response.status_code == 200
+    assert response.get_json()['returned'] == 2
+    assert available(book_id) == 2
+
+    limit = app_module.Admin.BULK_RETURN_MAX
+    too_many = admin_client(app_module).post('/admin/return-books', json={'transaction_ids': list(range(limit + 1))})
+    assert too_many.status_code == 400
+
+
+def test_add_stock_serves_waitlist_first(app_module, make_user, make_book):
+    book_id = make_book(quantity=1)
+    borrow(make_user(), book_id)
+    waiters = [make_user() for _ in range(2)]
+    for waiter in waiters:
+        assert waiter.join_waitlist(book_id)[0]
+
+    response = admin_client(app_module).post(f'/admin/add_stock/{book_id}', data={'quantity_added': 3})
+    assert response.status_code == 302
+    status = waitlist_status(book_id)
+    assert [status[w.user_id] for w in waiters] == ['held', 'held']
+    assert available(book_id) == 1
+    assert query("SELECT quantity FROM books WHERE id = %s", (book_id,))[0][0] == 4
+
+
+def test_cancel_held_copy_passes_to_next_and_claim(make_user, make_book):
+    borrower = make_user()
+    book_id = make_book(quantity=1)
+    transaction_id = borrow(borrower, book_id)
+    first, second = make_user(), make_user()
+    for waiter in (first, second):
+        assert waiter.join_waitlist(book_id)[0]
+    assert borrower.return_book(transaction_id)[0]
+
+    assert first.cancel_waitlist(book_id)[0]
+    assert not first.cancel_waitlist(book_id)[0]
+    assert waitlist_status(book_id)[second.user_id] == 'held'
+
+    assert not first.claim_hold(book_id)[0]
+    assert second.claim_hold(book_id)[0]
+    assert waitlist_status(book_id)[second.user_id] == 'claimed'
+    assert len(second.get_borrowed_books()) == 1
+    assert available(book_id) == 0